@@ -1,9 +1,44 @@
+import sys, time
+# misura dell'avvio: parte prima di qualsiasi import dell'app
+_RUN_START = time.perf_counter()
+_COLD_START = "ui_components" not in sys.modules
+
 import os, streamlit as st
 import asyncio
 import pandas as pd
 
 from ui_components import login_view, ui_sidebar, main_view, wheel_metrics_view
-from data_store import fetch_trades, fetch_cashflows
+from session_loader import load_session_data
+
+_IMPORTS_DONE = time.perf_counter()
+
+# moduli pesanti che non devono essere caricati per mostrare il login
+HEAVY_MODULES = ("supabase", "postgrest", "httpx", "yfinance", "plotly", "requests")
+
+
+def record_startup_time(view: str) -> None:
+    """
+    Registra in sessione i tempi della prima esecuzione dello script (import +
+    render di `view`) e i moduli pesanti già caricati. `cold` indica la prima
+    esecuzione nel processo, con gli import non ancora in cache.
+    Con STARTUP_TIMING=1 i tempi sono anche scritti su stderr e mostrati a video.
+    """
+    if "startup_timing" in st.session_state:
+        return
+    now = time.perf_counter()
+    timing = {
+        "view": view,
+        "cold": _COLD_START,
+        "imports_ms": round((_IMPORTS_DONE - _RUN_START) * 1000, 1),
+        "render_ms": round((now - _IMPORTS_DONE) * 1000, 1),
+        "total_ms": round((now - _RUN_START) * 1000, 1),
+        "heavy_modules": [m for m in HEAVY_MODULES if m in sys.modules],
+    }
+    st.session_state.startup_timing = timing
+    if os.getenv("STARTUP_TIMING"):
+        print(f"startup_timing {timing}", file=sys.stderr)
+        st.caption(f"⏱️ Avvio {timing['total_ms']} ms (import {timing['imports_ms']} ms, "
+                   f"render {timing['render_ms']} ms{', cold' if timing['cold'] else ''})")
 
 
 def main():
@@ -12,14 +47,18 @@ def main():
     # 1) Se l'utente non è loggato, mostra la vista di login e ferma l'esecuzione
     if "user_id" not in st.session_state:
         login_view()
+        record_startup_time("login")
         return
 
     # 2) Se l'utente è loggato ma i suoi dati non sono ancora stati caricati, caricali ora.
     #    Questo blocco viene eseguito solo una volta dopo il login.
     if "trades" not in st.session_state:
         with st.spinner("Caricamento dati utente..."):
-            st.session_state.trades = fetch_trades()
-            st.session_state.cash_flows = fetch_cashflows()
+            # Trade e flussi (sync incrementale), prefetch prezzi e risk-free rate in parallelo
+            data = asyncio.run(load_session_data(st.session_state.user_id))
+            st.session_state.trades = data["trades"]
+            st.session_state.cash_flows = data["cash_flows"]
+            st.session_state.trade_table = data["trade_table"]
             # Inizializza le altre variabili di stato necessarie
             st.session_state.last_trade_count = 0
             st.session_state.portfolio_history = pd.DataFrame()
@@ -1,48 +1,107 @@
-from postgrest import APIError
-import requests
-from bs4 import BeautifulSoup
+import os
 import streamlit as st
-import yfinance as yf
 import pandas as pd
 from datetime import timedelta, date
-import streamlit as st
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+from fetch_scheduler import FetchScheduler
+from price_provider import NoDataError, PriceProvider, provider_from_env
+from price_store import PriceStore
+from rate_store import ESTR, RateStore
+
+@st.cache_resource
+def get_price_store() -> PriceStore:
+    """Archivio prezzi su disco, unico per processo e condiviso tra le sessioni."""
+    return PriceStore()
+
+
+@st.cache_resource
+def get_price_provider() -> PriceProvider:
+    """Provider dei prezzi scelto con PRICE_PROVIDER (yfinance o fixture:<path>)."""
+    return provider_from_env()
+
+
+class _TransientFailure(Exception):
+    """Download con errori di rete o throttling: il risultato parziale non va in cache."""
+
+    def __init__(self, frame: pd.DataFrame, failures: Dict[str, Exception]):
+        super().__init__(sorted(failures))
+        self.frame = frame
+        self.failures = failures
+
+
+# la coda di oggi viene riscaricata al massimo una volta l'ora
+@st.cache_data(ttl=3600)
+def download_prices(symbols: tuple, start: date, end: date) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    """
+    Download dal provider tramite FetchScheduler (rate limit, retry con backoff,
+    concorrenza adattiva): (frame allineato, errori per simbolo).
+    Ogni retry dello scheduler interroga davvero il provider; in cache finisce
+    solo l'esito definitivo, compresi i simboli senza dati (NoDataError).
+    """
+    provider = get_price_provider()
+    scheduler = FetchScheduler(lambda syms, s, e: provider.fetch_many(syms, s, e))
+    frame, failed = asyncio.run(scheduler.run(list(symbols), start, end))
+    if any(not isinstance(e, NoDataError) for e in failed.values()):
+        # le eccezioni non entrano in cache: si riprova alla prossima richiesta
+        raise _TransientFailure(frame, failed)
+    return frame, failed
 
-@st.cache_data(ttl=86400)
-def fetch_symbol_data(symbol: str, start: date, end: date) -> pd.DataFrame:
-    ticker = yf.Ticker(symbol)
-    hist = ticker.history(start=start - timedelta(days=7),
-                          end=end + timedelta(days=1))
-    if hist.empty: return pd.DataFrame()
-    hist.index = hist.index.tz_localize(None).date
-    return hist[['Close']]
 
+def scheduled_download(symbols: List[str], start: date, end: date,
+                       failures: Optional[Dict[str, Exception]] = None) -> pd.DataFrame:
+    """
+    Scarica `symbols` (vedi download_prices). I simboli falliti o senza dati
+    finiscono in `failures` e non compaiono come colonne del frame restituito.
+    """
+    try:
+        frame, failed = download_prices(tuple(symbols), start, end)
+    except _TransientFailure as e:
+        frame, failed = e.frame, e.failures
+    if failures is not None:
+        failures.update(failed)
+    return frame
+
+
+def fetch_price_frame(symbols: List[str], start: date, end: date,
+                      failures: Optional[Dict[str, Exception]] = None) -> pd.DataFrame:
+    """
+    Chiusure (date × simboli) fra start ed end inclusi. Con un provider remoto
+    passa dall'archivio su disco, che scarica solo gli intervalli mancanti.
+    """
+    if not symbols:
+        return pd.DataFrame()
+    provider = get_price_provider()
+    if not provider.persistent_cache:
+        return provider.fetch_many(list(symbols), start, end)
+    return get_price_store().get_many(list(symbols), start, end, scheduled_download, failures)
 
 
 async def fetch_all_historical_data(symbols: List[str],
                                     start: date, end: date
-                                   ) -> Dict[str, pd.DataFrame]:
-    all_data = {}
-    progress = st.progress(0)
+                                   ) -> pd.DataFrame:
+    """
+    Chiusure di tutti i `symbols` da una settimana prima di `start` fino a `end`,
+    in un unico frame allineato (indice date, una colonna per simbolo).
+    """
     status = st.empty()
-    #potenzialmente più lento ma con 10 va in range limit
-    with ThreadPoolExecutor(3) as ex:
-        loop = asyncio.get_event_loop()
-        tasks = [
-          loop.run_in_executor(ex, fetch_symbol_data, sym, start, end)
-          for sym in symbols
-        ]
-        for i, fut in enumerate(asyncio.as_completed(tasks)):
-            df = await fut
-            sym = symbols[i]
-            if not df.empty:
-                all_data[sym] = df
-            progress.progress((i+1)/len(symbols))
-            status.text(f"{i+1}/{len(symbols)}: {sym}")
-    progress.empty(); status.empty()
-    return all_data
+    status.text(f"Download prezzi per {len(symbols)} simboli…")
+    failures: Dict[str, Exception] = {}
+    frame = await asyncio.to_thread(
+        fetch_price_frame, symbols, start - timedelta(days=7), end, failures
+    )
+    status.empty()
+    # i simboli senza alcun prezzo non diventano colonne vuote: restano "mancanti"
+    # e il processore li richiede di nuovo al prossimo aggiornamento
+    frame = frame.dropna(axis=1, how='all')
+    missing = set(failures) | {s for s in symbols if s not in frame}
+    if missing:
+        st.warning(
+            "Prezzi non disponibili per: " + ", ".join(sorted(missing))
+            + ". Verranno richiesti di nuovo al prossimo aggiornamento."
+        )
+    return frame
 
 def fetch_price_series(
     ticker: str,
@@ -50,59 +109,60 @@ def fetch_price_series(
     end: date
 ) -> pd.Series:
     """
-    Scarica da Yahoo Finance la serie dei prezzi di chiusura 
-    adjusted per `ticker` fra start (incluso) ed end (escluso).
+    Serie dei prezzi di chiusura adjusted per `ticker` fra start (incluso)
+    ed end (escluso), dallo stesso provider/archivio dello storico.
     Ritorna pd.Series indexed by date.
     """
-    df = yf.Ticker(ticker).history(
-        start=start.isoformat(),
-        end=end.isoformat(),
-        auto_adjust=True
-    )
-    # se non ci sono dati, ritorna serie vuota
-    if df.empty:
+    frame = fetch_price_frame([ticker], start, end - timedelta(days=1))
+    if ticker not in frame or frame[ticker].dropna().empty:
         return pd.Series(dtype=float)
-    return df["Close"].rename(ticker)
+    series = frame[ticker].dropna()
+    series.index = pd.to_datetime(series.index)
+    return series.rename(ticker)
 
-@st.cache_data(ttl=86400) # Mettiamo in cache per 1 giorno
-def fetch_risk_free_rate() -> float:
+
+@st.cache_resource
+def get_rate_store() -> RateStore:
+    """Archivio su disco dei tassi risk-free giornalieri, unico per processo."""
+    return RateStore()
+
+
+def refresh_risk_free_series() -> Optional[float]:
     """
-    Recupera l'ultimo tasso €STR dalla pagina della BCE usando requests e BeautifulSoup,
-    e lo converte in formato decimale.
+    Aggiorna lo storico €STR (solo le osservazioni nuove, al massimo una volta
+    al giorno) dalla fonte in ESTR_SOURCE: "ecb" (default) o "file:<percorso>".
+    Va chiamata fuori dal percorso delle metriche (es. al login); se la rete non
+    è disponibile restano valide le osservazioni già salvate.
+    Restituisce l'ultimo tasso disponibile.
     """
-    URL = "https://www.ecb.europa.eu/stats/financial_markets_and_interest_rates/euro_short-term_rate/html/index.en.html"
-    
-    # È buona norma usare un User-Agent per sembrare un browser reale
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-
+    store = get_rate_store()
     try:
-        # Esegui la richiesta GET per ottenere il contenuto HTML della pagina
-        response = requests.get(URL, headers=headers)
-        response.raise_for_status()  # Genera un errore se la richiesta fallisce (es. 404, 500)
-
-        # Crea un oggetto BeautifulSoup per parsare l'HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Trova l'elemento <dd> con la classe 'value' che contiene il tasso.
-        # Questa è la parte cruciale che dipende dalla struttura della pagina HTML.
-        rate_element = soup.find('dd', class_='value')
-
-        if rate_element:
-            rate_str = rate_element.get_text(strip=True)
-            rate_float = float(rate_str)
-            return rate_float / 100  # Converte in decimale
-        else:
-            st.warning("Non è stato possibile trovare l'elemento del risk-free rate nella pagina. Verrà usato un valore di default.")
-            return 0.05  # Fallback
-
-    except requests.exceptions.RequestException as e:
-        st.error(f"Errore di rete durante il recupero del risk-free rate: {e}")
-        return 0.05  # Fallback
+        store.refresh(ESTR, os.getenv("ESTR_SOURCE", "ecb"))
     except Exception as e:
-        st.error(f"Errore imprevisto durante il recupero del risk-free rate: {e}")
-        return 0.05  # Fallback
-    except Exception as e:
-        st.error(f"Errore durante il recupero del risk-free rate: {e}")
-        return 0.05 # Valore di fallback in caso di errore
+        st.warning(f"Aggiornamento €STR non riuscito, uso i dati salvati: {e}")
+    return last_risk_free_rate()
+
+
+def last_risk_free_rate() -> Optional[float]:
+    """Ultimo tasso €STR salvato (senza accesso alla rete), None se l'archivio è vuoto."""
+    today = date.today()
+    last = get_rate_store().read(ESTR, today, today)
+    return float(last.iloc[-1]) if not last.empty else None
+
+
+def risk_free_version() -> Optional[date]:
+    """Ultima osservazione €STR salvata: cambia solo quando arrivano dati nuovi."""
+    return get_rate_store().last_date(ESTR)
+
+
+def fetch_risk_free_series(start: date, end: date) -> pd.Series:
+    """
+    Tasso risk-free annuo (decimale) per ogni giorno di calendario fra start ed end,
+    letto solo dall'archivio locale e propagato in avanti su weekend e festivi.
+    Serie vuota se l'archivio non ha ancora dati.
+    """
+    stored = get_rate_store().read(ESTR, start, end)
+    if stored.empty:
+        return stored
+    days = pd.date_range(start, end, freq="D").date
+    return stored.reindex(stored.index.union(days)).ffill().bfill().reindex(days)
@@ -3,16 +3,24 @@
 import os
 from uuid import uuid4
 from datetime import date, datetime
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+import pandas as pd
 import streamlit as st
-from postgrest import APIError
-from supabase import create_client
+
+from sync_store import SnapshotStore
+from trade_store import TradeTable
+from write_queue import WriteBehindQueue
 
 # ——————————————————————————————————————————————
 # 1) Init Supabase client con env vars o st.secrets
 # ——————————————————————————————————————————————
-def _get_supabase_client():
+# Il client viene creato al primo uso e condiviso da tutte le sessioni del
+# processo: la pagina di login non paga import e connessione di supabase.
+@st.cache_resource
+def get_supabase_client():
+    from supabase import create_client
+
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY")
     if not url or not key:
@@ -27,8 +35,6 @@ def _get_supabase_client():
         )
     return create_client(url, key)
 
-sb = _get_supabase_client()
-
 
 # ——————————————————————————————————————————————
 # 2) Helper generici
@@ -44,9 +50,11 @@ def get_user_id() -> str:
     return uid
 
 def find_user_by_email(email: str) -> str | None:
+    # postgrest (con httpx e pydantic) si importa solo qui, dopo il render del login
+    from postgrest import APIError
     try:
         resp = (
-            sb.table("users")
+            get_supabase_client().table("users")
               .select("id")
               .eq("email", email)
               .single()
@@ -61,7 +69,7 @@ def find_user_by_email(email: str) -> str | None:
 def create_user(email: str) -> str:
     """Crea un nuovo user e ritorna il suo id."""
     new_id = str(uuid4())
-    sb.table("users").insert({"id": new_id, "email": email}).execute()
+    get_supabase_client().table("users").insert({"id": new_id, "email": email}).execute()
     return new_id
 
 def _serialize_dates(obj: Dict) -> Dict:
@@ -76,94 +84,238 @@ def _serialize_dates(obj: Dict) -> Dict:
 # 3) Fetch
 # ——————————————————————————————————————————————
 
-def fetch_trades() -> List[Dict]:
-    """Carica i trade SOLO per l'utente loggato."""
-    try:
-        user_id = get_user_id()  # Prende l'ID dell'utente dalla sessione
+# Righe per pagina: PostgREST tronca comunque al suo max-rows, per questo la
+# paginazione si ferma solo alla prima pagina vuota e non a una pagina "corta"
+PAGE_SIZE = 1000
+# Colonne di sincronizzazione (vedi SnapshotStore)
+SYNC_COLUMN = "updated_at"
+DELETED_COLUMN = "deleted_at"
+
+
+def _parse_dates(rows: List[Dict]) -> List[Dict]:
+    for r in rows:
+        for k in ("date", "expiry"):
+            if isinstance(r.get(k), str) and r[k]:
+                r[k] = date.fromisoformat(r[k][:10])
+    return rows
+
+
+def iter_pages(table: str, user_id: str, page_size: int = PAGE_SIZE, client=None,
+               order_by: str = "date", since: Optional[str] = None,
+               columns: Optional[Iterable[str]] = None) -> Iterator[List[Dict]]:
+    """
+    Legge `table` per `user_id` a pagine con paginazione keyset su (order_by, id):
+    ogni richiesta riparte dopo l'ultima riga ricevuta, quindi il costo non
+    cresce con l'offset e nessuna riga viene persa se il server tronca la pagina.
+    `since` limita alle righe con `order_by >= since` (usato dal sync
+    incrementale su updated_at);
+    `columns` limita le colonne richieste (None = tutte);
+    `client` permette di iniettare un client compatibile (es. un fake in-process).
+    """
+    client = client or get_supabase_client()
+    # le colonne del cursore servono sempre, anche se non richieste
+    projection = ",".join(dict.fromkeys([order_by, "id"] + list(columns))) if columns else "*"
+    cursor: Optional[Tuple[str, str]] = None
+    while True:
+        query = (
+            client.table(table)
+                  .select(projection)
+                  .eq("user_id", user_id)
+        )
+        if since is not None:
+            query = query.gte(order_by, since)
+        if cursor:
+            last_key, last_id = cursor
+            # valori tra virgolette: i timestamp contengono caratteri riservati (":", ".")
+            query = query.or_(
+                f'{order_by}.gt."{last_key}",and({order_by}.eq."{last_key}",id.gt."{last_id}")'
+            )
         resp = (
-            sb.table("trades")
-              .select("*")
-              .eq("user_id", user_id)  # <-- FILTRO DECISIVO: user_id deve corrispondere
-              .order("date", desc=False)
-              .execute()
+            query.order(order_by, desc=False)
+                 .order("id", desc=False)
+                 .limit(page_size)
+                 .execute()
         )
         rows = resp.data or []
-        for r in rows:
-            if isinstance(r.get("date"), str):
-                r["date"] = date.fromisoformat(r["date"])
-            if isinstance(r.get("expiry"), str) and r["expiry"]:
-                r["expiry"] = date.fromisoformat(r["expiry"])
-        return rows
-    except APIError as e:
-        st.error(f"❌ Supabase APIError in fetch_trades(): {e.message}")
-        return []
-    except RuntimeError as e: # Gestisce il caso in cui l'utente non sia loggato
-        st.warning(f"Tentativo di fetch_trades senza utente loggato.")
-        return []
+        if not rows:
+            return
+        cursor = (str(rows[-1][order_by]), str(rows[-1]["id"]))
+        yield _parse_dates(rows)
+
+
+@st.cache_resource
+def get_snapshot_store() -> SnapshotStore:
+    """Snapshot locale delle righe utente, unico per processo."""
+    return SnapshotStore()
+
+
+def _high_water(rows: List[Dict], current: Optional[str]) -> Optional[str]:
+    stamps = [r[SYNC_COLUMN] for r in rows if r.get(SYNC_COLUMN)]
+    if current:
+        stamps.append(current)
+    return max(stamps, key=pd.Timestamp) if stamps else None
+
+
+def _snapshot_table(table: str, columns: Optional[Iterable[str]]) -> str:
+    # una proiezione diversa tiene uno snapshot a parte: le righe salvate
+    # hanno solo le colonne scaricate
+    return table if not columns else f"{table}[{','.join(sorted(columns))}]"
+
+
+def sync_pages(table: str, user_id: str, client=None, store: Optional[SnapshotStore] = None,
+               columns: Optional[Iterable[str]] = None,
+               page_size: int = PAGE_SIZE) -> Iterator[List[Dict]]:
+    """
+    Righe attive di `table` per `user_id`, aggiornate con un sync incrementale
+    e restituite a pagine ordinate per (date, id):
+     - senza snapshot (o senza colonna `updated_at`) si carica tutto e si salva lo snapshot;
+     - altrimenti si scaricano solo le righe con `updated_at` >= high-water mark,
+       fuse per `id`, togliendo quelle con `deleted_at` valorizzato.
+    Il costo di rete dipende quindi da quante righe sono cambiate, non dal totale.
+    `columns` limita le colonne scaricate e salvate (None = tutte).
+    """
+    from postgrest import APIError
+
+    store = store or get_snapshot_store()
+    tbl = _snapshot_table(table, columns)
+    fetched = list(columns) + [SYNC_COLUMN, DELETED_COLUMN] if columns else None
+    mark = store.high_water(user_id, tbl)
+    if mark is None:
+        try:
+            rows = [r for page in iter_pages(table, user_id, client=client, columns=fetched)
+                    for r in page]
+        except APIError:
+            if not fetched:
+                raise
+            # colonna proiettata assente nello schema (es. senza colonne di sync
+            # o senza la migrazione di was_assigned): si scarica la riga intera
+            rows = [r for page in iter_pages(table, user_id, client=client) for r in page]
+        store.replace(user_id, tbl, [r for r in rows if not r.get(DELETED_COLUMN)],
+                      _high_water(rows, None))
+    else:
+        try:
+            changes = [r for page in iter_pages(table, user_id, client=client,
+                                                order_by=SYNC_COLUMN, since=mark, columns=fetched)
+                       for r in page]
+        except APIError:
+            # schema senza colonne di sync: si ricade sul caricamento completo
+            store.clear_table(user_id, tbl)
+            yield from sync_pages(table, user_id, client, store, columns, page_size)
+            return
+        if changes:
+            store.apply(user_id, tbl, changes, _high_water(changes, mark), DELETED_COLUMN)
+    for page in store.pages(user_id, tbl, page_size):
+        yield _parse_dates(page)
+
 
+def sync_rows(table: str, user_id: str, client=None, store: Optional[SnapshotStore] = None,
+              columns: Optional[Iterable[str]] = None) -> List[Dict]:
+    """Righe attive di `table` come lista ordinata per (date, id) (vedi sync_pages)."""
+    return [r for page in sync_pages(table, user_id, client, store, columns) for r in page]
 
-def fetch_cashflows() -> List[Dict]:
-    """Carica i flussi di cassa SOLO per l'utente loggato."""
+
+def sync_trade_table(user_id: str, client=None, store: Optional[SnapshotStore] = None,
+                     columns: Optional[Iterable[str]] = None) -> Tuple[List[Dict], TradeTable]:
+    """
+    Trade dell'utente (sync incrementale) sia come lista di dict sia come
+    TradeTable: le pagine vanno nella tabella man mano che arrivano, senza
+    ricostruirla in un secondo momento dalla lista completa.
+    """
+    rows: List[Dict] = []
+
+    def collect():
+        for page in sync_pages("trades", user_id, client, store, columns or TRADE_COLUMNS):
+            rows.extend(page)
+            yield page
+
+    table = TradeTable.from_pages(collect())
+    return rows, table
+
+
+def sync_user_data(client=None) -> Tuple[List[Dict], List[Dict]]:
+    """(trade, flussi di cassa) dell'utente loggato tramite sync incrementale."""
+    from postgrest import APIError
     try:
-        user_id = get_user_id() # Prende l'ID dell'utente dalla sessione
-        resp = (
-            sb.table("cashflows")
-              .select("*")
-              .eq("user_id", user_id)  # <-- FILTRO DECISIVO: user_id deve corrispondere
-              .order("date", desc=False)
-              .execute()
-        )
-        rows = resp.data or []
-        for r in rows:
-            if isinstance(r.get("date"), str):
-                r["date"] = date.fromisoformat(r["date"])
-        return rows
+        user_id = get_user_id()
+        return (sync_rows("trades", user_id, client, columns=TRADE_COLUMNS),
+                sync_rows("cashflows", user_id, client, columns=CASHFLOW_COLUMNS))
     except APIError as e:
-        st.error(f"❌ Supabase APIError in fetch_cashflows(): {e.message}")
-        return []
+        st.error(f"❌ Supabase APIError in sync_user_data(): {e.message}")
+        return [], []
     except RuntimeError as e: # Gestisce il caso in cui l'utente non sia loggato
-        st.warning(f"Tentativo di fetch_cashflows senza utente loggato.")
-        return []
+        st.warning(f"Tentativo di sync_user_data senza utente loggato.")
+        return [], []
 
 
 # ——————————————————————————————————————————————
 # 4) Upsert
 # ——————————————————————————————————————————————
-def upsert_trade(trade: Dict):
-    record = trade.copy()
+# Campi presenti negli schemi public.trades e public.cashflows
+# (was_assigned: boolean nullable, esito dichiarato delle opzioni scadute,
+# vedi migrations/20261017_trades_was_assigned.sql)
+TRADE_FIELDS = {
+    "id", "user_id", "date", "symbol", "type", "quantity",
+    "strike", "expiry", "premium", "stock_price",
+    "commission", "multiplier", "note", "was_assigned"
+}
+CASHFLOW_FIELDS = {"id", "user_id", "date", "amount", "note"}
+# Colonne aggiunte da migrazioni: senza, l'upsert le omette (vedi upsert_rows)
+OPTIONAL_COLUMNS = {"trades": ("was_assigned",)}
+# Colonne lette dall'app (user_id è già il filtro della query)
+TRADE_COLUMNS = tuple(sorted(TRADE_FIELDS - {"user_id"}))
+CASHFLOW_COLUMNS = tuple(sorted(CASHFLOW_FIELDS - {"user_id"}))
+
+
+def _prepare_record(row: Dict, allowed: set) -> Dict:
+    # l'id resta anche sul dict in sessione, così il sync successivo lo riconosce
+    row.setdefault("id", str(uuid4()))
+    record = row.copy()
     record["user_id"] = get_user_id()
-    record.setdefault("id", str(uuid4()))
     record = _serialize_dates(record)
+    return {k: v for k, v in record.items() if k in allowed}
+
 
-    # Filtra solo i campi presenti nello schema public.trades
-    allowed = {
-        "id", "user_id", "date", "symbol", "type", "quantity",
-        "strike", "expiry", "premium", "stock_price",
-        "commission", "multiplier", "note"
-    }
-    record = {k: v for k, v in record.items() if k in allowed}
+def upsert_rows(table: str, records: List[Dict], client=None) -> None:
+    """
+    Upsert multi-riga in una sola richiesta. PostgREST vuole le stesse chiavi
+    su tutte le righe, quindi i campi mancanti vengono completati con None.
+    Se lo schema non ha ancora una colonna opzionale (migrazione non applicata)
+    il batch viene reinviato senza quella colonna invece di fallire.
+    Solleva APIError: la gestione degli errori è lasciata al chiamante.
+    """
+    from postgrest import APIError
 
+    if not records:
+        return
+    keys = sorted(set().union(*records))
+    rows = [{k: r.get(k) for k in keys} for r in records]
     try:
-        sb.table("trades").upsert(record).execute()
+        (client or get_supabase_client()).table(table).upsert(rows).execute()
     except APIError as e:
-        st.error("❌ Supabase APIError in upsert_trade():")
-        st.json(e.args[0])
+        missing = [k for k in OPTIONAL_COLUMNS.get(table, ()) if k in keys and k in str(e)]
+        if not missing:
+            raise
+        upsert_rows(table, [{k: v for k, v in r.items() if k not in missing} for r in rows], client)
 
 
-def upsert_cashflow(flow: Dict):
-    record = flow.copy()
-    record["user_id"] = get_user_id()
-    record.setdefault("id", str(uuid4()))
-    record = _serialize_dates(record)
+def get_write_queue() -> WriteBehindQueue:
+    """Coda write-behind della sessione corrente."""
+    if "write_queue" not in st.session_state:
+        st.session_state.write_queue = WriteBehindQueue(upsert_rows)
+    return st.session_state.write_queue
 
-    # Filtra solo i campi presenti nello schema public.cashflows
-    allowed = {"id", "user_id", "date", "amount", "note"}
-    record = {k: v for k, v in record.items() if k in allowed}
 
-    try:
-        sb.table("cashflows").upsert(record).execute()
-    except APIError as e:
-        st.error("❌ Supabase APIError in upsert_cashflow():")
-        st.json(e.args[0])
+def upsert_trade(trade: Dict):
+    """Accoda il trade: l'invio a Supabase avviene a batch (vedi WriteBehindQueue)."""
+    get_write_queue().enqueue("trades", _prepare_record(trade, TRADE_FIELDS))
+
+
+def upsert_cashflow(flow: Dict):
+    """Accoda il flusso di cassa: l'invio a Supabase avviene a batch."""
+    get_write_queue().enqueue("cashflows", _prepare_record(flow, CASHFLOW_FIELDS))
 
 
+def flush_writes() -> bool:
+    """Invia subito le scritture in attesa. False se qualcosa resta da inviare o è fallito."""
+    queue = get_write_queue()
+    return queue.flush() and queue.failed_count == 0
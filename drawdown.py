@@ -0,0 +1,94 @@
+# drawdown.py
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def drawdown_kernel(equity: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Drawdown in un solo passaggio vettoriale (O(n)) su una linea di equity:
+     - drawdown: massimo precedente - equity, per ogni punto (>= 0);
+     - starts / ends: indici del primo punto in drawdown e del primo punto
+       successivo tornato al massimo (ends == n se l'episodio è ancora aperto);
+     - troughs / depth: indice e profondità del minimo di ogni episodio.
+    I NaN iniziali non interrompono il massimo corrente (come cummax di pandas).
+    """
+    equity = np.asarray(equity, dtype=float)
+    n = len(equity)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return {"drawdown": np.empty(0), "starts": empty, "ends": empty,
+                "troughs": empty, "depth": np.empty(0)}
+
+    running_max = np.fmax.accumulate(equity)
+    drawdown = running_max - equity
+    in_dd = drawdown > 0
+
+    # bordi degli episodi: +1 all'ingresso in drawdown, -1 al recupero
+    edges = np.diff(np.concatenate(([0], in_dd.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return {"drawdown": drawdown, "starts": empty, "ends": empty,
+                "troughs": empty, "depth": np.empty(0)}
+
+    depth = np.maximum.reduceat(np.where(in_dd, drawdown, 0.0), starts)
+    # episodio di appartenenza di ogni punto; fuori dai drawdown non conta
+    label = np.cumsum(edges[:-1] == 1) - 1
+    at_depth = np.flatnonzero(in_dd & (drawdown == depth[np.maximum(label, 0)]))
+    first = np.concatenate(([True], label[at_depth][1:] != label[at_depth][:-1]))
+    troughs = at_depth[first]
+
+    return {"drawdown": drawdown, "starts": starts, "ends": ends,
+            "troughs": troughs, "depth": depth}
+
+
+def compute_drawdown(equity: pd.Series, dates: Optional[pd.Series] = None,
+                     base: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Drawdown completo di una linea di equity (P&L o valore):
+     - drawdown / drawdown_pct: serie in dollari e in % di `base`
+       (es. capitale iniziale; 0 se `base` manca o non è positiva);
+     - max_drawdown, max_drawdown_pct, current_drawdown;
+     - durations: lunghezza in punti di ogni episodio, con media e massimo;
+     - episodes: tabella peak/trough/recovery (date se `dates` è dato,
+       altrimenti indici), depth, depth_pct, length; recovery vuota se aperto.
+    """
+    out = drawdown_kernel(equity.to_numpy(dtype=float))
+    n = len(equity)
+    drawdown = pd.Series(out["drawdown"], index=equity.index)
+    if base is not None and base > 0:
+        drawdown_pct = drawdown / base * 100
+    else:
+        drawdown_pct = pd.Series(0.0, index=equity.index)
+
+    starts, ends, troughs = out["starts"], out["ends"], out["troughs"]
+    durations = ends - starts
+    labels = pd.Index(dates) if dates is not None else pd.RangeIndex(n)
+    open_ = ends >= n
+    recovery = np.array(labels.take(np.minimum(ends, n - 1)), dtype=object)
+    recovery[open_] = None
+    episodes = pd.DataFrame({
+        # il picco è l'ultimo punto prima dell'ingresso in drawdown
+        "peak": labels.take(np.maximum(starts - 1, 0)),
+        "trough": labels.take(troughs),
+        "recovery": recovery,
+        "depth": out["depth"],
+        "depth_pct": drawdown_pct.to_numpy()[troughs] if n else np.empty(0),
+        "length": durations,
+    })
+
+    return {
+        "drawdown": drawdown,
+        "drawdown_pct": drawdown_pct,
+        "max_drawdown": float(drawdown.max()) if n else 0.0,
+        "max_drawdown_pct": float(drawdown_pct.max()) if n else 0.0,
+        "current_drawdown": float(drawdown.iloc[-1]) if n else 0.0,
+        "durations": durations,
+        "max_duration": int(durations.max()) if len(durations) else 0,
+        "avg_duration": float(durations.mean()) if len(durations) else 0.0,
+        "episodes": episodes,
+    }
@@ -0,0 +1,169 @@
+# fetch_scheduler.py
+
+import asyncio
+import random
+import time
+from datetime import date
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from price_provider import NoDataError, RateLimitError
+
+FetchFn = Callable[[List[str], date, date], pd.DataFrame]
+
+
+class TokenBucket:
+    """Rate limit a token bucket: `rate` richieste/secondo, raffiche fino a `capacity`."""
+
+    def __init__(self, rate: float, capacity: int,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await self._sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class FetchScheduler:
+    """
+    Esegue i download dei prezzi a blocchi di simboli rispettando i limiti del provider:
+     - token bucket sul numero di richieste al secondo;
+     - retry con backoff esponenziale e jitter (full jitter), anche per i soli
+       simboli assenti o vuoti in una risposta riuscita;
+     - concorrenza adattiva AIMD: +1 dopo `increase_after` successi consecutivi,
+       dimezzata ad ogni throttling (`RateLimitError`);
+     - ogni risultato è etichettato con il proprio simbolo, mai con l'ordine di arrivo.
+    `fetch` è un qualsiasi callable (simboli, start, end) -> frame allineato, quindi
+    lo scheduler si può provare con un provider finto che inietta errori 429.
+    """
+
+    def __init__(self, fetch: FetchFn, rate: float = 2.0, burst: int = 4,
+                 initial_concurrency: int = 3, min_concurrency: int = 1,
+                 max_concurrency: int = 8, increase_after: int = 3,
+                 max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 chunk_size: int = 20, rng: Optional[random.Random] = None,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep):
+        self.fetch = fetch
+        self.bucket = TokenBucket(rate, burst, sleep=sleep)
+        self.concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase_after = increase_after
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.chunk_size = chunk_size
+        self.rng = rng or random.Random()
+        self._sleep = sleep
+        self.throttled = 0
+        self._streak = 0
+
+    def _backoff(self, attempt: int) -> float:
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _on_success(self) -> None:
+        self._streak += 1
+        if self._streak >= self.increase_after and self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            self._streak = 0
+
+    def _on_throttle(self) -> None:
+        self.throttled += 1
+        self._streak = 0
+        self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+
+    async def run(self, symbols: List[str], start: date, end: date,
+                  on_progress: Optional[Callable[[int, int], None]] = None
+                  ) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+        """
+        Scarica tutti i `symbols`. Restituisce (frame allineato, errori per simbolo):
+        i simboli falliti dopo tutti i tentativi non compaiono come colonne del frame;
+        quelli sempre senza dati pur con risposte riuscite hanno `NoDataError`.
+        """
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+        queue: asyncio.Queue = asyncio.Queue()
+        for chunk in chunks:
+            queue.put_nowait((chunk, 0))
+
+        results: Dict[str, pd.Series] = {}
+        failures: Dict[str, Exception] = {}
+        active = 0
+        slot = asyncio.Condition()
+        done = 0
+
+        async def worker() -> None:
+            nonlocal active, done
+            while True:
+                try:
+                    chunk, attempt = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                async with slot:
+                    await slot.wait_for(lambda: active < self.concurrency)
+                    active += 1
+                retry, retry_delay = chunk, None
+                try:
+                    await self.bucket.acquire()
+                    frame = await asyncio.to_thread(self.fetch, chunk, start, end)
+                except Exception as e:
+                    if isinstance(e, RateLimitError):
+                        self._on_throttle()
+                    if attempt < self.max_retries:
+                        retry_delay = self._backoff(attempt)
+                    else:
+                        for symbol in chunk:
+                            failures[symbol] = e
+                        done += len(chunk)
+                else:
+                    self._on_success()
+                    retry = [s for s in chunk if not (s in frame and frame[s].notna().any())]
+                    for symbol in chunk:
+                        if symbol not in retry:
+                            results[symbol] = frame[symbol]
+                    if retry and attempt < self.max_retries:
+                        # colonna assente o vuota (errore per simbolo del provider):
+                        # si riprova solo il sottoinsieme mancante, con lo stesso backoff
+                        retry_delay = self._backoff(attempt)
+                        done += len(chunk) - len(retry)
+                    else:
+                        for symbol in retry:
+                            failures[symbol] = NoDataError(symbol)
+                        done += len(chunk)
+                finally:
+                    async with slot:
+                        active -= 1
+                        slot.notify_all()
+                if on_progress:
+                    on_progress(done, len(symbols))
+                if retry_delay is not None:
+                    # l'attesa avviene fuori dallo slot, che resta libero per gli altri blocchi
+                    await self._sleep(retry_delay)
+                    queue.put_nowait((retry, attempt + 1))
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+        # un worker che esce a coda vuota può lasciare retry reinseriti da altri: si rilancia
+        while True:
+            await asyncio.gather(*workers)
+            if queue.empty():
+                break
+            workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+
+        frame = pd.concat(results, axis=1).sort_index() if results else pd.DataFrame()
+        return frame, failures
@@ -0,0 +1,67 @@
+# metrics_cache.py
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Impronta del contenuto di `parts`: DataFrame (valori e indice), array NumPy,
+    liste di dict (convertite in DataFrame) o valori semplici (via repr).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, list) and part and isinstance(part[0], dict):
+            part = pd.DataFrame.from_records(part)
+        if isinstance(part, pd.DataFrame):
+            h.update(repr(list(part.columns)).encode())
+            h.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+        elif isinstance(part, np.ndarray):
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode())
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Cache di dimensione limitata con espulsione LRU, condivisa dai thread del server.
+    Le chiavi sono impronte del contenuto, quindi sessioni con gli stessi dati
+    possono riusare lo stesso risultato.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Tuple[bool, Optional[Any]]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, self._data[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,4 @@
+-- Esito dichiarato delle opzioni scadute (assegnata / esercitata).
+-- NULL = non dichiarato: l'esito si ricava dal prezzo alla scadenza.
+-- Finché la colonna manca, upsert_rows invia i trade senza was_assigned.
+alter table public.trades add column if not exists was_assigned boolean;
@@ -1,50 +1,528 @@
 # portfolio.py
 
+import copy
 import pandas as pd
 import numpy as np
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import date, timedelta
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 # import della funzione async di fetch centralizzata
 #from data_fetcher import fetch_all_historical_data
-from data_fetcher import fetch_all_historical_data, fetch_risk_free_rate
+from data_fetcher import (fetch_all_historical_data, fetch_risk_free_series, last_risk_free_rate,
+                          risk_free_version)
+from drawdown import compute_drawdown
+from metrics_cache import LRUCache, fingerprint
+from price_matrix import PriceMatrix
+from trade_store import TradeTable
+from twr import compute_twr
 
 # configurazione globale
 CONFIG = {
     'risk_free_rate': 0.05,
     'default_commission': 1.50,
+    # giorni dopo la scadenza entro cui un trade di azioni inserito a mano
+    # (stesso simbolo, quantità e prezzo = strike) sostituisce quello derivato
+    'assignment_match_days': 4,
 }
 
+# metriche già calcolate, per impronta di (trade, flussi, storico, prezzi, tassi)
+METRICS_CACHE = LRUCache(maxsize=32)
+
 
 class PortfolioProcessor:
     """
     Classe che contiene tutta la logica per processare i trade,
     ricostruire lo storico e calcolare le metriche.
     """
-    def __init__(self, trades: List[Dict], cash_flows: List[Dict]):
+    def __init__(self, trades: List[Dict], cash_flows: List[Dict],
+                 trade_table: Optional[TradeTable] = None):
         self.trades = sorted(trades, key=lambda x: x['date'])
         self.cash_flows = sorted(cash_flows, key=lambda x: x['date'])
         # tutti i simboli coinvolti
         self.all_symbols = list({t['symbol'] for t in self.trades})
-        self.historical_prices = {}
+        self.historical_prices = pd.DataFrame()
+        self.price_matrix = PriceMatrix.empty()
+        self._trade_table = trade_table
+        # stato per l'aggiornamento incrementale dello storico
+        self.history = pd.DataFrame()
+        self.expired_log = pd.DataFrame()
+        self.checkpoints: List[Dict[str, Any]] = []
+        self._record_keys: Dict[tuple, date] = {}
+        self._start_date: Optional[date] = None
+        self._end_date: Optional[date] = None
+        # trade di azioni generati da assegnazioni ed esercizi, separati da quelli dell'utente
+        self.derived_trades: List[Dict[str, Any]] = []
+        self._position_table: Optional[TradeTable] = None
+        # equity e P&L per simbolo (giorni × simboli), allineati alle righe di `history`
+        self.symbol_matrix: Dict[str, Any] = self._empty_symbol_matrix()
+
+    @property
+    def trade_table(self) -> TradeTable:
+        """Vista colonnare dei trade del processore, costruita alla prima richiesta."""
+        if self._trade_table is None or len(self._trade_table) != len(self.trades):
+            self._trade_table = TradeTable.from_records(self.trades)
+        return self._trade_table
+
+    @property
+    def position_table(self) -> TradeTable:
+        """
+        Trade dell'utente più le azioni derivate da assegnazioni ed esercizi
+        (escluse quelle già inserite a mano): base per posizioni aperte e P&L.
+        """
+        derived = [d for d in self.derived_trades if d['matched_trade'] is None]
+        if self._position_table is None:
+            self._position_table = TradeTable.from_records(self.trades + derived)
+        return self._position_table
 
     @staticmethod
     def get_price_on_date(historical_data: pd.DataFrame, target_date: date) -> float:
-        """Recupera il prezzo di chiusura più vicino a una data specifica."""
+        """
+        Recupera il prezzo di chiusura più vicino a una data specifica.
+        Per le serie già caricate nel processore usare `self.price_matrix.price`.
+        """
         if historical_data is None or historical_data.empty:
             return 0.0
-        subset = historical_data[historical_data.index <= target_date]
-        if not subset.empty:
-            return float(subset.iloc[-1]['Close'])
+        pos = historical_data.index.searchsorted(target_date, side='right')
+        if pos > 0:
+            return float(historical_data['Close'].iloc[pos - 1])
         return 0.0
 
+    def _index_events(self, start_date: date, end_date: date,
+                      open_options: Optional[Dict[date, List[Dict]]] = None
+                      ) -> Tuple[Dict[date, List[Dict]], Dict[date, List[Dict]], List[date]]:
+        """
+        Raggruppa una sola volta cash flows e trade per data e raccoglie le
+        scadenze delle opzioni (incluse quelle già aperte in `open_options`,
+        indicizzate per scadenza).
+        Restituisce (flows_by_date, trades_by_date, event_days), dove event_days
+        è l'elenco ordinato dei soli giorni con almeno un evento.
+        """
+        flows_by_date: Dict[date, List[Dict]] = defaultdict(list)
+        for flow in self.cash_flows:
+            if start_date <= flow['date'] <= end_date:
+                flows_by_date[flow['date']].append(flow)
+
+        trades_by_date: Dict[date, List[Dict]] = defaultdict(list)
+        expiry_days = set()
+        for trade in self.trades:
+            if not (start_date <= trade['date'] <= end_date):
+                continue
+            trades_by_date[trade['date']].append(trade)
+            expiry = trade.get('expiry')
+            if (trade['type'] in ['put', 'call'] and expiry
+                    and trade['date'] <= expiry <= end_date):
+                expiry_days.add(expiry)
+        expiry_days.update(e for e in (open_options or {})
+                           if e is not None and start_date <= e <= end_date)
+
+        event_days = sorted(set(flows_by_date) | set(trades_by_date) | expiry_days)
+        return flows_by_date, trades_by_date, event_days
+
+    @staticmethod
+    def _apply_trade(state: Dict[str, Any], trade: Dict) -> None:
+        """
+        Applica un trade allo stato (posizioni e opzioni aperte).
+        Gli effetti sul cash sono calcolati a parte da `_cash_ledger`.
+        """
+        positions = state['positions']
+
+        if trade['type'] == 'stock':
+            symbol = trade['symbol']
+            qty = trade['quantity']
+            price = trade['stock_price']
+
+            if symbol not in positions:
+                positions[symbol] = {'shares': 0, 'cost_basis': 0.0}
+
+            # aggiornamento costo medio
+            if qty > 0:  # acquisto
+                old_cost = (positions[symbol]['shares']
+                            * positions[symbol]['cost_basis'])
+                new_cost = qty * price
+                total_shares = positions[symbol]['shares'] + qty
+                positions[symbol]['cost_basis'] = (
+                    (old_cost + new_cost) / total_shares
+                    if total_shares > 0 else 0.0
+                )
+
+            positions[symbol]['shares'] += qty
+
+        elif trade['type'] in ['put', 'call']:
+            state['open_options'][trade.get('expiry')].append(trade)
+
+    @staticmethod
+    def _open_legs(open_options: Dict[date, List[Dict]]) -> List[Dict]:
+        """Opzioni aperte in un'unica lista, a partire dall'indice per scadenza."""
+        return [opt for legs in open_options.values() for opt in legs]
+
+    def _expire_options(self, state: Dict[str, Any],
+                        current_date: date) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Chiude le opzioni che scadono in `current_date`, prelevando solo il loro
+        gruppo dall'indice per scadenza (O(k) invece di O(opzioni aperte)).
+        Restituisce le righe del log delle scadenze e i trade di azioni derivati:
+        consegna allo strike per le short assegnate e per le long esercitate.
+        """
+        expired_rows: List[Dict[str, Any]] = []
+        settlements: List[Dict[str, Any]] = []
+        # un solo prezzo per simbolo: con molti contratti sulla stessa scadenza
+        # le gambe condividono il sottostante
+        spot: Dict[str, float] = {}
+        for opt in state['open_options'].pop(current_date, []):
+            symbol = opt['symbol']
+            strike = opt['strike']
+            premium = opt['premium']
+            qty = opt['quantity']
+            multiplier = opt.get('multiplier', 100)
+            if symbol not in spot:
+                spot[symbol] = self.price_matrix.price(symbol, current_date)
+            price_on_exp = spot[symbol]
+            # in the money alla chiusura del giorno di scadenza, salvo che l'utente
+            # abbia indicato l'esito ("Assegnata?" nel form delle opzioni scadute)
+            in_the_money = ((opt['type'] == 'put' and price_on_exp < strike)
+                            or (opt['type'] == 'call' and price_on_exp > strike))
+            flag = opt.get('was_assigned')
+            settled = in_the_money if flag is None else bool(flag)
+            # assegnata per le short, esercitata per le long
+            was_assigned = qty < 0 and settled
+            exercised = qty >= 0 and settled
+
+            if qty < 0:
+                # short: il premio già incassato è il P&L, sia OTM che assegnata
+                pnl = abs(premium)
+            else:
+                # long
+                intrinsic = 0.0
+                if opt['type'] == 'put' and price_on_exp < strike:
+                    intrinsic = (strike - price_on_exp) * abs(qty) * multiplier
+                elif opt['type'] == 'call' and price_on_exp > strike:
+                    intrinsic = (price_on_exp - strike) * abs(qty) * multiplier
+                pnl = (intrinsic if exercised else 0.0) - abs(premium)
+
+            if was_assigned or exercised:
+                # put: la short riceve le azioni, la long le consegna; call al contrario
+                shares = abs(qty) * multiplier * (1 if opt['type'] == 'put' else -1)
+                if exercised:
+                    shares = -shares
+                kind = 'assignment' if was_assigned else 'exercise'
+                label = 'Assegnazione' if was_assigned else 'Esercizio'
+                settlements.append({
+                    'date': current_date,
+                    'symbol': symbol,
+                    'type': 'stock',
+                    'quantity': shares,
+                    'stock_price': strike,
+                    'commission': 0.0,
+                    'expiry': current_date,
+                    'strike': 0.0,
+                    'premium': 0.0,
+                    'multiplier': 1,
+                    'note': f"{label} da {opt['type'].title()} strike {strike}",
+                    'derived': kind,
+                    'option_id': opt.get('id', opt.get('unique_id')),
+                    'matched_trade': None,
+                })
+
+            expired_rows.append({
+                'expiry_date': current_date,
+                'symbol': symbol,
+                'type': opt['type'],
+                'strike': strike,
+                'quantity': qty,
+                'multiplier': multiplier,
+                'premium': premium,
+                'pnl': pnl,
+                'was_assigned': was_assigned,
+                'price_on_expiry': price_on_exp
+            })
+        return expired_rows, settlements
+
+    def _manual_fills(self) -> Dict[Tuple[str, float], List[Dict]]:
+        """
+        Trade di azioni dell'utente per (simbolo, quantità), ordinati per data:
+        indice per riconoscere le assegnazioni già inserite a mano.
+        """
+        fills: Dict[Tuple[str, float], List[Dict]] = defaultdict(list)
+        for t in self.trades:
+            if t['type'] == 'stock':
+                fills[(t['symbol'], float(t['quantity']))].append(t)
+        return fills
+
+    def _match_manual(self, settlement: Dict[str, Any],
+                      fills: Dict[Tuple[str, float], List[Dict]], used: set) -> Optional[tuple]:
+        """
+        Trade dell'utente che registra già `settlement`: stesso simbolo e quantità,
+        prezzo pari allo strike, data entro `assignment_match_days` dalla scadenza.
+        Ogni trade dell'utente copre al massimo un'assegnazione.
+        """
+        last = settlement['date'] + timedelta(days=CONFIG['assignment_match_days'])
+        for t in fills.get((settlement['symbol'], float(settlement['quantity'])), []):
+            if t['date'] < settlement['date']:
+                continue
+            if t['date'] > last:
+                break
+            key = self._record_key(t)
+            if key not in used and abs(t.get('stock_price', 0) - settlement['stock_price']) < 0.005:
+                used.add(key)
+                return key
+        return None
+
+    @staticmethod
+    def _cash_ledger(trades: List[Dict], flows: List[Dict], from_date: date,
+                     n_days: int) -> Dict[str, np.ndarray]:
+        """
+        Libro cassa giornaliero: flussi, commissioni, premi e regolamenti azioni
+        raggruppati per giorno in array (bincount) a partire da `from_date`.
+        """
+        def bucket(records: List[Dict], weights: List[float]) -> np.ndarray:
+            if not records:
+                return np.zeros(n_days)
+            days = np.array([(r['date'] - from_date).days for r in records])
+            return np.bincount(days, weights=np.asarray(weights, dtype=float),
+                               minlength=n_days)
+
+        stocks = [t for t in trades if t['type'] == 'stock']
+        options = [t for t in trades if t['type'] in ['put', 'call']]
+        return {
+            'cash_flow': bucket(flows, [f['amount'] for f in flows]),
+            'commission': bucket(trades, [t.get('commission', 0) for t in trades]),
+            # short -> incassi premio, long -> paghi premio
+            'premium': bucket(options, [abs(t['premium']) if t['quantity'] < 0
+                                        else -abs(t['premium']) for t in options]),
+            # paghi o incassi azioni
+            'stock_settlement': bucket(stocks, [-t['quantity'] * t['stock_price']
+                                                for t in stocks]),
+        }
+
+    def _stock_values(self, prices: np.ndarray,
+                      stock_fills: List[Tuple[int, str, float]]) -> np.ndarray:
+        """
+        Valore giornaliero delle azioni per simbolo (colonne della matrice prezzi):
+        matrice delle quantità detenute (giorni × simboli, cumulata dalle variazioni
+        registrate nei giorni di trade) moltiplicata elemento per elemento per i prezzi.
+        """
+        holdings = np.zeros_like(prices)
+        if stock_fills:
+            days, symbols, qtys = zip(*stock_fills)
+            cols = self.price_matrix.columns_of(symbols)
+            mask = cols >= 0
+            np.add.at(holdings, (np.asarray(days)[mask], cols[mask]),
+                      np.asarray(qtys, dtype=float)[mask])
+        np.cumsum(holdings, axis=0, out=holdings)
+        return holdings * prices
+
+    def _option_values(self, prices: np.ndarray, start_date: date,
+                       option_legs: List[Dict], symbol_index: Dict[str, int]) -> np.ndarray:
+        """
+        Valore intrinseco giornaliero di tutte le gambe in opzione in un'unica passata,
+        per simbolo (colonne secondo `symbol_index`).
+        Ogni gamba è viva nell'intervallo [data trade, scadenza) (fino a fine storico se
+        non scade nella finestra): si espandono solo le coppie (gamba, giorno) vive,
+        si valorizzano in blocco e si sommano per (giorno, simbolo) con bincount.
+        """
+        n_days, n_symbols = prices.shape[0], len(symbol_index)
+        if not option_legs:
+            return np.zeros((n_days, n_symbols))
+
+        # le gambe aperte prima della finestra (ripresa da checkpoint) partono dal giorno 0
+        open_idx = np.array([max((o['date'] - start_date).days, 0) for o in option_legs])
+        close_idx = np.array([
+            (o['expiry'] - start_date).days
+            if o.get('expiry') and o['date'] <= o['expiry'] and (o['expiry'] - start_date).days < n_days
+            else n_days
+            for o in option_legs
+        ])
+        strike = np.array([o['strike'] for o in option_legs], dtype=float)
+        qty = np.array([o['quantity'] for o in option_legs], dtype=float)
+        mult = np.array([o.get('multiplier', 100) for o in option_legs], dtype=float)
+        is_put = np.array([o['type'] == 'put' for o in option_legs])
+        cols = self.price_matrix.columns_of(o['symbol'] for o in option_legs)
+        owner = np.array([symbol_index[o['symbol']] for o in option_legs])
+
+        # espansione (gamba, giorno) sugli intervalli di vita
+        lengths = close_idx - open_idx
+        leg = np.repeat(np.arange(len(option_legs)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        day = open_idx[leg] + offsets
+
+        col = cols[leg]
+        price_now = np.where(col >= 0, prices[day, np.clip(col, 0, None)], 0.0)
+        intrinsic = np.where(is_put[leg],
+                             np.maximum(0, strike[leg] - price_now),
+                             np.maximum(0, price_now - strike[leg]))
+        val = intrinsic * np.abs(qty[leg]) * mult[leg]
+        # short è passività
+        val = np.where(qty[leg] < 0, -val, val)
+        return np.bincount(day * n_symbols + owner[leg], weights=val,
+                           minlength=n_days * n_symbols).reshape(n_days, n_symbols)
+
+    @staticmethod
+    def _symbol_cash(trades: List[Dict], from_date: date, n_days: int,
+                     symbol_index: Dict[str, int],
+                     start: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """
+        Cash cumulato dei trade per simbolo (giorni × simboli): premi, regolamenti
+        azioni (anche derivati da assegnazioni ed esercizi) e commissioni,
+        partendo dai saldi `start`.
+        I flussi di cassa del conto non appartengono a nessun simbolo.
+        """
+        ledger = np.zeros((n_days, len(symbol_index)))
+        for symbol, amount in (start or {}).items():
+            if symbol in symbol_index:
+                ledger[0, symbol_index[symbol]] += amount
+        if trades:
+            day = np.array([(t['date'] - from_date).days for t in trades])
+            col = np.array([symbol_index[t['symbol']] for t in trades])
+            qty = np.array([t['quantity'] for t in trades], dtype=float)
+            is_stock = np.array([t['type'] == 'stock' for t in trades])
+            premium = np.array([abs(t.get('premium') or 0) for t in trades], dtype=float)
+            price = np.array([t.get('stock_price') or 0 for t in trades], dtype=float)
+            commission = np.array([t.get('commission', 0) for t in trades], dtype=float)
+            amount = np.where(is_stock, -qty * price, np.where(qty < 0, premium, -premium)) - commission
+            np.add.at(ledger, (day, col), amount)
+        return np.cumsum(ledger, axis=0)
+
+    @staticmethod
+    def _empty_symbol_matrix() -> Dict[str, Any]:
+        return {'symbols': [], 'equity': np.zeros((0, 0)), 'pnl': np.zeros((0, 0))}
+
+    @staticmethod
+    def _snapshot(state: Dict[str, Any], event_date: date) -> Dict[str, Any]:
+        """Copia dello stato a fine giornata, usata come checkpoint di ripresa."""
+        return {
+            'date': event_date,
+            'positions': {s: dict(p) for s, p in state['positions'].items()},
+            'open_options': defaultdict(list, {e: list(legs)
+                                               for e, legs in state['open_options'].items()}),
+        }
+
+    @classmethod
+    def _restore(cls, checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+        state = cls._snapshot(checkpoint, checkpoint['date'])
+        del state['date']
+        return state
+
+    @staticmethod
+    def _record_key(record: Dict) -> tuple:
+        """Impronta di un trade o flusso, indipendente dai campi calcolati dal processore."""
+        return tuple(sorted((k, v) for k, v in record.items() if k != 'unique_id'))
+
+    def _replay(self, from_date: date, end_date: date, state: Dict[str, Any],
+                start_cash: float = 0.0, start_cf: float = 0.0,
+                start_symbol_cash: Optional[Dict[str, float]] = None
+                ) -> Tuple[pd.DataFrame, List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Replay indicizzato per evento da `from_date` a `end_date` partendo da `state`
+        e dai saldi `start_cash` / `start_cf` / `start_symbol_cash` del giorno precedente.
+        Aggiunge un checkpoint per ogni giorno con eventi e i trade di azioni
+        derivati da assegnazioni ed esercizi a `self.derived_trades`; restituisce
+        (storico_del_periodo, righe_log_scadenze, matrice_per_simbolo).
+        La matrice per simbolo ha equity (valore di azioni e opzioni) e P&L
+        (equity + cash dei trade) per giorno: la somma dei P&L è `equity_line_pnl`.
+        """
+        expired_options_log: List[Dict[str, Any]] = []
+        n_days = (end_date - from_date).days + 1
+        settled: List[Dict[str, Any]] = []
+        fills = self._manual_fills()
+        used = {d['matched_trade'] for d in self.derived_trades if d['matched_trade'] is not None}
+        stock_fills: List[Tuple[int, str, float]] = [
+            (0, s, p['shares']) for s, p in state['positions'].items() if p['shares'] != 0
+        ]
+        option_legs: List[Dict] = self._open_legs(state['open_options'])
+
+        flows_by_date, trades_by_date, event_days = self._index_events(
+            from_date, end_date, state['open_options']
+        )
+
+        # Loop sui soli giorni con eventi; ogni evento apre un segmento
+        # [giorno evento, giorno evento successivo) a stato costante
+        for event_date in event_days:
+            day = (event_date - from_date).days
+
+            # a) trade di quel giorno (i cash flows toccano solo il libro cassa)
+            for trade in trades_by_date.get(event_date, []):
+                self._apply_trade(state, trade)
+                if trade['type'] == 'stock':
+                    stock_fills.append((day, trade['symbol'], trade['quantity']))
+                elif trade['type'] in ['put', 'call']:
+                    option_legs.append(trade)
+
+            # b) gestione scadenze opzioni
+            expired_rows, settlements = self._expire_options(state, event_date)
+            expired_options_log.extend(expired_rows)
+
+            # c) consegna delle azioni nello stesso giorno di scadenza, salvo
+            #    che l'utente non l'abbia già registrata a mano
+            for trade in settlements:
+                trade['matched_trade'] = self._match_manual(trade, fills, used)
+                self.derived_trades.append(trade)
+                if trade['matched_trade'] is None:
+                    self._apply_trade(state, trade)
+                    stock_fills.append((day, trade['symbol'], trade['quantity']))
+                    settled.append(trade)
+
+            self.checkpoints.append(self._snapshot(state, event_date))
+
+        # libro cassa vettoriale: somme cumulate dei movimenti giornalieri
+        window_trades = [t for d in event_days for t in trades_by_date.get(d, [])] + settled
+        ledger = self._cash_ledger(
+            window_trades,
+            [f for d in event_days for f in flows_by_date.get(d, [])],
+            from_date, n_days
+        )
+        daily_cash_flow = ledger['cash_flow']
+        cash_movements = (daily_cash_flow + ledger['premium'] + ledger['stock_settlement']
+                          - ledger['commission'])
+        cash_balance = start_cash + np.cumsum(cash_movements)
+        cumulative_cf = start_cf + np.cumsum(daily_cash_flow)
+
+        # valorizzazione vettoriale su tutta la finestra
+
+        # colonne per simbolo: tutti i simboli dei trade e quelli ancora in portafoglio
+        symbols = sorted({t['symbol'] for t in self.trades}
+                         | {s for _, s, _ in stock_fills}
+                         | {o['symbol'] for o in option_legs}
+                         | set(start_symbol_cash or {}))
+        symbol_index = {s: j for j, s in enumerate(symbols)}
+
+        prices = self.price_matrix.window(from_date, n_days)
+        stock_by_symbol = self._stock_values(prices, stock_fills)
+        options_by_symbol = self._option_values(prices, from_date, option_legs, symbol_index)
+        stock_value = stock_by_symbol.sum(axis=1)
+        options_value = options_by_symbol.sum(axis=1)
+        portfolio_value = stock_value + cash_balance + options_value
+
+        equity = options_by_symbol
+        price_cols = np.array([symbol_index.get(s, -1) for s in self.price_matrix.symbols], dtype=int)
+        held = price_cols >= 0
+        equity[:, price_cols[held]] += stock_by_symbol[:, held]
+        pnl = equity + self._symbol_cash(window_trades, from_date, n_days,
+                                         symbol_index, start_symbol_cash)
+        symbol_matrix = {'symbols': symbols, 'equity': equity, 'pnl': pnl}
+
+        history = pd.DataFrame({
+            'date': pd.date_range(from_date, end_date, freq='D').date,
+            'portfolio_value': portfolio_value,
+            'stock_value': stock_value,
+            'options_value': options_value,
+            'cash_balance': cash_balance,
+            'daily_cash_flow': daily_cash_flow,
+            'cumulative_cash_flow': cumulative_cf,
+            # P&L netto rispetto ai cash flows
+            'equity_line_pnl': portfolio_value - cumulative_cf
+        })
+        return history, expired_options_log, symbol_matrix
+
     async def build_full_history(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """
-        Ricostruisce giorno per giorno:
-         - posizioni e cash balance
-         - esecuzione trade e cash flows
-         - scadenze opzioni e assegnazioni
-         - valore portafoglio e P&L cumulativo
+        Ricostruisce lo storico del portafoglio con un replay indicizzato per evento:
+         - trade, cash flows e scadenze vengono raggruppati per data una sola volta
+         - lo stato (posizioni, opzioni aperte) cambia solo nei giorni con eventi
+           e viene salvato come checkpoint per gli aggiornamenti incrementali
+         - il cash è un libro cassa vettoriale (movimenti giornalieri + somme cumulate)
+         - azioni e opzioni vengono valorizzate in blocco su tutto il calendario
         Restituisce: (portfolio_history_df, expired_options_log_df)
         """
         # se non ci sono dati
@@ -60,242 +538,191 @@ class PortfolioProcessor:
         self.historical_prices = await fetch_all_historical_data(
             self.all_symbols, start_date, end_date
         )
-        historical_prices = self.historical_prices
+        # matrice prezzi allineata e forward-filled: lookup as-of in O(1)
+        self.price_matrix = PriceMatrix.from_wide(
+            self.historical_prices, start_date, end_date
+        )
 
-        # 3) Costruzione dei log
-        portfolio_history: List[Dict[str, Any]] = []
-        expired_options_log: List[Dict[str, Any]] = []
+        # 3) assegna ID unici ai trade
+        for idx, t in enumerate(self.trades):
+            t['unique_id'] = idx
+
+        # 4) replay completo da stato vuoto
+        state: Dict[str, Any] = {
+            'positions': {},        # es. {'AAPL': {'shares': 100, 'cost_basis': 150.0}}
+            'open_options': defaultdict(list),   # {scadenza: [opzioni aperte]}
+        }
+        self.checkpoints = []
+        self.derived_trades = []
+        self._position_table = None
+        history, expired_rows, symbol_matrix = self._replay(start_date, end_date, state)
+
+        self.history = history
+        self.symbol_matrix = symbol_matrix
+        self.expired_log = pd.DataFrame(expired_rows)
+        self._start_date, self._end_date = start_date, end_date
+        self._record_keys = {self._record_key(r): r['date'] for r in all_actions}
+        return self.history, self.expired_log
+
+    async def update_history(self, trades: List[Dict],
+                             cash_flows: List[Dict]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Aggiorna lo storico dopo l'aggiunta, modifica o rimozione di trade e flussi.
+        Il replay riparte dall'ultimo checkpoint precedente alla prima data
+        toccata e ricalcola solo il suffisso di `portfolio_history`; se non è
+        possibile (primo calcolo, data di inizio cambiata) ricostruisce tutto.
+        """
+        self.trades = sorted(trades, key=lambda x: x['date'])
+        self.cash_flows = sorted(cash_flows, key=lambda x: x['date'])
+        self.all_symbols = list({t['symbol'] for t in self.trades})
+        self._trade_table = None
+        self._position_table = None
+        if not self.trades and not self.cash_flows:
+            return pd.DataFrame(), pd.DataFrame()
 
-        # 4) Stato iniziale
-        cash_balance = 0.0
-        positions: Dict[str, Dict[str, Any]] = {}  # es. {'AAPL': {'shares': 100, 'cost_basis': 150.0}}
-        open_options: List[Dict[str, Any]] = []
-        processed_trade_ids = set()
+        all_actions = self.trades + self.cash_flows
+        start_date = min(a['date'] for a in all_actions)
+        end_date = date.today()
+        if self.history.empty or start_date != self._start_date:
+            return await self.build_full_history()
+
+        # 1) prima data toccata: record nuovi, rimossi o modificati
+        new_keys = {self._record_key(r): r['date'] for r in all_actions}
+        changed = ([d for k, d in new_keys.items() if k not in self._record_keys]
+                   + [d for k, d in self._record_keys.items() if k not in new_keys])
+        if end_date > self._end_date:
+            changed.append(self._end_date + timedelta(days=1))
+        if not changed:
+            return self.history, self.expired_log
+        # un trade di azioni inserito a mano può sostituire l'assegnazione di una
+        # scadenza fino a `assignment_match_days` prima: si riparte da lì
+        resume_date = min(changed) - timedelta(days=CONFIG['assignment_match_days'])
+
+        # 2) prezzi: solo i simboli nuovi, o tutti se il calendario si è allungato
+        #    (i simboli senza dati non hanno colonna e vengono richiesti di nuovo)
+        if end_date > self._end_date:
+            self.historical_prices = await fetch_all_historical_data(
+                self.all_symbols, start_date, end_date
+            )
+            self.price_matrix = PriceMatrix.from_wide(self.historical_prices, start_date, end_date)
+        else:
+            missing = [s for s in self.all_symbols if s not in self.historical_prices.columns]
+            if missing:
+                fetched = await fetch_all_historical_data(missing, start_date, end_date)
+                self.historical_prices = self.historical_prices.join(fetched, how='outer')
+                self.price_matrix = PriceMatrix.from_wide(self.historical_prices, start_date, end_date)
 
-        # 5) assegna ID unici ai trade
         for idx, t in enumerate(self.trades):
             t['unique_id'] = idx
 
-        # 6) Loop su ogni giorno
-        for single in pd.date_range(start_date, end_date, freq='D'):
-            current_date = single.date()
-            daily_cash_flow = 0.0
-
-            # a) cash flows
-            for flow in self.cash_flows:
-                if flow['date'] == current_date:
-                    amt = flow['amount']
-                    cash_balance += amt
-                    daily_cash_flow += amt
-
-            # b) trade di quel giorno
-            for trade in self.trades:
-                if (trade['date'] == current_date
-                        and trade['unique_id'] not in processed_trade_ids):
-                    # commissioni
-                    cash_balance -= trade.get('commission', 0)
-
-                    if trade['type'] == 'stock':
-                        symbol = trade['symbol']
-                        qty = trade['quantity']
-                        price = trade['stock_price']
-
-                        # paghi o incassi azioni
-                        cash_balance -= qty * price
-
-                        if symbol not in positions:
-                            positions[symbol] = {'shares': 0, 'cost_basis': 0.0}
-
-                        # aggiornamento costo medio
-                        if qty > 0:  # acquisto
-                            old_cost = (positions[symbol]['shares']
-                                        * positions[symbol]['cost_basis'])
-                            new_cost = qty * price
-                            total_shares = positions[symbol]['shares'] + qty
-                            positions[symbol]['cost_basis'] = (
-                                (old_cost + new_cost) / total_shares
-                                if total_shares > 0 else 0.0
-                            )
-
-                        positions[symbol]['shares'] += qty
-
-                    elif trade['type'] in ['put', 'call']:
-                        # premio opzione
-                        prem = abs(trade['premium'])
-                        if trade['quantity'] < 0:
-                            # short -> incassi premio
-                            cash_balance += prem
-                        else:
-                            # long -> paghi premio
-                            cash_balance -= prem
-
-                        open_options.append(trade)
-
-                    processed_trade_ids.add(trade['unique_id'])
-
-            # c) gestione scadenze opzioni
-            remaining_options = []
-            for opt in open_options:
-                if opt['expiry'] == current_date:
-                    symbol = opt['symbol']
-                    strike = opt['strike']
-                    premium = opt['premium']
-                    qty = opt['quantity']
-                    multiplier = opt.get('multiplier', 100)
-                    price_on_exp = self.get_price_on_date(
-                        historical_prices.get(symbol, pd.DataFrame()), current_date
-                    )
-                    pnl = 0.0
-                    was_assigned = False
-
-                    # determina se assegnata (solo per short)
-                    if qty < 0:
-                        if (opt['type'] == 'put' and price_on_exp < strike) \
-                           or (opt['type'] == 'call' and price_on_exp > strike):
-                            was_assigned = True
-
-                    # calcolo P&L e possibili trade di assignment
-                    if qty < 0:
-                        # short
-                        if was_assigned:
-                            # premio già incassato -> considerato P&L
-                            pnl = abs(premium)
-                            # genera trade di azioni
-                            #contracts = abs(qty)
-                            #share_qty = contracts * multiplier
-                            #if opt['type'] == 'put':
-                                #assign_qty = share_qty
-                            #else:
-                                #assign_qty = -share_qty
-
-                            #assignment_trade = {
-                                #'date': current_date,
-                                #'symbol': symbol,
-                                #'type': 'stock',
-                                #'quantity': assign_qty,
-                                #'stock_price': strike,
-                                #'commission': 0.0,
-                                #'note': f"Assegnazione da {opt['type'].title()} strike {strike}",
-                                #'unique_id': len(self.trades) + len(expired_options_log)
-                            #}
-                            #self.trades.append(assignment_trade)
-                        else:
-                            # scaduta OTM
-                            pnl = abs(premium)
-                    else:
-                        # long
-                        intrinsic = 0.0
-                        if opt['type'] == 'put' and price_on_exp < strike:
-                            intrinsic = (strike - price_on_exp) * abs(qty) * multiplier
-                        elif opt['type'] == 'call' and price_on_exp > strike:
-                            intrinsic = (price_on_exp - strike) * abs(qty) * multiplier
-
-                        if intrinsic > 0:
-                            cash_balance += intrinsic
-                            pnl = intrinsic - abs(premium)
-                        else:
-                            pnl = -abs(premium)
-
-                    expired_options_log.append({
-                        'expiry_date': current_date,
-                        'symbol': symbol,
-                        'type': opt['type'],
-                        'strike': strike,
-                        'premium': premium,
-                        'pnl': pnl,
-                        'was_assigned': was_assigned,
-                        'price_on_expiry': price_on_exp
-                    })
-                else:
-                    remaining_options.append(opt)
-            open_options = remaining_options
-
-            # d) calcola valori di portafoglio
-            stock_value = 0.0
-            for symbol, pos in positions.items():
-                shares = pos['shares']
-                if shares != 0:
-                    p = self.get_price_on_date(
-                        historical_prices.get(symbol, pd.DataFrame()), current_date
-                    )
-                    stock_value += shares * p
-
-            options_value = 0.0
-            for opt in open_options:
-                price_now = self.get_price_on_date(
-                    historical_prices.get(opt['symbol'], pd.DataFrame()), current_date
-                )
-                intrinsic = 0.0
-                if opt['type'] == 'put':
-                    intrinsic = max(0, opt['strike'] - price_now)
-                else:
-                    intrinsic = max(0, price_now - opt['strike'])
-                val = intrinsic * abs(opt['quantity']) * opt.get('multiplier', 100)
-                # short è passività
-                options_value += (-val if opt['quantity'] < 0 else val)
+        # 3) ripresa dall'ultimo checkpoint strettamente precedente alla data toccata
+        k = bisect_left([c['date'] for c in self.checkpoints], resume_date) - 1
+        if k < 0:
+            return await self.build_full_history()
+        checkpoint = self.checkpoints[k]
+        del self.checkpoints[k + 1:]
+        from_date = checkpoint['date'] + timedelta(days=1)
+
+        # saldi del giorno precedente la ripresa (riga giornaliera dello storico)
+        n_prefix = (from_date - start_date).days
+        last = self.history.iloc[n_prefix - 1]
+        prev = self.symbol_matrix
+        last_symbol_cash = dict(zip(prev['symbols'],
+                                    prev['pnl'][n_prefix - 1] - prev['equity'][n_prefix - 1]))
+        self.derived_trades = [d for d in self.derived_trades if d['date'] < from_date]
+        suffix, expired_rows, suffix_matrix = self._replay(
+            from_date, end_date, self._restore(checkpoint),
+            last['cash_balance'], last['cumulative_cash_flow'], last_symbol_cash
+        )
 
-            portfolio_value = stock_value + cash_balance + options_value
+        # 4) sostituisce il suffisso dello storico e del log scadenze
+        prefix = self.history[self.history['date'] < from_date]
+        self.history = pd.concat([prefix, suffix], ignore_index=True)
+        self.symbol_matrix = self._join_symbol_matrix(prev, n_prefix, suffix_matrix)
+        if not self.expired_log.empty:
+            kept = self.expired_log[self.expired_log['expiry_date'] < from_date]
+            self.expired_log = pd.concat([kept, pd.DataFrame(expired_rows)], ignore_index=True)
+        else:
+            self.expired_log = pd.DataFrame(expired_rows)
 
-            # P&L netto rispetto ai cash flows
-            cumulative_cf = sum(cf['amount']
-                                for cf in self.cash_flows
-                                if cf['date'] <= current_date)
-            equity_line_pnl = portfolio_value - cumulative_cf
-
-            # registra lo snapshot
-            portfolio_history.append({
-                'date': current_date,
-                'portfolio_value': portfolio_value,
-                'stock_value': stock_value,
-                'options_value': options_value,
-                'cash_balance': cash_balance,
-                'daily_cash_flow': daily_cash_flow,
-                'cumulative_cash_flow': cumulative_cf,
-                'equity_line_pnl': equity_line_pnl
-            })
+        self._end_date = end_date
+        self._record_keys = new_keys
+        return self.history, self.expired_log
 
-        # ritorna due DataFrame
-        return pd.DataFrame(portfolio_history), pd.DataFrame(expired_options_log)
+    @staticmethod
+    def _join_symbol_matrix(prefix: Dict[str, Any], n_prefix: int,
+                            suffix: Dict[str, Any]) -> Dict[str, Any]:
+        """Prime `n_prefix` righe di `prefix` seguite da `suffix`, sull'unione dei simboli."""
+        symbols = sorted(set(prefix['symbols']) | set(suffix['symbols']))
+        index = {s: j for j, s in enumerate(symbols)}
+        n_suffix = suffix['pnl'].shape[0]
+        out = {'symbols': symbols}
+        for key in ('equity', 'pnl'):
+            values = np.zeros((n_prefix + n_suffix, len(symbols)))
+            values[:n_prefix, [index[s] for s in prefix['symbols']]] = prefix[key][:n_prefix]
+            values[n_prefix:, [index[s] for s in suffix['symbols']]] = suffix[key]
+            out[key] = values
+        return out
+
+    def symbol_frame(self, kind: str = 'pnl') -> pd.DataFrame:
+        """Matrice per simbolo ('pnl' o 'equity') come DataFrame date × simboli, per grafici e metriche."""
+        if self.history.empty:
+            return pd.DataFrame()
+        return pd.DataFrame(self.symbol_matrix[kind], index=pd.Index(self.history['date'], name='date'),
+                            columns=self.symbol_matrix['symbols'])
 
     @staticmethod
-    def get_current_positions(trades: list[dict]) -> tuple[dict, list[dict]]:
+    def get_current_positions(trades: Union[List[Dict], TradeTable]) -> Tuple[Dict, List[Dict]]:
         """
         Analizza i trade e restituisce le posizioni aperte separando azioni e opzioni.
         Restituisce una tupla: (stock_positions, open_options)
         - stock_positions: { simbolo: quantità_netta, ... }
-        - open_options: [ lista di dizionari dei trade di opzioni aperte ]
+        - open_options: [ lista di dizionari dei trade di opzioni con scadenza da oggi in poi ]
         """
-        stock_positions: dict[str, int] = {}
-        open_options: list[dict] = []
-        today = date.today()
-
-        for t in trades:
-            symbol = t['symbol']
-            
-            # --- Logica per le Azioni ---
-            if t['type'] == 'stock':
-                qty = t['quantity']
-                stock_positions[symbol] = stock_positions.get(symbol, 0) + qty
-            
-            # --- Logica per le Opzioni ---
-            elif t['type'] in ['put', 'call']:
-                expiry_date = t.get('expiry')
-                
-                # Un'opzione è considerata aperta se la sua data di scadenza è oggi o nel futuro.
-                if expiry_date and expiry_date >= today:
-                    open_options.append(t)
-
-        return stock_positions, open_options
+        table = trades if isinstance(trades, TradeTable) else TradeTable.from_records(trades)
+        return table.current_positions()
     
+    def metrics_key(self, history: pd.DataFrame) -> str:
+        """
+        Impronta di tutto ciò da cui dipendono le metriche: contenuto di trade,
+        flussi di cassa e storico, versione della matrice prezzi, ultimo dato
+        €STR e data odierna (i valori "ad oggi" cambiano col giorno).
+        """
+        return fingerprint(
+            self.trade_table.frame,
+            self.cash_flows,
+            history,
+            self.price_matrix.version,
+            risk_free_version(),
+            date.today(),
+        )
+
     def calculate_performance_metrics(
         self,
         history: pd.DataFrame
     ) -> Dict[str, Any]:
         """
-        Calcola metriche estese. Ora è un metodo di istanza.
+        Metriche estese, memorizzate per impronta del contenuto: un rerun di
+        Streamlit con gli stessi dati (o un'altra vista) non le ricalcola.
         """
         if history.empty:
             return {}
+        key = self.metrics_key(history)
+        hit, metrics = METRICS_CACHE.get(key)
+        if not hit:
+            metrics = self._compute_performance_metrics(history)
+            METRICS_CACHE.put(key, metrics)
+        # copia profonda: la cache è condivisa fra le sessioni e i valori annidati
+        # (es. P&L per simbolo) non devono essere modificabili da chi chiama
+        return copy.deepcopy(metrics)
+
+    def _compute_performance_metrics(
+        self,
+        history: pd.DataFrame
+    ) -> Dict[str, Any]:
+        """
+        Calcola metriche estese. Ora è un metodo di istanza.
+        """
 
         # Usa i dati dall'istanza (self)
         trades = self.trades
@@ -303,28 +730,24 @@ class PortfolioProcessor:
 
         # Calcoli iniziali (rendimenti, rf, etc.) rimangono uguali...
         ret = history['portfolio_value'].pct_change().dropna()
-        rf = fetch_risk_free_rate()
+        # risk-free giorno per giorno (€STR storico), sottratto ai rendimenti in blocco
+        rf_daily = self._risk_free_daily(history)
+        excess_ann = (ret - rf_daily.loc[ret.index]).mean() * 252
         ann_ret = ret.mean() * 252
         ann_vol = ret.std() * np.sqrt(252)
         total_pnl = history['equity_line_pnl'].iloc[-1]
         init_cf = history['cumulative_cash_flow'].iloc[0] or 1
         total_ret_pct = total_pnl / abs(init_cf) * 100
-        sharpe = (ann_ret - rf) / ann_vol if ann_vol > 0 else 0
+        sharpe = excess_ann / ann_vol if ann_vol > 0 else 0
         down_rets = ret[ret < 0]
         dd_std = down_rets.std() * np.sqrt(252)
-        sortino = (ann_ret - rf) / dd_std if dd_std > 0 else 0
+        sortino = excess_ann / dd_std if dd_std > 0 else 0
         #sortino = (twr_metrics.get("TWR", 0) - rf) / dd_std if dd_std > 0 else 0 
         var95 = -np.percentile(ret, 5) * history['portfolio_value'].iloc[-1]
-        eq = history['equity_line_pnl']
-        running_max = eq.cummax()
-        drawdown = running_max - eq
-        max_dd = drawdown.max()
-        durations, cur = [], 0
-        for flag in drawdown > 0:
-            cur = cur + 1 if flag else (durations.append(cur) or 0)
-        durations.append(cur)
-        max_dd_duration = max(durations)
-        total_comm = sum(t.get('commission', 0) for t in trades) if trades else 0
+        dd = compute_drawdown(history['equity_line_pnl'])
+        max_dd = dd["max_drawdown"]
+        max_dd_duration = dd["max_duration"]
+        total_comm = self.trade_table.frame['commission'].sum() if trades else 0
         comm_impact_pct = total_comm / abs(init_cf) * 100
 
         # --- BREAKDOWN P&L ---
@@ -332,28 +755,21 @@ class PortfolioProcessor:
         per_type_pnl = {}
 
         if trades:
-            df_t = pd.DataFrame(trades)
+            # trade dell'utente più le azioni consegnate alle scadenze
+            table = self.position_table
+            df_t = table.frame.assign(net_cf=table.net_cash_flow())
             today = history['date'].iloc[-1]
 
-            # Funzione helper per il cash flow
-            def net_cf(tr):
-                if tr['type'] == 'stock':
-                    return -tr['quantity'] * tr['stock_price'] - tr.get('commission', 0)
-                prem = tr.get('premium', 0)
-                sign = 1 if tr['quantity'] < 0 else -1
-                return sign * prem - tr.get('commission', 0)
-            df_t['net_cf'] = df_t.apply(net_cf, axis=1)
-
-            stock_positions, open_options = self.get_current_positions(trades)
+            stock_positions, open_options = table.current_positions()
             
             # --- 1. Calcolo P&L per le Azioni ---
             df_stock = df_t[df_t['type'] == 'stock']
-            stock_cf_by_symbol = df_stock.groupby('symbol')['net_cf'].sum()
+            stock_cf_by_symbol = df_stock.groupby('symbol', observed=True)['net_cf'].sum()
 
             stock_mv_by_symbol = {}
             for symbol, qty in stock_positions.items():
                 if qty != 0:
-                    price = self.get_price_on_date(self.historical_prices.get(symbol), today)
+                    price = self.price_matrix.price(symbol, today)
                     stock_mv_by_symbol[symbol] = qty * price
             
             stock_pnl_by_symbol = stock_cf_by_symbol.add(pd.Series(stock_mv_by_symbol, name='mv'), fill_value=0)
@@ -361,13 +777,13 @@ class PortfolioProcessor:
 
             # --- 2. Calcolo P&L per le Opzioni ---
             df_options = df_t[df_t['type'].isin(['put', 'call'])]
-            option_cf_by_symbol = df_options.groupby('symbol')['net_cf'].sum()
-            option_cf_by_type = df_options.groupby('type')['net_cf'].sum()
+            option_cf_by_symbol = df_options.groupby('symbol', observed=True)['net_cf'].sum()
+            option_cf_by_type = df_options.groupby('type', observed=True)['net_cf'].sum()
 
             option_mv_by_symbol = {}
             option_mv_by_type = {'put': 0.0, 'call': 0.0}
             for opt in open_options:
-                price_now = self.get_price_on_date(self.historical_prices.get(opt['symbol']), today)
+                price_now = self.price_matrix.price(opt['symbol'], today)
                 intrinsic = max(0, opt['strike'] - price_now) if opt['type'] == 'put' else max(0, price_now - opt['strike'])
                 market_value = intrinsic * abs(opt['quantity']) * opt.get('multiplier', 100)
                 market_value = -market_value if opt['quantity'] < 0 else market_value # Valore negativo per opzioni short
@@ -380,17 +796,27 @@ class PortfolioProcessor:
             per_type_pnl['call'] = option_cf_by_type.get('call', 0) + option_mv_by_type.get('call', 0)
 
             # --- 3. Calcolo P&L Totale per Simbolo ---
-            per_symbol_pnl = stock_pnl_by_symbol.add(option_pnl_by_symbol, fill_value=0).to_dict()
+            # dalla matrice del replay se copre questo storico (somma = P&L totale)
+            pnl_matrix = self.symbol_matrix['pnl']
+            if len(pnl_matrix) == len(history) and today == self._end_date:
+                per_symbol_pnl = {s: float(v) for s, v in zip(self.symbol_matrix['symbols'], pnl_matrix[-1])}
+            else:
+                per_symbol_pnl = stock_pnl_by_symbol.add(option_pnl_by_symbol, fill_value=0).to_dict()
         
-        # Calcoli TWR (rimangono uguali, ma usando self.calculate_twr)
+        # Calcoli TWR
         twr_metrics = {}
         if cash_flows:
-            twr_metrics = self.calculate_twr(history, cash_flows)
-            twr_daily = self.calculate_twr_daily_returns(history, cash_flows)
+            # un solo passaggio vettoriale per TWR totale, annualizzato e giornaliero
+            twr = compute_twr(history, cash_flows)
+            twr_metrics = {"TWR": twr["TWR"], "Annualized TWR": twr["Annualized TWR"]}
+            twr_daily = twr["daily"]
             if len(twr_daily) > 1:
-                mu = np.mean(twr_daily) * 252
+                # stessi giorni dei rendimenti TWR: quelli con valore precedente positivo
+                has_prev = (history['portfolio_value'].shift(1) > 0).to_numpy()[1:]
+                rf_twr = rf_daily.to_numpy()[1:][has_prev]
+                mu = np.mean(twr_daily - rf_twr) * 252
                 sigma = np.std(twr_daily) * np.sqrt(252)
-                sr_twr = (mu - rf) / sigma if sigma > 0 else 0
+                sr_twr = mu / sigma if sigma > 0 else 0
             else:
                 sr_twr = 0
             twr_metrics["TWR Sharpe Ratio"] = sr_twr
@@ -416,48 +842,31 @@ class PortfolioProcessor:
         }
         return out
 
+    @staticmethod
+    def _risk_free_daily(history: pd.DataFrame) -> pd.Series:
+        """
+        Tasso risk-free giornaliero (annuo / 252) per ogni riga dello storico,
+        dall'archivio locale €STR (aggiornato al login, mai da qui); se l'archivio
+        non copre lo storico, ultimo tasso salvato o CONFIG['risk_free_rate'] costante.
+        """
+        dates = pd.Index(pd.to_datetime(history['date']).dt.date)
+        series = fetch_risk_free_series(dates[0], dates[-1])
+        if series.empty:
+            last = last_risk_free_rate()
+            annual = np.full(len(history), CONFIG['risk_free_rate'] if last is None else last,
+                             dtype=float)
+        else:
+            annual = series.reindex(dates).to_numpy(dtype=float)
+        return pd.Series(annual / 252, index=history.index)
+
     @staticmethod
     def calculate_twr(history: pd.DataFrame,
                       cash_flows: List[Dict]) -> Dict[str, float]:
         """
         Time-Weighted Return (TWR) senza l’effetto dei flussi di cassa.
         """
-        if len(history) < 2:
-            return {"TWR": 0.0, "Annualized TWR": 0.0}
-
-        cash_flow_dates = {cf['date']: cf['amount'] for cf in cash_flows}
-        period_returns = []
-        previous_value = None
-
-        for idx, row in history.iterrows():
-            current_date = row['date']
-            current_value = row['portfolio_value']
-
-            if previous_value is None:
-                previous_value = current_value
-                continue
-
-            cash_flow = cash_flow_dates.get(current_date, 0)
-            if cash_flow != 0:
-                before = current_value - cash_flow
-                if previous_value > 0:
-                    period_returns.append((before / previous_value) - 1)
-                previous_value = current_value
-            elif idx == len(history) - 1:
-                if previous_value > 0:
-                    period_returns.append((current_value / previous_value) - 1)
-
-        twr = 1.0
-        for r in period_returns:
-            twr *= (1 + r)
-        twr -= 1
-
-        # annualizzazione
-        days = (history['date'].iloc[-1] - history['date'].iloc[0]).days
-        years = days / 365.25
-        ann = ((1 + twr) ** (1 / years) - 1) if years > 0 else twr
-
-        return {"TWR": twr, "Annualized TWR": ann}
+        twr = compute_twr(history, cash_flows)
+        return {"TWR": twr["TWR"], "Annualized TWR": twr["Annualized TWR"]}
 
     @staticmethod
     def calculate_twr_daily_returns(history: pd.DataFrame,
@@ -465,19 +874,7 @@ class PortfolioProcessor:
         """
         Ritorna i rendimenti giornalieri time-weighted.
         """
-        if len(history) < 2:
-            return []
-
-        cf_dates = {cf['date']: cf['amount'] for cf in cash_flows}
-        daily = []
-        for i in range(1, len(history)):
-            prev = history.iloc[i - 1]
-            curr = history.iloc[i]
-            cf = cf_dates.get(curr['date'], 0)
-            adj = curr['portfolio_value'] - cf if cf != 0 else curr['portfolio_value']
-            if prev['portfolio_value'] > 0:
-                daily.append((adj / prev['portfolio_value']) - 1)
-        return daily
+        return compute_twr(history, cash_flows)["daily"].tolist()
 
     @staticmethod
     def compute_contributions(trades: list[dict]) -> pd.DataFrame:
@@ -0,0 +1,133 @@
+# price_matrix.py
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Union
+
+
+class PriceMatrix:
+    """
+    Matrice dei prezzi di chiusura (giorni × simboli) su calendario giornaliero
+    continuo, già forward-filled. Costruita una volta dall'output di
+    `fetch_all_historical_data` (`from_wide`), rende le ricerche "as-of" letture dirette:
+    il prezzo di un giorno è l'ultima chiusura disponibile fino a quel giorno,
+    0.0 se non esiste ancora nessuna quotazione (stessa semantica di
+    `PortfolioProcessor.get_price_on_date`).
+    """
+
+    def __init__(self, start: date, symbols: List[str], values: np.ndarray):
+        self.start = start
+        self.symbols = list(symbols)
+        self.values = values
+        self._col = {s: j for j, s in enumerate(self.symbols)}
+        self._version: Optional[str] = None
+        self.dates = (np.datetime64(start, 'D')
+                      + np.arange(values.shape[0]).astype('timedelta64[D]'))
+
+    @classmethod
+    def empty(cls) -> "PriceMatrix":
+        return cls(date.today(), [], np.zeros((0, 0)))
+
+    @classmethod
+    def from_frames(cls, historical_prices: Dict[str, pd.DataFrame],
+                    start: date, end: date) -> "PriceMatrix":
+        """
+        Allinea le serie {simbolo: DataFrame['Close']} sul calendario
+        [min(start, prima quotazione), end].
+        """
+        frames = {s: df for s, df in historical_prices.items()
+                  if df is not None and not df.empty}
+        first = min([start] + [min(df.index) for df in frames.values()])
+        n_days = (end - first).days + 1
+        calendar = (np.datetime64(first, 'D')
+                    + np.arange(max(n_days, 0)).astype('timedelta64[D]'))
+
+        symbols = sorted(frames)
+        values = np.zeros((len(calendar), len(symbols)))
+        for j, symbol in enumerate(symbols):
+            df = frames[symbol]
+            raw_dates = np.array(df.index, dtype='datetime64[D]')
+            closes = df['Close'].to_numpy(dtype=float)
+            pos = np.searchsorted(raw_dates, calendar, side='right') - 1
+            values[:, j] = np.where(pos >= 0, closes[np.clip(pos, 0, None)], 0.0)
+        return cls(first, symbols, values)
+
+    @classmethod
+    def from_wide(cls, prices: pd.DataFrame, start: date, end: date) -> "PriceMatrix":
+        """Come `from_frames`, partendo dal frame allineato (date × simboli) del provider."""
+        frames = {s: prices[s].dropna().to_frame('Close') for s in prices.columns}
+        return cls.from_frames(frames, start, end)
+
+    @property
+    def version(self) -> str:
+        """
+        Impronta del contenuto (inizio, simboli, valori), calcolata una volta:
+        la matrice non viene mai modificata, un aggiornamento ne crea una nuova.
+        """
+        if self._version is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(self.start.isoformat().encode())
+            h.update("\x1f".join(self.symbols).encode())
+            h.update(np.ascontiguousarray(self.values).tobytes())
+            self._version = h.hexdigest()
+        return self._version
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._col
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def end(self) -> date:
+        return self.start + timedelta(days=len(self) - 1)
+
+    def row_of(self, day: date) -> int:
+        """Indice di riga per `day`, limitato all'ultimo giorno disponibile (-1 se prima dell'inizio)."""
+        return min((day - self.start).days, len(self) - 1)
+
+    def price(self, symbol: str, day: date) -> float:
+        """Prezzo as-of di `symbol` in `day`, lettura O(1)."""
+        j = self._col.get(symbol)
+        if j is None:
+            return 0.0
+        i = self.row_of(day)
+        return float(self.values[i, j]) if i >= 0 else 0.0
+
+    def column(self, symbol: str) -> np.ndarray:
+        """Serie giornaliera completa di `symbol` (zeri se il simbolo non è presente)."""
+        j = self._col.get(symbol)
+        if j is None:
+            return np.zeros(len(self))
+        return self.values[:, j]
+
+    def columns_of(self, symbols: Iterable[str]) -> np.ndarray:
+        """Indici di colonna per `symbols` (-1 per i simboli senza prezzi)."""
+        return np.array([self._col.get(s, -1) for s in symbols], dtype=int)
+
+    def window(self, start: date, n_days: int) -> np.ndarray:
+        """Righe della matrice per i `n_days` giorni a partire da `start` (righe a zero fuori range)."""
+        rows = (start - self.start).days + np.arange(n_days)
+        out = np.zeros((n_days, len(self.symbols)))
+        valid = (rows >= 0) & (rows < len(self))
+        out[valid] = self.values[rows[valid]]
+        return out
+
+    def asof(self, symbol: str,
+             days: Union[Iterable[date], np.ndarray]) -> np.ndarray:
+        """Prezzi as-of per date arbitrarie con un unico searchsorted vettoriale."""
+        days = np.asarray(days, dtype='datetime64[D]')
+        j = self._col.get(symbol)
+        if j is None or len(self) == 0:
+            return np.zeros(days.shape)
+        rows = np.searchsorted(self.dates, days, side='right') - 1
+        return np.where(rows >= 0, self.values[np.clip(rows, 0, None), j], 0.0)
+
+    def frame(self, symbols: Optional[List[str]] = None) -> pd.DataFrame:
+        """Vista DataFrame (indice date) della matrice, utile per grafici e debug."""
+        symbols = self.symbols if symbols is None else symbols
+        data = {s: self.column(s) for s in symbols}
+        return pd.DataFrame(data, index=pd.to_datetime(self.dates))
@@ -0,0 +1,158 @@
+# price_provider.py
+
+import os
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+
+def _with_data(frame: pd.DataFrame, symbols: List[str],
+               errors: Optional[Dict] = None) -> pd.DataFrame:
+    """Colonne dei soli `symbols` con almeno un dato e senza errore segnalato, nell'ordine richiesto."""
+    frame = frame.dropna(axis=1, how='all')
+    return frame[[s for s in symbols if s in frame.columns and s not in (errors or {})]]
+
+
+def _to_date_index(frame: pd.DataFrame) -> pd.DataFrame:
+    """Normalizza l'indice a oggetti `date` (senza timezone)."""
+    idx = pd.DatetimeIndex(frame.index)
+    if idx.tz is not None:
+        idx = idx.tz_localize(None)
+    frame.index = idx.date
+    return frame
+
+
+class RateLimitError(Exception):
+    """Il provider ha segnalato throttling (HTTP 429 / Too Many Requests)."""
+
+
+class NoDataError(KeyError):
+    """Il provider ha risposto senza errori ma senza alcun dato per il simbolo."""
+
+
+class PriceProvider:
+    """
+    Sorgente dei prezzi di chiusura. Le implementazioni forniscono `fetch_many`:
+    molti simboli, un intervallo di date (estremi inclusi), un unico DataFrame
+    allineato con indice `date`, una colonna per simbolo e NaN dove manca il dato.
+    I simboli senza alcun dato (delistati, ticker errati, errori di rete) non
+    compaiono come colonne: chi chiama li tratta come falliti e li riprova.
+    """
+    # se True i prezzi scaricati vengono salvati nell'archivio su disco
+    persistent_cache = True
+
+    def fetch_many(self, symbols: List[str], start: date, end: date) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def fetch(self, symbol: str, start: date, end: date) -> pd.Series:
+        """Chiusure di un singolo simbolo, senza NaN."""
+        frame = self.fetch_many([symbol], start, end)
+        if symbol not in frame:
+            return pd.Series(dtype=float, name=symbol)
+        return frame[symbol].dropna()
+
+
+# yf.download scrive gli errori nel dict globale yf.shared._ERRORS e lo azzera
+# a ogni chiamata: download e lettura degli errori devono essere atomici
+_YF_LOCK = threading.Lock()
+
+
+class YFinanceProvider(PriceProvider):
+    """
+    Prezzi adjusted da Yahoo Finance con un solo download per tutti i simboli.
+    I download sono serializzati (vedi _YF_LOCK): lo scheduler li esegue in
+    thread paralleli, ma ogni blocco legge solo i propri errori.
+    """
+
+    def fetch_many(self, symbols: List[str], start: date, end: date) -> pd.DataFrame:
+        if not symbols:
+            return pd.DataFrame()
+        import yfinance as yf  # import pesante, rimandato al primo download
+
+        with _YF_LOCK:
+            raw = yf.download(
+                list(symbols),
+                start=start.isoformat(),
+                end=(end + timedelta(days=1)).isoformat(),
+                auto_adjust=True,
+                progress=False,
+                threads=False,
+            )
+            # yf.download non solleva eccezioni: gli errori per simbolo finiscono in yf.shared._ERRORS
+            errors = dict(getattr(getattr(yf, 'shared', None), '_ERRORS', {}) or {})
+        throttled = [s for s in symbols
+                     if any(k in str(errors.get(s, '')) for k in ('Rate', 'Too Many Requests', '429'))]
+        if throttled:
+            raise RateLimitError(f"Rate limit Yahoo Finance per {', '.join(throttled)}")
+        if raw is None or raw.empty:
+            return pd.DataFrame()
+        close = raw['Close']
+        if isinstance(close, pd.Series):
+            close = close.to_frame(symbols[0])
+        close = _to_date_index(close.copy())
+        return _with_data(close, list(symbols), errors)
+
+
+class FixtureProvider(PriceProvider):
+    """
+    Prezzi da file locali, per eseguire e misurare tutta la pipeline offline.
+    `path` può essere:
+     - un file CSV/Parquet "largo": prima colonna la data, una colonna per simbolo;
+     - una cartella con un file per simbolo (<SIMBOLO>.csv o <SIMBOLO>.parquet)
+       con colonne Date e Close.
+    """
+    persistent_cache = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._wide: Optional[pd.DataFrame] = None
+        self._per_symbol: Dict[str, pd.Series] = {}
+
+    @staticmethod
+    def _read(path: str) -> pd.DataFrame:
+        if path.endswith(".parquet"):
+            frame = pd.read_parquet(path)
+            if not isinstance(frame.index, pd.DatetimeIndex):
+                frame = frame.set_index(frame.columns[0])
+        else:
+            frame = pd.read_csv(path, index_col=0)
+        frame.index = pd.to_datetime(frame.index)
+        return _to_date_index(frame.sort_index())
+
+    def _series(self, symbol: str) -> pd.Series:
+        if os.path.isdir(self.path):
+            if symbol not in self._per_symbol:
+                series = pd.Series(dtype=float, name=symbol)
+                for ext in (".csv", ".parquet"):
+                    file = os.path.join(self.path, f"{symbol}{ext}")
+                    if os.path.exists(file):
+                        series = self._read(file)['Close'].rename(symbol)
+                        break
+                self._per_symbol[symbol] = series
+            return self._per_symbol[symbol]
+
+        if self._wide is None:
+            self._wide = self._read(self.path)
+        if symbol not in self._wide:
+            return pd.Series(dtype=float, name=symbol)
+        return self._wide[symbol]
+
+    def fetch_many(self, symbols: List[str], start: date, end: date) -> pd.DataFrame:
+        if not symbols:
+            return pd.DataFrame()
+        frame = pd.concat([self._series(s).rename(s) for s in symbols], axis=1)
+        frame = frame[(frame.index >= start) & (frame.index <= end)] if len(frame) else frame
+        return _with_data(frame, list(symbols))
+
+
+def provider_from_env(spec: Optional[str] = None) -> PriceProvider:
+    """
+    Crea il provider indicato da `spec` o dalla variabile PRICE_PROVIDER:
+    "yfinance" (default) oppure "fixture:<percorso file o cartella>".
+    """
+    spec = spec or os.getenv("PRICE_PROVIDER", "yfinance")
+    if spec.startswith("fixture:"):
+        return FixtureProvider(spec.split(":", 1)[1])
+    return YFinanceProvider()
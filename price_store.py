@@ -0,0 +1,168 @@
+# price_store.py
+
+import os
+import sqlite3
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from price_provider import NoDataError
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "prices.sqlite")
+
+Range = Tuple[date, date]
+
+
+class PriceStore:
+    """
+    Archivio locale (SQLite) delle chiusure giornaliere per simbolo.
+    Oltre ai prezzi registra gli intervalli di date già scaricati (`coverage`),
+    così una richiesta scarica solo i buchi o la coda mancante.
+    Il file sopravvive ai riavvii ed è condiviso da tutte le sessioni del server.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("PRICE_CACHE_PATH") or DEFAULT_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS prices ("
+                " symbol TEXT NOT NULL, date TEXT NOT NULL, close REAL,"
+                " PRIMARY KEY (symbol, date))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                " symbol TEXT NOT NULL, start TEXT NOT NULL, end TEXT NOT NULL,"
+                " PRIMARY KEY (symbol, start))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # una connessione per operazione: lo store viene usato da più thread
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # ——————————————————————————————————————————————
+    # Intervalli coperti
+    # ——————————————————————————————————————————————
+    def coverage(self, symbol: str) -> List[Range]:
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT start, end FROM coverage WHERE symbol = ? ORDER BY start", (symbol,)
+            ).fetchall()
+        return [(date.fromisoformat(s), date.fromisoformat(e)) for s, e in rows]
+
+    def missing_ranges(self, symbol: str, start: date, end: date) -> List[Range]:
+        """Sotto-intervalli di [start, end] non ancora scaricati."""
+        gaps: List[Range] = []
+        cursor = start
+        for cov_start, cov_end in self.coverage(symbol):
+            if cov_end < cursor:
+                continue
+            if cov_start > end:
+                break
+            if cov_start > cursor:
+                gaps.append((cursor, cov_start - timedelta(days=1)))
+            cursor = max(cursor, cov_end + timedelta(days=1))
+            if cursor > end:
+                break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _mark_covered(self, con: sqlite3.Connection, symbol: str, start: date, end: date) -> None:
+        """Aggiunge [start, end] alla copertura fondendo gli intervalli sovrapposti o adiacenti."""
+        rows = con.execute(
+            "SELECT start, end FROM coverage WHERE symbol = ? ORDER BY start", (symbol,)
+        ).fetchall()
+        ranges = sorted([(date.fromisoformat(s), date.fromisoformat(e)) for s, e in rows]
+                        + [(start, end)])
+        merged: List[List[date]] = []
+        for s, e in ranges:
+            if merged and s <= merged[-1][1] + timedelta(days=1):
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        con.execute("DELETE FROM coverage WHERE symbol = ?", (symbol,))
+        con.executemany(
+            "INSERT INTO coverage (symbol, start, end) VALUES (?, ?, ?)",
+            [(symbol, s.isoformat(), e.isoformat()) for s, e in merged]
+        )
+
+    # ——————————————————————————————————————————————
+    # Lettura / scrittura
+    # ——————————————————————————————————————————————
+    def write(self, symbol: str, closes: pd.Series,
+              covered: Optional[Range] = None) -> None:
+        """Salva le chiusure scaricate e, se indicato, segna l'intervallo `covered` come coperto."""
+        records = [(symbol, d.isoformat(), float(c)) for d, c in closes.dropna().items()]
+        with self._connect() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO prices (symbol, date, close) VALUES (?, ?, ?)", records
+            )
+            if covered is not None:
+                self._mark_covered(con, symbol, *covered)
+
+    def read_many(self, symbols: List[str], start: date, end: date) -> pd.DataFrame:
+        """Chiusure salvate in [start, end] come DataFrame allineato (date × simboli)."""
+        placeholders = ", ".join("?" for _ in symbols)
+        with self._connect() as con:
+            rows = con.execute(
+                f"SELECT date, symbol, close FROM prices WHERE symbol IN ({placeholders})"
+                " AND date BETWEEN ? AND ?",
+                (*symbols, start.isoformat(), end.isoformat())
+            ).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=list(symbols))
+        frame = (pd.DataFrame(rows, columns=['date', 'symbol', 'close'])
+                   .pivot(index='date', columns='symbol', values='close')
+                   .sort_index())
+        frame.index = [date.fromisoformat(d) for d in frame.index]
+        frame.columns.name = None
+        return frame.reindex(columns=list(symbols))
+
+    def get_many(self, symbols: List[str], start: date, end: date,
+                 download: Callable[[List[str], date, date, Dict[str, Exception]], pd.DataFrame],
+                 failures: Optional[Dict[str, Exception]] = None) -> pd.DataFrame:
+        """
+        Restituisce le chiusure di [start, end] per tutti i `symbols` come frame
+        allineato. I simboli con lo stesso buco (tipicamente la coda fino a oggi)
+        vengono scaricati insieme con una sola chiamata a `download`, che riporta
+        gli errori per simbolo nel dict ricevuto.
+        Un buco senza dati ma senza errori (NoDataError: festività, simbolo non
+        ancora quotato) viene comunque segnato come coperto, così non si riscarica;
+        con errori di rete o throttling resta scoperto e si riprova alla prossima
+        richiesta. La giornata odierna non viene mai segnata come coperta, perché
+        la sua chiusura non è ancora definitiva.
+        In `failures` finiscono solo gli errori dei buchi rimasti scoperti.
+        """
+        today = date.today()
+        by_gap: Dict[Range, List[str]] = defaultdict(list)
+        for symbol in symbols:
+            for gap in self.missing_ranges(symbol, start, end):
+                by_gap[gap].append(symbol)
+
+        for (gap_start, gap_end), gap_symbols in by_gap.items():
+            gap_failures: Dict[str, Exception] = {}
+            closes = download(gap_symbols, gap_start, gap_end, gap_failures)
+            covered_end = min(gap_end, today - timedelta(days=1))
+            covered = (gap_start, covered_end) if covered_end >= gap_start else None
+            for symbol in gap_symbols:
+                error = gap_failures.get(symbol)
+                if symbol in closes and closes[symbol].notna().any():
+                    self.write(symbol, closes[symbol], covered)
+                elif error is None or isinstance(error, NoDataError):
+                    # risposta riuscita ma vuota: nessun prezzo, intervallo coperto
+                    if covered is not None:
+                        self.write(symbol, pd.Series(dtype=float), covered)
+                elif failures is not None:
+                    failures[symbol] = error
+        return self.read_many(symbols, start, end)
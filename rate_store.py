@@ -0,0 +1,147 @@
+# rate_store.py
+
+import io
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Optional
+
+import pandas as pd
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "rates.sqlite")
+
+# €STR giornaliero (tasso di interesse, %) dal Data Portal della BCE
+ESTR = "EST/B.EU000A2X2A25.WT"
+ECB_URL = "https://data-api.ecb.europa.eu/service/data/{key}"
+# prima pubblicazione dell'€STR
+ESTR_START = date(2019, 10, 1)
+
+
+def parse_rate_csv(text: str) -> pd.Series:
+    """
+    Serie di tassi annui in decimale indicizzata per `date`, da:
+     - CSV del Data Portal BCE (colonne TIME_PERIOD, OBS_VALUE in %);
+     - CSV semplice a due colonne (data, tasso in %).
+    """
+    frame = pd.read_csv(io.StringIO(text))
+    if {"TIME_PERIOD", "OBS_VALUE"} <= set(frame.columns):
+        frame = frame[["TIME_PERIOD", "OBS_VALUE"]]
+    else:
+        frame = frame.iloc[:, :2]
+    frame.columns = ["date", "value"]
+    frame["date"] = pd.to_datetime(frame["date"], errors="coerce")
+    frame["value"] = pd.to_numeric(frame["value"], errors="coerce")
+    frame = frame.dropna().sort_values("date")
+    return pd.Series((frame["value"] / 100).to_numpy(), index=frame["date"].dt.date.to_numpy(), name="rate")
+
+
+def download_rates(source: str, start: date) -> pd.Series:
+    """
+    Osservazioni da `start` in poi. `source` è "ecb" (Data Portal BCE) oppure
+    "file:<percorso>" per lavorare offline da un CSV salvato.
+    """
+    if source.startswith("file:"):
+        with open(source.split(":", 1)[1], encoding="utf-8") as f:
+            series = parse_rate_csv(f.read())
+        return series[series.index >= start]
+
+    import requests  # import ritardato: serve solo all'aggiornamento
+
+    response = requests.get(
+        ECB_URL.format(key=ESTR),
+        params={"format": "csvdata", "startPeriod": start.isoformat()},
+        timeout=10,
+    )
+    # 404 = nessuna osservazione nuova dopo `start`
+    if response.status_code == 404:
+        return pd.Series(dtype=float, name="rate")
+    response.raise_for_status()
+    if not response.text.strip():
+        return pd.Series(dtype=float, name="rate")
+    return parse_rate_csv(response.text)
+
+
+class RateStore:
+    """
+    Archivio locale (SQLite) delle serie giornaliere dei tassi risk-free.
+    L'aggiornamento è incrementale (solo le osservazioni dopo l'ultima salvata)
+    e avviene al massimo una volta al giorno; le metriche leggono soltanto da qui,
+    quindi non aspettano mai una richiesta HTTP.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("RATE_CACHE_PATH") or DEFAULT_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS rates ("
+                " series TEXT NOT NULL, date TEXT NOT NULL, value REAL NOT NULL,"
+                " PRIMARY KEY (series, date))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS checked ("
+                " series TEXT PRIMARY KEY, day TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def last_date(self, series: str) -> Optional[date]:
+        with self._connect() as con:
+            row = con.execute("SELECT MAX(date) FROM rates WHERE series = ?", (series,)).fetchone()
+        return date.fromisoformat(row[0]) if row and row[0] else None
+
+    def last_checked(self, series: str) -> Optional[date]:
+        with self._connect() as con:
+            row = con.execute("SELECT day FROM checked WHERE series = ?", (series,)).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def write(self, series: str, values: pd.Series, checked: Optional[date] = None) -> None:
+        with self._connect() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO rates (series, date, value) VALUES (?, ?, ?)",
+                [(series, d.isoformat(), float(v)) for d, v in values.dropna().items()]
+            )
+            if checked is not None:
+                con.execute(
+                    "INSERT OR REPLACE INTO checked (series, day) VALUES (?, ?)",
+                    (series, checked.isoformat())
+                )
+
+    def read(self, series: str, start: date, end: date) -> pd.Series:
+        """
+        Tassi annui (decimali) fra start ed end, più l'ultima osservazione
+        precedente a `start` per poter propagare il valore in avanti.
+        """
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT date, value FROM rates WHERE series = ? AND date <= ?"
+                " AND date >= COALESCE((SELECT MAX(date) FROM rates"
+                "                      WHERE series = ? AND date <= ?), ?)"
+                " ORDER BY date",
+                (series, end.isoformat(), series, start.isoformat(), start.isoformat())
+            ).fetchall()
+        if not rows:
+            return pd.Series(dtype=float, name="rate")
+        return pd.Series([v for _, v in rows], index=[date.fromisoformat(d) for d, _ in rows], name="rate")
+
+    def refresh(self, series: str, source: str, today: Optional[date] = None) -> bool:
+        """
+        Scarica le osservazioni successive all'ultima salvata, se oggi non è
+        già stato fatto. Restituisce True se è stato fatto un download.
+        """
+        today = today or date.today()
+        if self.last_checked(series) == today:
+            return False
+        last = self.last_date(series)
+        start = last + timedelta(days=1) if last else ESTR_START
+        self.write(series, download_rates(source, start), checked=today)
+        return True
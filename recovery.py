@@ -0,0 +1,95 @@
+# recovery.py
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+# orizzonti in giorni di borsa: 1, 3, 6 e 12 mesi
+HORIZONS = (21, 63, 126, 252)
+# giorni-percorso simulati per blocco di lavoro (~ 8 MB di float64)
+CHUNK_CELLS = 1_000_000
+
+
+def block_bootstrap(returns: np.ndarray, n_paths: int, horizon: int, block: int,
+                    rng: np.random.Generator) -> np.ndarray:
+    """
+    Percorsi di rendimenti (n_paths × horizon) ricampionati a blocchi circolari
+    di `block` giorni consecutivi: conserva l'autocorrelazione di breve periodo
+    (volatilità a grappoli) che un bootstrap giorno per giorno perderebbe.
+    """
+    n_blocks = -(-horizon // block)
+    starts = rng.integers(0, len(returns), size=(n_paths, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block)) % len(returns)
+    return returns[idx.reshape(n_paths, -1)[:, :horizon]]
+
+
+def _first_hits(returns: np.ndarray, target: float, n_paths: int, horizon: int,
+                block: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Giorno (1..horizon) in cui ogni percorso raggiunge il fattore di crescita
+    `target`; horizon + 1 per i percorsi che non recuperano.
+    """
+    paths = block_bootstrap(returns, n_paths, horizon, block, np.random.default_rng(seed))
+    growth = np.cumprod(1 + paths, axis=1)
+    hit = growth >= target
+    return np.where(hit.any(axis=1), hit.argmax(axis=1) + 1, horizon + 1)
+
+
+def _first_hits_job(args: tuple) -> np.ndarray:
+    return _first_hits(*args)
+
+
+def simulate_recovery(returns: Sequence[float], drawdown: float, value: float,
+                      horizons: Sequence[int] = HORIZONS, n_paths: int = 20_000,
+                      block: Optional[int] = None, seed: int = 0,
+                      workers: Optional[int] = None,
+                      parallel_threshold: int = 200_000) -> Dict[str, Any]:
+    """
+    Probabilità e tempi di recupero dal drawdown corrente con un Monte Carlo
+    a blocchi sui rendimenti giornalieri storici (senza flussi di cassa futuri):
+    il recupero avviene quando il valore `value` cresce di `drawdown` dollari.
+     - probabilities: {orizzonte: probabilità di recupero entro l'orizzonte};
+     - expected_days / median_days: tempo di recupero dei percorsi che recuperano
+       entro l'orizzonte più lungo (None se nessuno).
+    I percorsi sono simulati a blocchi di CHUNK_CELLS giorni-percorso, ognuno con
+    un seme derivato da `seed`: il risultato non dipende da quanti processi si usano.
+    Con `workers` > 1 e almeno `parallel_threshold` percorsi i blocchi vanno in
+    un pool di processi.
+    """
+    returns = np.asarray(returns, dtype=float)
+    returns = returns[np.isfinite(returns)]
+    horizons = sorted(set(int(h) for h in horizons))
+    horizon = horizons[-1]
+    block = block or max(1, int(round(len(returns) ** (1 / 3))))
+    result = {"n_paths": n_paths, "block": block, "horizon": horizon,
+              "target_return": 0.0, "probabilities": {h: 1.0 for h in horizons},
+              "expected_days": 0.0, "median_days": 0.0}
+
+    if drawdown <= 0:
+        return result
+    if len(returns) < 2 or value <= 0:
+        result.update(probabilities={h: 0.0 for h in horizons},
+                      expected_days=None, median_days=None)
+        return result
+
+    target = 1 + drawdown / value
+    per_chunk = max(1, CHUNK_CELLS // horizon)
+    sizes = [min(per_chunk, n_paths - i) for i in range(0, n_paths, per_chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(returns, target, size, horizon, block, s) for size, s in zip(sizes, seeds)]
+
+    if workers and workers > 1 and n_paths >= parallel_threshold and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            hits = np.concatenate(list(pool.map(_first_hits_job, jobs)))
+    else:
+        hits = np.concatenate([_first_hits_job(job) for job in jobs])
+
+    recovered = hits[hits <= horizon]
+    result.update(
+        target_return=target - 1,
+        probabilities={h: float(np.mean(hits <= h)) for h in horizons},
+        expected_days=float(recovered.mean()) if len(recovered) else None,
+        median_days=float(np.median(recovered)) if len(recovered) else None,
+    )
+    return result
@@ -0,0 +1,90 @@
+# session_loader.py
+
+import asyncio
+import threading
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List
+
+import streamlit as st
+
+from data_fetcher import fetch_price_frame, get_price_provider, refresh_risk_free_series
+from data_store import CASHFLOW_COLUMNS, sync_rows, sync_trade_table
+from trade_store import TradeTable
+
+
+def _in_script_context(fn: Callable) -> Callable:
+    """
+    Propaga il contesto della sessione Streamlit al thread di lavoro: senza,
+    st.cache_data e st.warning/st.error chiamati nel thread vengono ignorati.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return fn
+    ctx = get_script_run_ctx()
+
+    def wrapped(*args):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args)
+    return wrapped
+
+
+def _prefetch_prices(trades: List[Dict]) -> None:
+    """Scalda l'archivio prezzi con i simboli dei trade, fino a oggi."""
+    symbols = sorted({t['symbol'] for t in trades})
+    if not symbols or not get_price_provider().persistent_cache:
+        return
+    start = min(t['date'] for t in trades) - timedelta(days=7)
+    fetch_price_frame(symbols, start, date.today())
+
+
+def _loaded_rows(result: Any, what: str) -> Any:
+    """
+    Risultato di un task di caricamento avviato con return_exceptions=True; in
+    caso di errore mostra lo stesso avviso del caricamento sincrono e restituisce [].
+    """
+    if not isinstance(result, BaseException):
+        return result
+    if not isinstance(result, Exception):
+        raise result  # cancellazione / interruzione: non è un errore di caricamento
+    from postgrest import APIError  # già caricato dal client Supabase a questo punto
+    if isinstance(result, APIError):
+        st.error(f"❌ Supabase APIError nel caricamento dei {what}: {result.message}")
+    elif isinstance(result, RuntimeError):
+        # credenziali mancanti o utente non loggato
+        st.warning(f"Caricamento dei {what} non riuscito: {result}")
+    else:
+        # errori di rete (httpx) o inattesi: la pagina resta utilizzabile
+        st.error(f"❌ Connessione a Supabase non riuscita nel caricamento dei {what}: {result}")
+    return []
+
+
+async def load_session_data(user_id: str, client=None) -> Dict[str, Any]:
+    """
+    Carica in parallelo tutto ciò che serve alla prima dashboard:
+     - trade (già come TradeTable) e flussi di cassa (sync incrementale) nello stesso momento;
+     - prefetch dei prezzi appena arrivano i trade, senza aspettare i flussi;
+     - aggiornamento incrementale dello storico €STR usato dalle metriche.
+    Il tempo totale è circa quello della richiesta più lenta, non la somma.
+    `user_id` è passato esplicitamente perché i thread non leggono st.session_state.
+    """
+    def run(fn: Callable, *args) -> asyncio.Task:
+        return asyncio.create_task(asyncio.to_thread(_in_script_context(fn), *args))
+
+    trades_task = run(sync_trade_table, user_id, client)
+    cash_task = run(sync_rows, "cashflows", user_id, client, None, CASHFLOW_COLUMNS)
+    rf_task = run(refresh_risk_free_series)
+
+    (loaded,) = await asyncio.gather(trades_task, return_exceptions=True)
+    trades, trade_table = _loaded_rows(loaded, "trade") or ([], TradeTable.from_records([]))
+    # il prefetch è solo un'ottimizzazione: un errore qui non blocca il caricamento
+    prices_task = run(_prefetch_prices, trades)
+
+    (cash_flows,) = await asyncio.gather(cash_task, return_exceptions=True)
+    cash_flows = _loaded_rows(cash_flows, "flussi di cassa")
+    risk_free_rate, _ = await asyncio.gather(rf_task, prices_task, return_exceptions=True)
+    if isinstance(risk_free_rate, Exception):
+        risk_free_rate = None
+
+    return {"trades": trades, "trade_table": trade_table,
+            "cash_flows": cash_flows, "risk_free_rate": risk_free_rate}
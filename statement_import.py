@@ -0,0 +1,292 @@
+# statement_import.py
+
+from typing import Callable, Dict, IO, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from trade_store import TRADE_TYPES, TradeTable
+from write_queue import WriteBehindQueue
+
+# Formati supportati:
+#  - "generic": CSV con le colonne dello schema (date, symbol, type, quantity, ...);
+#  - "ibkr": Flex Query di Interactive Brokers (sezione Trades o Cash Transactions).
+FORMATS = ["generic", "ibkr"]
+
+TRADE_COLUMNS = ["id", "date", "symbol", "type", "quantity", "strike", "expiry",
+                 "premium", "stock_price", "commission", "multiplier", "note"]
+CASHFLOW_COLUMNS = ["id", "date", "amount", "note"]
+
+
+def _dates(col: pd.Series) -> pd.Series:
+    """Date in formato ISO, YYYYMMDD o "YYYYMMDD;HHMMSS" (Flex) → datetime64 normalizzato."""
+    text = col.fillna("").astype(str).str.split(";").str[0].str.strip()
+    compact = text.str.fullmatch(r"\d{8}").fillna(False).astype(bool)
+    out = pd.to_datetime(text.where(~compact), format="mixed", errors="coerce")
+    out = out.mask(compact, pd.to_datetime(text.where(compact), format="%Y%m%d", errors="coerce"))
+    return out.dt.normalize()
+
+
+def _num(df: pd.DataFrame, col: str, default: float = 0.0) -> pd.Series:
+    if col not in df:
+        return pd.Series(default, index=df.index, dtype="float64")
+    return pd.to_numeric(df[col], errors="coerce").fillna(default).astype("float64")
+
+
+def _text(df: pd.DataFrame, col: str, default: str = "") -> pd.Series:
+    if col not in df:
+        return pd.Series(default, index=df.index, dtype=object)
+    return df[col].fillna(default).astype(str).str.strip()
+
+
+# ——————————————————————————————————————————————
+# Mapping verso lo schema di Supabase
+# ——————————————————————————————————————————————
+def map_trades(chunk: pd.DataFrame, fmt: str) -> pd.DataFrame:
+    """Converte un blocco del file nelle colonne di public.trades (premio totale, commissioni positive)."""
+    if fmt == "ibkr":
+        asset = _text(chunk, "AssetClass").str.upper()
+        is_opt = asset.eq("OPT")
+        right = _text(chunk, "Put/Call").str.upper().str[:1]
+        qty = _num(chunk, "Quantity")
+        price = _num(chunk, "TradePrice")
+        mult = _num(chunk, "Multiplier", 100.0).where(is_opt, 1.0)
+        date_ = _dates(chunk["TradeDate"])
+        out = pd.DataFrame({
+            "date": date_,
+            "symbol": _text(chunk, "UnderlyingSymbol").where(is_opt, _text(chunk, "Symbol")).str.upper(),
+            "type": np.select([~is_opt, right.eq("P"), right.eq("C")], ["stock", "put", "call"], ""),
+            "quantity": qty,
+            "strike": _num(chunk, "Strike").where(is_opt, 0.0),
+            "expiry": _dates(chunk["Expiry"]).where(is_opt, date_) if "Expiry" in chunk else date_,
+            "premium": (price * qty * mult).abs().where(is_opt, 0.0),
+            "stock_price": price.where(~is_opt, 0.0),
+            "commission": _num(chunk, "IBCommission").abs(),
+            "multiplier": mult,
+            "note": ("IBKR " + _text(chunk, "TradeID")).str.strip(),
+        }, index=chunk.index)
+        # righe non azioni/opzioni (forex, future, ...) scartate come non valide
+        out.loc[~asset.isin(["STK", "OPT"]), "type"] = ""
+        return out
+
+    types = _text(chunk, "type").str.lower()
+    is_stock = types.eq("stock")
+    date_ = _dates(chunk["date"]) if "date" in chunk else pd.Series(pd.NaT, index=chunk.index)
+    expiry = _dates(chunk["expiry"]) if "expiry" in chunk else pd.Series(pd.NaT, index=chunk.index)
+    return pd.DataFrame({
+        "date": date_,
+        "symbol": _text(chunk, "symbol").str.upper(),
+        "type": types,
+        "quantity": _num(chunk, "quantity"),
+        "strike": _num(chunk, "strike"),
+        # come nei form: per le azioni la scadenza coincide con la data del trade
+        "expiry": expiry.where(~is_stock, date_),
+        "premium": _num(chunk, "premium").abs(),
+        "stock_price": _num(chunk, "stock_price"),
+        "commission": _num(chunk, "commission").abs(),
+        "multiplier": (_num(chunk, "multiplier", 100.0) if "multiplier" in chunk
+                       else pd.Series(100.0, index=chunk.index).where(~is_stock, 1.0)),
+        "note": _text(chunk, "note"),
+    }, index=chunk.index)
+
+
+def map_cashflows(chunk: pd.DataFrame, fmt: str) -> pd.DataFrame:
+    """Converte un blocco del file nelle colonne di public.cashflows."""
+    if fmt == "ibkr":
+        if "Type" in chunk:
+            chunk = chunk[_text(chunk, "Type").str.contains("Deposit|Withdrawal", case=False)]
+        date_col = "SettleDate" if "SettleDate" in chunk else "Date/Time"
+        return pd.DataFrame({
+            "date": _dates(chunk[date_col]),
+            "amount": _num(chunk, "Amount", np.nan),
+            "note": _text(chunk, "Description"),
+        }, index=chunk.index)
+    return pd.DataFrame({
+        "date": _dates(chunk["date"]) if "date" in chunk else pd.Series(pd.NaT, index=chunk.index),
+        "amount": _num(chunk, "amount", np.nan),
+        "note": _text(chunk, "note"),
+    }, index=chunk.index)
+
+
+# ——————————————————————————————————————————————
+# Validazione e chiavi di deduplica (vettoriali)
+# ——————————————————————————————————————————————
+def validate_trades(df: pd.DataFrame) -> pd.Series:
+    """Motivo di scarto per riga ("" = valida), calcolato con maschere vettoriali."""
+    is_stock = df["type"].eq("stock")
+    is_opt = df["type"].isin(["put", "call"])
+    checks = [
+        (df["date"].isna(), "data non valida"),
+        (df["symbol"].eq(""), "simbolo mancante"),
+        (~df["type"].isin(TRADE_TYPES), "tipo non valido"),
+        (df["quantity"].eq(0), "quantità nulla"),
+        (is_stock & (df["stock_price"] <= 0), "prezzo azione non valido"),
+        (is_opt & (df["strike"] <= 0), "strike non valido"),
+        (is_opt & (df["expiry"].isna() | (df["expiry"] < df["date"])), "scadenza non valida"),
+        (is_opt & (df["multiplier"] <= 0), "moltiplicatore non valido"),
+    ]
+    reason = pd.Series("", index=df.index, dtype=object)
+    # il primo controllo fallito vince: si applicano in ordine inverso
+    for mask, label in reversed(checks):
+        reason = reason.mask(mask, label)
+    return reason
+
+
+def validate_cashflows(df: pd.DataFrame) -> pd.Series:
+    reason = pd.Series("", index=df.index, dtype=object)
+    reason = reason.mask(df["amount"].isna() | df["amount"].eq(0), "importo non valido")
+    return reason.mask(df["date"].isna(), "data non valida")
+
+
+def _content_frame(df: pd.DataFrame, kind: str) -> pd.DataFrame:
+    """Campi che identificano un movimento, con tipi canonici per un hash stabile."""
+    if kind == "cashflows":
+        return pd.DataFrame({
+            "date": df["date"].dt.strftime("%Y-%m-%d"),
+            "amount": df["amount"].astype("float64").round(2),
+        })
+    is_stock = df["type"].astype(str).eq("stock")
+    return pd.DataFrame({
+        "date": df["date"].dt.strftime("%Y-%m-%d"),
+        "symbol": df["symbol"].astype(str),
+        "type": df["type"].astype(str),
+        "quantity": df["quantity"].astype("float64").round(4),
+        "strike": df["strike"].astype("float64").round(4).where(~is_stock, 0.0),
+        "expiry": df["expiry"].dt.strftime("%Y-%m-%d").where(~is_stock, "").fillna(""),
+        "premium": df["premium"].astype("float64").round(2).where(~is_stock, 0.0),
+        "stock_price": df["stock_price"].astype("float64").round(4).where(is_stock, 0.0),
+    })
+
+
+class _KeyCounter:
+    """
+    Chiave di deduplica = (utente, contenuto, occorrenza): due fill identici nello
+    stesso file restano distinti, mentre reimportare lo stesso file (o un estratto
+    sovrapposto) produce le stesse chiavi e quindi gli stessi id. L'utente fa parte
+    della chiave: lo stesso fill importato da due account dà id diversi.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = str(user_id)
+        # occorrenze già viste per hash di contenuto (8+8 byte per movimento distinto)
+        self.seen = pd.Series(dtype="int64")
+
+    def keys(self, content: pd.DataFrame) -> pd.DataFrame:
+        h = pd.util.hash_pandas_object(content, index=False)
+        prior = h.map(self.seen).fillna(0).astype("int64")
+        occurrence = h.groupby(h.values).cumcount() + prior
+        self.seen = self.seen.add(h.value_counts(), fill_value=0).astype("int64")
+        keyed = pd.DataFrame({"user": self.user_id, "h": h.values, "occ": occurrence.values},
+                             index=content.index)
+        # due hash a 64 bit indipendenti (ordine delle colonne diverso) → id a 128 bit
+        return pd.DataFrame({
+            "k0": pd.util.hash_pandas_object(keyed, index=False).values,
+            "k1": pd.util.hash_pandas_object(keyed[["occ", "h", "user"]], index=False).values,
+        }, index=content.index)
+
+
+def _uuid_strings(keys: pd.DataFrame) -> pd.Series:
+    """Id deterministici (formato UUID) dai due hash a 64 bit."""
+    hexs = (pd.Series(np.char.mod("%016x", keys["k0"].to_numpy()), index=keys.index)
+            + pd.Series(np.char.mod("%016x", keys["k1"].to_numpy()), index=keys.index))
+    return (hexs.str[0:8] + "-" + hexs.str[8:12] + "-" + hexs.str[12:16] + "-"
+            + hexs.str[16:20] + "-" + hexs.str[20:32])
+
+
+def existing_keys(rows: Union[TradeTable, List[Dict]], kind: str, user_id: str) -> np.ndarray:
+    """Chiavi dei movimenti già presenti di `user_id`, calcolate come per il file importato."""
+    if kind == "trades":
+        frame = (rows if isinstance(rows, TradeTable) else TradeTable.from_records(rows)).frame
+    else:
+        frame = pd.DataFrame.from_records(list(rows), columns=["date", "amount"])
+        frame["date"] = pd.to_datetime(frame["date"], errors="coerce")
+        frame["amount"] = pd.to_numeric(frame["amount"], errors="coerce")
+    if frame.empty:
+        return np.empty(0, dtype="uint64")
+    frame = frame[frame["date"].notna()]
+    return _KeyCounter(user_id).keys(_content_frame(frame, kind))["k0"].to_numpy()
+
+
+def _in_sorted(values: np.ndarray, sorted_keys: np.ndarray) -> np.ndarray:
+    """Maschera di appartenenza di `values` a `sorted_keys` (ordinato e senza duplicati)."""
+    if not len(sorted_keys):
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_keys, values).clip(max=len(sorted_keys) - 1)
+    return sorted_keys[pos] == values
+
+
+# ——————————————————————————————————————————————
+# Import
+# ——————————————————————————————————————————————
+def import_statement(source: Union[str, IO], kind: str, write: Callable[[str, List[Dict]], None],
+                     user_id: str, fmt: str = "generic",
+                     existing: Optional[np.ndarray] = None,
+                     chunksize: int = 5000, batch_size: int = 500,
+                     on_rows: Optional[Callable[[List[Dict]], None]] = None,
+                     on_progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Importa un estratto conto a blocchi di `chunksize` righe, con memoria costante
+    rispetto alla dimensione del file. Per ogni blocco:
+     - mapping nello schema di `kind` ("trades" o "cashflows");
+     - validazione e deduplica vettoriali, contro `existing` (vedi `existing_keys`)
+       e contro le righe già importate;
+     - upsert a batch di `batch_size` tramite una WriteBehindQueue (retry inclusi);
+     - `on_rows` riceve le righe valide con date Python (per la sessione),
+       `on_progress` il riepilogo aggiornato.
+    Restituisce il riepilogo: righe lette, accodate, duplicate, scartate per
+    motivo; al termine, dallo stato della coda, le righe davvero scritte
+    (`imported`), quelle ancora in coda allo scadere dell'attesa (`pending`)
+    e quelle fallite dopo i retry (`failed`).
+    """
+    mapper, validator = ((map_trades, validate_trades) if kind == "trades"
+                         else (map_cashflows, validate_cashflows))
+    columns = TRADE_COLUMNS if kind == "trades" else CASHFLOW_COLUMNS
+    # chiavi esistenti ordinate una volta sola; quelle di questo import in un set,
+    # così il costo per blocco non cresce con le righe già importate
+    known = np.unique(existing) if existing is not None else np.empty(0, dtype="uint64")
+    imported_keys: set = set()
+    counter = _KeyCounter(user_id)
+    queue = WriteBehindQueue(write, max_batch=batch_size, max_delay=60.0)
+    summary: Dict = {"read": 0, "queued": 0, "imported": 0, "duplicates": 0, "invalid": {},
+                     "pending": 0, "failed": 0}
+
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str, skipinitialspace=True):
+        summary["read"] += len(chunk)
+        df = mapper(chunk, fmt)
+        reason = validator(df)
+        for label, n in reason[reason.ne("")].value_counts().items():
+            summary["invalid"][label] = summary["invalid"].get(label, 0) + int(n)
+        df = df[reason.eq("")]
+        if df.empty:
+            continue
+
+        keys = counter.keys(_content_frame(df, kind))
+        k0 = keys["k0"].to_numpy()
+        dup = _in_sorted(k0, known) | np.fromiter((k in imported_keys for k in k0.tolist()),
+                                                  dtype=bool, count=len(k0))
+        summary["duplicates"] += int(dup.sum())
+        df, keys = df[~dup], keys[~dup]
+        imported_keys.update(k0[~dup].tolist())
+        if df.empty:
+            continue
+
+        df = df.assign(id=_uuid_strings(keys))
+        payload = df.assign(**{c: df[c].dt.strftime("%Y-%m-%d") for c in ("date", "expiry") if c in df},
+                            user_id=user_id)
+        for record in payload[columns + ["user_id"]].to_dict("records"):
+            queue.enqueue(kind, record)
+        queue.flush()
+        summary["queued"] += len(df)
+
+        if on_rows:
+            session = df[columns].assign(**{c: df[c].dt.date for c in ("date", "expiry") if c in df})
+            on_rows(session.to_dict("records"))
+        if on_progress:
+            on_progress(summary)
+
+    queue.wait()
+    summary["pending"] = queue.pending_count
+    summary["failed"] = queue.failed_count
+    summary["imported"] = summary["queued"] - summary["pending"] - summary["failed"]
+    summary["last_error"] = queue.last_error
+    return summary
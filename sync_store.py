@@ -0,0 +1,116 @@
+# sync_store.py
+
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sync.sqlite")
+
+
+class SnapshotStore:
+    """
+    Copia locale (SQLite) delle righe Supabase di ogni utente, per tabella,
+    con il relativo high-water mark (il massimo `updated_at` già ricevuto).
+    Al login o al refresh si scaricano solo le righe con `updated_at` dal mark
+    in poi e si fondono qui per `id`; quelle con `deleted_at` valorizzato
+    vengono rimosse. Le righe sono salvate così come arrivano dal server (JSON).
+
+    Lato database servono le colonne di sincronizzazione, ad esempio:
+        alter table trades add column updated_at timestamptz not null default now();
+        alter table trades add column deleted_at timestamptz;
+        create trigger ... before update ... set new.updated_at = now();
+    (idem per cashflows). Le cancellazioni devono essere soft delete.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("SYNC_CACHE_PATH") or DEFAULT_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " user_id TEXT NOT NULL, tbl TEXT NOT NULL, id TEXT NOT NULL, payload TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, tbl, id))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS marks ("
+                " user_id TEXT NOT NULL, tbl TEXT NOT NULL, high_water TEXT,"
+                " PRIMARY KEY (user_id, tbl))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def high_water(self, user_id: str, tbl: str) -> Optional[str]:
+        """Mark della tabella, oppure None se non esiste ancora uno snapshot."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT high_water FROM marks WHERE user_id = ? AND tbl = ?", (user_id, tbl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def rows(self, user_id: str, tbl: str) -> List[Dict]:
+        with self._connect() as con:
+            payloads = con.execute(
+                "SELECT payload FROM rows WHERE user_id = ? AND tbl = ?", (user_id, tbl)
+            ).fetchall()
+        return [json.loads(p) for (p,) in payloads]
+
+    def pages(self, user_id: str, tbl: str, page_size: int = 1000) -> Iterator[List[Dict]]:
+        """Righe dello snapshot a pagine, ordinate per (date, id) come la paginazione remota."""
+        with self._connect() as con:
+            cursor = con.execute(
+                "SELECT payload FROM rows WHERE user_id = ? AND tbl = ?"
+                " ORDER BY json_extract(payload, '$.date'), id", (user_id, tbl)
+            )
+            while True:
+                chunk = cursor.fetchmany(page_size)
+                if not chunk:
+                    return
+                yield [json.loads(p) for (p,) in chunk]
+
+    def replace(self, user_id: str, tbl: str, rows: List[Dict], mark: Optional[str]) -> None:
+        """Sostituisce lo snapshot con un caricamento completo."""
+        with self._connect() as con:
+            con.execute("DELETE FROM rows WHERE user_id = ? AND tbl = ?", (user_id, tbl))
+            self._upsert(con, user_id, tbl, rows, mark)
+
+    def apply(self, user_id: str, tbl: str, changes: List[Dict],
+              mark: Optional[str], deleted_column: str = "deleted_at") -> None:
+        """Fonde nello snapshot le righe cambiate: upsert per `id`, rimozione delle cancellate."""
+        deleted = [(user_id, tbl, str(r["id"])) for r in changes if r.get(deleted_column)]
+        alive = [r for r in changes if not r.get(deleted_column)]
+        with self._connect() as con:
+            con.executemany("DELETE FROM rows WHERE user_id = ? AND tbl = ? AND id = ?", deleted)
+            self._upsert(con, user_id, tbl, alive, mark)
+
+    @staticmethod
+    def _upsert(con: sqlite3.Connection, user_id: str, tbl: str,
+                rows: List[Dict], mark: Optional[str]) -> None:
+        con.executemany(
+            "INSERT OR REPLACE INTO rows (user_id, tbl, id, payload) VALUES (?, ?, ?, ?)",
+            [(user_id, tbl, str(r["id"]), json.dumps(r, default=str)) for r in rows]
+        )
+        con.execute(
+            "INSERT OR REPLACE INTO marks (user_id, tbl, high_water) VALUES (?, ?, ?)",
+            (user_id, tbl, mark)
+        )
+
+    def clear_table(self, user_id: str, tbl: str) -> None:
+        with self._connect() as con:
+            con.execute("DELETE FROM rows WHERE user_id = ? AND tbl = ?", (user_id, tbl))
+            con.execute("DELETE FROM marks WHERE user_id = ? AND tbl = ?", (user_id, tbl))
+
+    def clear(self, user_id: str) -> None:
+        """Elimina lo snapshot dell'utente: il prossimo sync sarà completo."""
+        with self._connect() as con:
+            con.execute("DELETE FROM rows WHERE user_id = ?", (user_id,))
+            con.execute("DELETE FROM marks WHERE user_id = ?", (user_id,))
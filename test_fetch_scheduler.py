@@ -0,0 +1,80 @@
+# test_fetch_scheduler.py
+
+import asyncio
+import random
+from datetime import date
+
+import pandas as pd
+
+from fetch_scheduler import FetchScheduler
+from price_provider import NoDataError, RateLimitError
+
+START, END = date(2024, 1, 2), date(2024, 1, 5)
+DATES = [date(2024, 1, d) for d in range(2, 6)]
+
+
+class FakeProvider:
+    """
+    Provider finto: `script` dice cosa fare alla n-esima chiamata
+    ("429" = throttling, un set = simboli omessi dalla risposta).
+    Ogni simbolo ha una serie riconoscibile, così si verifica l'etichettatura.
+    """
+
+    def __init__(self, script=(), empty=()):
+        self.script = list(script)
+        self.empty = set(empty)
+        self.calls = []
+
+    def __call__(self, symbols, start, end):
+        self.calls.append(list(symbols))
+        step = self.script.pop(0) if self.script else None
+        if step == "429":
+            raise RateLimitError("Too Many Requests")
+        omitted = set(step or ()) | self.empty
+        return pd.DataFrame({s: [float(len(s))] * len(DATES) for s in symbols if s not in omitted},
+                            index=DATES)
+
+
+def _run(provider, symbols, **kwargs):
+    async def no_sleep(delay):
+        pass
+
+    scheduler = FetchScheduler(provider, rate=1000, burst=1000, rng=random.Random(0),
+                               sleep=no_sleep, **kwargs)
+    frame, failures = asyncio.run(scheduler.run(symbols, START, END))
+    return scheduler, frame, failures
+
+
+def test_throttled_chunks_are_retried_and_concurrency_backs_off():
+    provider = FakeProvider(script=["429", "429"])
+    scheduler, frame, failures = _run(provider, ["AAPL", "MSFT"], chunk_size=1,
+                                      initial_concurrency=4)
+    assert not failures
+    assert scheduler.throttled == 2
+    assert scheduler.concurrency < 4
+    assert list(frame.columns) == ["AAPL", "MSFT"]
+    assert (frame["AAPL"] == 4.0).all() and (frame["MSFT"] == 4.0).all()
+
+
+def test_persistent_throttling_ends_as_rate_limit_failure():
+    provider = FakeProvider(script=["429"] * 10)
+    _, frame, failures = _run(provider, ["SPY"], max_retries=2)
+    assert len(provider.calls) == 3
+    assert isinstance(failures["SPY"], RateLimitError)
+    assert frame.empty
+
+
+def test_missing_symbols_are_retried_alone():
+    provider = FakeProvider(script=[{"MSFT"}])
+    _, frame, failures = _run(provider, ["AAPL", "MSFT", "KO"])
+    assert not failures
+    assert provider.calls == [["AAPL", "MSFT", "KO"], ["MSFT"]]
+    assert sorted(frame.columns) == ["AAPL", "KO", "MSFT"]
+
+
+def test_always_empty_symbol_ends_as_no_data_after_retries():
+    provider = FakeProvider(empty={"DELISTED"})
+    _, frame, failures = _run(provider, ["AAPL", "DELISTED"], max_retries=3)
+    assert provider.calls[1:] == [["DELISTED"]] * 3
+    assert isinstance(failures["DELISTED"], NoDataError)
+    assert list(frame.columns) == ["AAPL"]
@@ -0,0 +1,132 @@
+# test_incremental_history.py
+
+import asyncio
+import copy
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import portfolio
+from portfolio import CONFIG, PortfolioProcessor
+
+TODAY = date.today()
+START = TODAY - timedelta(days=120)
+EXPIRY = START + timedelta(days=30)
+
+
+def _prices():
+    days = pd.bdate_range(START - timedelta(days=10), TODAY).date
+    rng = np.random.default_rng(3)
+    abc = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, len(days))))
+    # XYZ scende sotto lo strike della put prima della scadenza: assegnazione
+    xyz = np.where(days < EXPIRY - timedelta(days=5), 50.0, 45.0)
+    return pd.DataFrame({"ABC": abc, "XYZ": xyz}, index=days)
+
+
+PRICES = _prices()
+
+
+async def _fetch(symbols, start, end):
+    frame = PRICES[[s for s in symbols if s in PRICES]]
+    return frame[(frame.index >= start - timedelta(days=7)) & (frame.index <= end)]
+
+
+def _trade(id_, day, symbol, type_, quantity, **fields):
+    trade = {"id": id_, "date": START + timedelta(days=day), "symbol": symbol, "type": type_,
+             "quantity": quantity, "strike": 0.0, "expiry": None, "premium": 0.0,
+             "stock_price": 0.0, "commission": 1.0, "multiplier": 1}
+    trade.update(fields)
+    return trade
+
+
+def _option(id_, day, symbol, type_, quantity, strike, expiry, premium):
+    return _trade(id_, day, symbol, type_, quantity, strike=strike, expiry=expiry,
+                  premium=premium, multiplier=100)
+
+
+TRADES = [
+    _option("p1", 1, "XYZ", "put", -1, 48.0, EXPIRY, 120.0),
+    _trade("s1", 3, "ABC", "stock", 100, stock_price=100.0),
+    _option("c1", 10, "ABC", "call", -1, 130.0, START + timedelta(days=40), 90.0),
+    _trade("s2", 45, "ABC", "stock", -50, stock_price=104.0),
+    _option("p2", 60, "ABC", "put", -1, 95.0, START + timedelta(days=74), 150.0),
+]
+FLOWS = [{"id": "f1", "date": START, "amount": 20000.0},
+         {"id": "f2", "date": START + timedelta(days=50), "amount": 5000.0}]
+
+# trade di azioni inserito a mano per l'assegnazione di p1, dentro la finestra di abbinamento
+MANUAL_FILL = _trade("m1", 32, "XYZ", "stock", 100, stock_price=48.0, commission=0.0)
+assert MANUAL_FILL["date"] - EXPIRY <= timedelta(days=CONFIG["assignment_match_days"])
+
+
+def _edit(trades):
+    trades[1] = dict(trades[1], quantity=200)
+    return trades
+
+
+def _insert(trades):
+    return trades + [_option("p3", 20, "ABC", "put", -2, 90.0, START + timedelta(days=35), 80.0)]
+
+
+def _delete(trades):
+    return [t for t in trades if t["id"] != "c1"]
+
+
+def _backdate_fill(trades):
+    return trades + [MANUAL_FILL]
+
+
+def _move_fill(trades):
+    # il fill era già presente: spostato di un giorno, sempre nella finestra
+    return [dict(t, date=t["date"] - timedelta(days=1)) if t["id"] == "m1" else t
+            for t in trades]
+
+
+CHANGES = {
+    "edit": (TRADES, _edit),
+    "insert": (TRADES, _insert),
+    "delete": (TRADES, _delete),
+    "backdated_assignment_fill": (TRADES, _backdate_fill),
+    "remove_assignment_fill": (TRADES + [MANUAL_FILL], lambda ts: ts[:-1]),
+    "move_assignment_fill": (TRADES + [MANUAL_FILL], _move_fill),
+}
+
+
+def _state(processor):
+    return processor.history, processor.expired_log, processor.symbol_frame("pnl"), processor.derived_trades
+
+
+@pytest.mark.parametrize("change", CHANGES)
+def test_incremental_update_matches_full_rebuild(monkeypatch, change):
+    monkeypatch.setattr(portfolio, "fetch_all_historical_data", _fetch)
+    before, apply = CHANGES[change]
+    after = apply(copy.deepcopy(before))
+
+    incremental = PortfolioProcessor(copy.deepcopy(before), copy.deepcopy(FLOWS))
+    asyncio.run(incremental.build_full_history())
+    asyncio.run(incremental.update_history(copy.deepcopy(after), copy.deepcopy(FLOWS)))
+
+    full = PortfolioProcessor(copy.deepcopy(after), copy.deepcopy(FLOWS))
+    asyncio.run(full.build_full_history())
+
+    history, expired, pnl, derived = _state(incremental)
+    pd.testing.assert_frame_equal(history, full.history)
+    pd.testing.assert_frame_equal(expired.reset_index(drop=True), full.expired_log.reset_index(drop=True))
+    pd.testing.assert_frame_equal(pnl, full.symbol_frame("pnl"))
+    assert derived == full.derived_trades
+
+
+def test_backdated_fill_replaces_the_derived_assignment(monkeypatch):
+    monkeypatch.setattr(portfolio, "fetch_all_historical_data", _fetch)
+    processor = PortfolioProcessor(copy.deepcopy(TRADES), copy.deepcopy(FLOWS))
+    asyncio.run(processor.build_full_history())
+    assert [d["matched_trade"] for d in processor.derived_trades] == [None]
+
+    asyncio.run(processor.update_history(copy.deepcopy(TRADES + [MANUAL_FILL]), copy.deepcopy(FLOWS)))
+    (assignment,) = processor.derived_trades
+    assert assignment["matched_trade"] is not None
+    # le azioni assegnate contano una volta sola
+    positions, _ = PortfolioProcessor.get_current_positions(processor.position_table)
+    assert positions["XYZ"] == 100
@@ -0,0 +1,27 @@
+# test_portfolio_metrics.py
+
+from datetime import date, timedelta
+
+import pandas as pd
+
+import portfolio
+from portfolio import METRICS_CACHE, PortfolioProcessor
+
+
+def test_returned_metrics_do_not_share_nested_values_with_the_cache(monkeypatch):
+    monkeypatch.setattr(portfolio, "risk_free_version", lambda: None)
+    monkeypatch.setattr(PortfolioProcessor, "_compute_performance_metrics",
+                        lambda self, history: {"P&L per Symbol": {"SPY": 100.0}})
+    METRICS_CACHE.clear()
+    start = date(2024, 1, 2)
+    history = pd.DataFrame({"date": [start + timedelta(days=i) for i in range(3)],
+                            "portfolio_value": [1000.0, 1010.0, 1005.0]})
+    processor = PortfolioProcessor([], [])
+
+    first = processor.calculate_performance_metrics(history)
+    first["P&L per Symbol"]["SPY"] = -1.0
+    first["P&L per Symbol"]["QQQ"] = 5.0
+
+    second = processor.calculate_performance_metrics(history)
+    assert METRICS_CACHE.hits == 1
+    assert second["P&L per Symbol"] == {"SPY": 100.0}
@@ -0,0 +1,50 @@
+# test_price_store.py
+
+from datetime import date, timedelta
+
+import pandas as pd
+
+from price_provider import NoDataError
+from price_store import PriceStore
+
+TODAY = date.today()
+START = TODAY - timedelta(days=10)
+
+
+class FakeDownload:
+    """`download` finto per get_many: prezzi per `data`, errori per `errors`."""
+
+    def __init__(self, data=(), errors=None):
+        self.data = set(data)
+        self.errors = errors or {}
+        self.calls = []
+
+    def __call__(self, symbols, start, end, failures):
+        self.calls.append((list(symbols), start, end))
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        failures.update({s: self.errors[s] for s in symbols if s in self.errors})
+        return pd.DataFrame({s: 100.0 for s in symbols if s in self.data}, index=days)
+
+
+def test_empty_successful_download_is_covered_except_today(tmp_path):
+    store = PriceStore(str(tmp_path / "prices.sqlite"))
+    download = FakeDownload(errors={"NEW": NoDataError("NEW")})
+    frame = store.get_many(["NEW", "QUIET"], START, TODAY, download)
+    assert frame.isna().all().all()
+    for symbol in ("NEW", "QUIET"):
+        assert store.coverage(symbol) == [(START, TODAY - timedelta(days=1))]
+    # la richiesta successiva scarica solo oggi
+    store.get_many(["NEW", "QUIET"], START, TODAY, download)
+    assert download.calls[1] == (["NEW", "QUIET"], TODAY, TODAY)
+
+
+def test_failed_download_stays_uncovered_and_is_reported(tmp_path):
+    store = PriceStore(str(tmp_path / "prices.sqlite"))
+    error = ConnectionError("offline")
+    download = FakeDownload(data={"AAA"}, errors={"BAD": error})
+    failures = {}
+    frame = store.get_many(["AAA", "BAD"], START, TODAY, download, failures)
+    assert (frame["AAA"] == 100.0).all()
+    assert store.coverage("AAA") == [(START, TODAY - timedelta(days=1))]
+    assert store.coverage("BAD") == []
+    assert failures == {"BAD": error}
@@ -0,0 +1,52 @@
+# test_statement_import.py
+
+import io
+
+from statement_import import existing_keys, import_statement
+
+CSV = """date,symbol,type,quantity,strike,expiry,premium,stock_price,commission,multiplier
+2024-01-02,SPY,put,-1,470,2024-01-19,250,0,1.5,100
+2024-01-02,SPY,put,-1,470,2024-01-19,250,0,1.5,100
+"""
+
+
+def _import(user_id):
+    written = []
+    summary = import_statement(io.StringIO(CSV), "trades",
+                               lambda table, rows: written.extend(rows), user_id)
+    return summary, [r["id"] for r in written]
+
+
+def test_same_fills_for_two_users_get_different_ids():
+    summary_a, ids_a = _import("user-a")
+    summary_b, ids_b = _import("user-b")
+    assert summary_a["imported"] == summary_b["imported"] == 2
+    # fill identici nello stesso file restano distinti
+    assert len(set(ids_a)) == 2
+    assert not set(ids_a) & set(ids_b)
+
+
+def test_reimport_is_deterministic_per_user():
+    assert _import("user-a")[1] == _import("user-a")[1]
+
+
+def test_rows_not_written_are_not_reported_as_imported():
+    def failing(table, rows):
+        raise ConnectionError("offline")
+
+    summary = import_statement(io.StringIO(CSV), "trades", failing, "user-a")
+    assert summary["queued"] == 2
+    assert summary["imported"] == 0
+    assert summary["pending"] + summary["failed"] == 2
+
+
+def test_existing_rows_are_skipped_as_duplicates():
+    rows = [{"date": "2024-01-02", "symbol": "SPY", "type": "put", "quantity": -1, "strike": 470,
+             "expiry": "2024-01-19", "premium": 250, "stock_price": 0, "commission": 1.5,
+             "multiplier": 100}]
+    existing = existing_keys(rows, "trades", "user-a")
+    summary = import_statement(io.StringIO(CSV), "trades", lambda table, rows: None, "user-a",
+                               existing=existing, chunksize=1)
+    # il primo fill è già presente, il secondo (stesso contenuto) no
+    assert summary["duplicates"] == 1
+    assert summary["imported"] == 1
@@ -0,0 +1,156 @@
+# test_twr_drawdown.py
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from drawdown import compute_drawdown
+from twr import compute_twr
+
+
+# ——————————————————————————————————————————————
+# Calcoli di riferimento: i cicli originali di PortfolioProcessor
+# (calculate_twr, calculate_twr_daily_returns) e di calculate_drawdown_tracker
+# ——————————————————————————————————————————————
+def reference_twr(history, cash_flows):
+    if len(history) < 2:
+        return {"TWR": 0.0, "Annualized TWR": 0.0}
+    cash_flow_dates = {cf['date']: cf['amount'] for cf in cash_flows}
+    period_returns = []
+    previous_value = None
+    for idx, row in history.iterrows():
+        current_date = row['date']
+        current_value = row['portfolio_value']
+        if previous_value is None:
+            previous_value = current_value
+            continue
+        cash_flow = cash_flow_dates.get(current_date, 0)
+        if cash_flow != 0:
+            before = current_value - cash_flow
+            if previous_value > 0:
+                period_returns.append((before / previous_value) - 1)
+            previous_value = current_value
+        elif idx == len(history) - 1:
+            if previous_value > 0:
+                period_returns.append((current_value / previous_value) - 1)
+    twr = 1.0
+    for r in period_returns:
+        twr *= (1 + r)
+    twr -= 1
+    days = (history['date'].iloc[-1] - history['date'].iloc[0]).days
+    years = days / 365.25
+    ann = ((1 + twr) ** (1 / years) - 1) if years > 0 else twr
+    return {"TWR": twr, "Annualized TWR": ann}
+
+
+def reference_daily(history, cash_flows):
+    if len(history) < 2:
+        return []
+    cf_dates = {cf['date']: cf['amount'] for cf in cash_flows}
+    daily = []
+    for i in range(1, len(history)):
+        prev = history.iloc[i - 1]
+        curr = history.iloc[i]
+        cf = cf_dates.get(curr['date'], 0)
+        adj = curr['portfolio_value'] - cf if cf != 0 else curr['portfolio_value']
+        if prev['portfolio_value'] > 0:
+            daily.append((adj / prev['portfolio_value']) - 1)
+    return daily
+
+
+def reference_drawdown(equity_line, initial_capital):
+    running_max = equity_line.cummax()
+    drawdown = running_max - equity_line
+    drawdown_pct = ((drawdown / initial_capital) * 100 if initial_capital > 0
+                    else pd.Series([0] * len(drawdown)))
+    periods, current = [], 0
+    for is_dd in drawdown > 0:
+        if is_dd:
+            current += 1
+        elif current > 0:
+            periods.append(current)
+            current = 0
+    if current > 0:
+        periods.append(current)
+    return {
+        "drawdown": drawdown,
+        "max_drawdown": drawdown.max(),
+        "max_drawdown_pct": drawdown_pct.max(),
+        "current_drawdown": drawdown.iloc[-1],
+        "durations": periods,
+        "avg_duration": np.mean(periods) if periods else 0,
+        "max_duration": max(periods) if periods else 0,
+    }
+
+
+# ——————————————————————————————————————————————
+# Casi
+# ——————————————————————————————————————————————
+START = date(2024, 1, 1)
+
+
+def _history(values):
+    return pd.DataFrame({"date": [START + timedelta(days=i) for i in range(len(values))],
+                         "portfolio_value": np.asarray(values, dtype=float)})
+
+
+def _flows(spec):
+    return [{"date": START + timedelta(days=day), "amount": amount} for day, amount in spec]
+
+
+rng = np.random.default_rng(7)
+random_values = 10000 * np.cumprod(1 + rng.normal(0, 0.01, 250))
+random_flows = [(int(d), float(a)) for d, a in zip(rng.choice(np.arange(1, 250), 12, replace=False),
+                                                    rng.normal(0, 2000, 12).round(2))]
+
+TWR_CASES = {
+    "random": (random_values, random_flows),
+    "flow_on_first_day": ([10000, 10100, 10200, 15300, 15200], [(0, 10000), (3, 5000)]),
+    "zero_start": ([0, 0, 5000, 5100, 5050], [(2, 5000)]),
+    "zero_start_flow_on_first_day": ([0, 1000, 1010, 990], [(0, 1000), (1, 1000)]),
+    "all_flat": ([1000.0] * 30, []),
+    "all_flat_with_flows": ([1000, 1000, 1500, 1500, 1500], [(2, 500)]),
+    "flow_on_last_day": ([1000, 1020, 1040, 2040], [(3, 1000)]),
+    "same_day_flows_last_wins": ([1000, 1010, 3010, 3000], [(2, 1000), (2, 2000)]),
+    "value_through_zero": ([1000, 500, 0, 0, 800, 900], [(4, 800)]),
+    "single_day": ([1000], [(0, 1000)]),
+}
+
+
+@pytest.mark.parametrize("case", TWR_CASES)
+def test_twr_matches_reference_loop(case):
+    values, spec = TWR_CASES[case]
+    history, cash_flows = _history(values), _flows(spec)
+    expected = reference_twr(history, cash_flows)
+    out = compute_twr(history, cash_flows)
+    assert out["TWR"] == pytest.approx(expected["TWR"], rel=1e-12, abs=1e-12)
+    assert out["Annualized TWR"] == pytest.approx(expected["Annualized TWR"], rel=1e-12, abs=1e-12)
+    np.testing.assert_allclose(out["daily"], reference_daily(history, cash_flows), rtol=1e-12)
+
+
+DRAWDOWN_CASES = {
+    "random": np.cumsum(rng.normal(0, 50, 300)),
+    "all_flat": np.zeros(20),
+    "monotonic_rise": np.arange(10, dtype=float),
+    "open_at_end": np.array([0, 100, 50, 20, 30]),
+    "recover_exactly_to_peak": np.array([0, 100, 40, 100, 90, 120, 60, 130]),
+    "starts_in_loss": np.array([-50, -80, -20, 10, 5]),
+    "single_point": np.array([42.0]),
+}
+
+
+@pytest.mark.parametrize("case", DRAWDOWN_CASES)
+@pytest.mark.parametrize("base", [0.0, 10000.0])
+def test_drawdown_matches_reference_loop(case, base):
+    equity = pd.Series(DRAWDOWN_CASES[case], dtype=float)
+    expected = reference_drawdown(equity, base)
+    out = compute_drawdown(equity, base=base)
+    np.testing.assert_allclose(out["drawdown"].to_numpy(), expected["drawdown"].to_numpy())
+    assert out["max_drawdown"] == pytest.approx(expected["max_drawdown"])
+    assert out["max_drawdown_pct"] == pytest.approx(expected["max_drawdown_pct"])
+    assert out["current_drawdown"] == pytest.approx(expected["current_drawdown"])
+    assert out["durations"].tolist() == expected["durations"]
+    assert out["max_duration"] == expected["max_duration"]
+    assert out["avg_duration"] == pytest.approx(expected["avg_duration"])
@@ -0,0 +1,126 @@
+# trade_store.py
+
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+TRADE_TYPES = ['stock', 'put', 'call']
+NUMERIC_COLUMNS = ['quantity', 'strike', 'premium', 'stock_price', 'commission', 'multiplier']
+DATE_COLUMNS = ['date', 'expiry']
+DEFAULTS = {'commission': 0.0, 'multiplier': 100.0, 'premium': 0.0, 'stock_price': 0.0, 'strike': 0.0}
+
+
+class TradeTable:
+    """
+    Tabella dei trade colonnare e tipizzata, costruita una volta al caricamento:
+     - symbol e type come categorie;
+     - date ed expiry come datetime64;
+     - campi numerici come float64.
+    I filtri per simbolo, tipo e intervallo di date sono maschere vettoriali;
+    `records()` restituisce la lista di dict per il codice che la usa ancora.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+
+    @classmethod
+    def from_records(cls, rows: Iterable[Dict]) -> "TradeTable":
+        return cls._typed(pd.DataFrame.from_records(list(rows)))
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[List[Dict]]) -> "TradeTable":
+        """
+        Costruisce la tabella da pagine di righe (es. la paginazione Supabase):
+        ogni pagina diventa subito un frame, la tipizzazione avviene una volta sola.
+        """
+        frames = [pd.DataFrame.from_records(page) for page in pages if page]
+        if not frames:
+            return cls.from_records([])
+        return cls._typed(pd.concat(frames, ignore_index=True))
+
+    @classmethod
+    def _typed(cls, df: pd.DataFrame) -> "TradeTable":
+        if df.empty:
+            df = pd.DataFrame(columns=['symbol', 'type'] + DATE_COLUMNS + NUMERIC_COLUMNS)
+        for col in DATE_COLUMNS:
+            if col not in df:
+                df[col] = pd.NaT
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        for col in NUMERIC_COLUMNS:
+            if col not in df:
+                df[col] = DEFAULTS.get(col, 0.0)
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(DEFAULTS.get(col, 0.0)).astype('float64')
+        df['symbol'] = df['symbol'].astype('category')
+        df['type'] = pd.Categorical(df['type'], categories=TRADE_TYPES)
+        return cls(df.sort_values('date', kind='stable').reset_index(drop=True))
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @property
+    def empty(self) -> bool:
+        return self.frame.empty
+
+    @property
+    def symbols(self) -> List[str]:
+        return sorted(self.frame['symbol'].dropna().unique().tolist())
+
+    def filter(self, symbol: Optional[str] = None,
+               types: Optional[Union[str, List[str]]] = None,
+               start: Optional[date] = None, end: Optional[date] = None) -> "TradeTable":
+        """Sottoinsieme per simbolo, tipo (uno o più) e intervallo di date (estremi inclusi)."""
+        df = self.frame
+        mask = np.ones(len(df), dtype=bool)
+        if symbol is not None:
+            mask &= (df['symbol'] == symbol).to_numpy()
+        if types is not None:
+            types = [types] if isinstance(types, str) else types
+            mask &= df['type'].isin(types).to_numpy()
+        if start is not None:
+            mask &= (df['date'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (df['date'] <= pd.Timestamp(end)).to_numpy()
+        return TradeTable(df[mask])
+
+    def net_cash_flow(self) -> pd.Series:
+        """
+        Flusso di cassa netto per trade: azioni -qty*prezzo, opzioni +premio
+        se short e -premio se long, sempre al netto delle commissioni.
+        """
+        df = self.frame
+        sign = np.where(df['quantity'] < 0, 1.0, -1.0)
+        cf = np.where(df['type'] == 'stock',
+                      -df['quantity'] * df['stock_price'],
+                      sign * df['premium'])
+        return pd.Series(cf - df['commission'], index=df.index)
+
+    def current_positions(self, today: Optional[date] = None) -> Tuple[Dict[str, float], List[Dict]]:
+        """
+        Posizioni aperte: (quantità netta di azioni per simbolo, opzioni con
+        scadenza da oggi in poi come lista di dict).
+        """
+        today = today or date.today()
+        stocks = self.filter(types='stock').frame
+        stock_positions = stocks.groupby('symbol', observed=True)['quantity'].sum().to_dict()
+        options = self.filter(types=['put', 'call']).frame
+        open_options = TradeTable(options[options['expiry'] >= pd.Timestamp(today)]).records()
+        return stock_positions, open_options
+
+    def records(self) -> List[Dict]:
+        """Righe come lista di dict con date Python, nel formato delle righe di Supabase."""
+        df = self.frame.astype({'symbol': object, 'type': object})
+        out = df.to_dict('records')
+        for row in out:
+            for col in DATE_COLUMNS:
+                value = row.get(col)
+                row[col] = value.date() if isinstance(value, pd.Timestamp) else None
+        return out
+
+    def display_frame(self) -> pd.DataFrame:
+        """Copia per le tabelle della UI con le date in formato ISO."""
+        df = self.frame.copy()
+        for col in DATE_COLUMNS:
+            df[col] = df[col].dt.strftime('%Y-%m-%d')
+        return df
@@ -0,0 +1,86 @@
+# twr.py
+
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+def align_cash_flows(dates: pd.Series, cash_flows: List[Dict]) -> np.ndarray:
+    """
+    Flusso di cassa per ogni data dello storico. Come nel calcolo originale
+    (`{cf['date']: cf['amount']}`), con più flussi nella stessa data vale l'ultimo.
+    """
+    last_wins = {cf['date']: cf['amount'] for cf in cash_flows}
+    if not last_wins:
+        return np.zeros(len(dates))
+    return (pd.Series(last_wins, dtype=float)
+              .reindex(pd.Index(dates))
+              .fillna(0.0)
+              .to_numpy())
+
+
+def twr_kernel(values: np.ndarray, flows: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Rendimenti time-weighted in un solo passaggio vettoriale su array allineati
+    (valore del portafoglio e flusso di cassa per giorno):
+     - daily: (v[i] - cf[i]) / v[i-1] - 1 per i giorni con v[i-1] > 0;
+     - daily_mask: quali giorni (da 1 a n-1) hanno un rendimento giornaliero;
+     - sub_periods: un rendimento per ogni giorno con flusso, rispetto al valore
+       dopo il flusso precedente (o al primo valore), più il periodo finale
+       se l'ultimo giorno non ha flussi; periodi con base <= 0 esclusi.
+    """
+    n = len(values)
+    if n < 2:
+        return {"daily": np.empty(0), "daily_mask": np.zeros(0, dtype=bool),
+                "sub_periods": np.empty(0)}
+
+    prev, curr, cf = values[:-1], values[1:], flows[1:]
+    daily_mask = prev > 0
+    daily = (curr[daily_mask] - cf[daily_mask]) / prev[daily_mask] - 1
+
+    # base di ogni sotto-periodo: ultimo giorno con flusso prima di i (o il giorno 0)
+    idx = np.arange(n)
+    has_flow = flows != 0
+    has_flow[0] = False
+    anchor = np.maximum.accumulate(np.where(has_flow, idx, 0))
+    base_idx = np.concatenate(([0], anchor[:-1]))
+
+    ends = idx[has_flow]
+    before = values[ends] - flows[ends]
+    if not has_flow[-1]:
+        ends = np.append(ends, n - 1)
+        before = np.append(before, values[-1])
+    base = values[base_idx[ends]]
+    valid = base > 0
+    sub_periods = before[valid] / base[valid] - 1
+
+    return {"daily": daily, "daily_mask": daily_mask, "sub_periods": sub_periods}
+
+
+def compute_twr(history: pd.DataFrame, cash_flows: List[Dict]) -> Dict[str, Any]:
+    """
+    TWR completo dallo storico del portafoglio: rendimenti giornalieri (con le
+    date corrispondenti e il cumulato), sotto-periodi, TWR totale e annualizzato.
+    """
+    if len(history) < 2:
+        return {"daily": np.empty(0), "daily_dates": [], "cumulative": np.empty(0),
+                "sub_periods": np.empty(0), "TWR": 0.0, "Annualized TWR": 0.0}
+
+    values = history['portfolio_value'].to_numpy(dtype=float)
+    flows = align_cash_flows(history['date'], cash_flows)
+    out = twr_kernel(values, flows)
+
+    twr = float(np.prod(1 + out["sub_periods"])) - 1
+    days = (history['date'].iloc[-1] - history['date'].iloc[0]).days
+    years = days / 365.25
+    ann = ((1 + twr) ** (1 / years) - 1) if years > 0 else twr
+
+    return {
+        "daily": out["daily"],
+        "daily_dates": history['date'].iloc[1:][out["daily_mask"]].tolist(),
+        "cumulative": np.cumprod(1 + out["daily"]) - 1,
+        "sub_periods": out["sub_periods"],
+        "TWR": twr,
+        "Annualized TWR": ann,
+    }
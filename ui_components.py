@@ -3,13 +3,16 @@
 import streamlit as st
 import asyncio
 import pandas as pd
-import plotly.graph_objects as go
 
-from data_store import upsert_trade, upsert_cashflow
+from data_store import upsert_trade, upsert_cashflow, sync_user_data
+from data_store import get_write_queue, flush_writes, upsert_rows, get_user_id
+from statement_import import import_statement, existing_keys
 from data_store import find_user_by_email, create_user
 from portfolio import PortfolioProcessor
 from datetime import date
 from data_fetcher import fetch_price_series
+from trade_store import TradeTable
+from twr import compute_twr
 
 def classify_pos(x):
     try:
@@ -17,6 +20,18 @@ def classify_pos(x):
     except Exception:
         return None
 
+def get_trade_table() -> TradeTable:
+    """
+    Tabella colonnare dei trade in sessione: costruita al caricamento e
+    ricostruita solo quando la lista `trades` cambia lunghezza.
+    """
+    table = st.session_state.get("trade_table")
+    if table is None or len(table) != len(st.session_state.trades):
+        table = TradeTable.from_records(st.session_state.trades)
+        st.session_state.trade_table = table
+    return table
+
+
 def login_view():
     st.title("👋 Benvenuto")
     st.write("Per favore inserisci la tua email per continuare.")
@@ -55,7 +70,7 @@ def ui_sidebar():
     with st.sidebar:
         st.header("⚙️ Inserimento Dati")
 
-        tab1, tab2, tab3 = st.tabs(["📈 Azioni", "📊 Opzioni", "💰 Flussi"])
+        tab1, tab2, tab3, tab4 = st.tabs(["📈 Azioni", "📊 Opzioni", "💰 Flussi", "📥 Import"])
 
         # ——————————————————————————————
         # TAB 1: Trade Azioni
@@ -151,9 +166,10 @@ def ui_sidebar():
                     premium_pp = st.number_input("Premio Originale", min_value=0.01, step=0.01, format="%.2f", key="exp_prem")
                     multiplier = st.number_input("Moltiplicatore", min_value=1, value=100, key="exp_mult")
                     commission = st.number_input("Commissioni ($)", value=1.50, min_value=0.0, step=0.5, key="exp_comm")
-                    was_assigned = st.checkbox("Assegnata?", key="exp_assigned")
-                    if was_assigned:
-                        st.warning("Ricorda: aggiungi il trade di azioni risultante dall'assegnazione.")
+                    was_assigned = st.checkbox("Assegnata / Esercitata?", key="exp_assigned")
+                    st.caption("Se spuntata, alla scadenza le azioni vengono consegnate allo strike "
+                               "automaticamente; altrimenti l'opzione scade senza consegna, "
+                               "qualunque sia il prezzo.")
                     total_prem = premium_pp * contracts * multiplier
                     st.info(f"Premio Totale: ${total_prem:,.2f}")
 
@@ -177,10 +193,7 @@ def ui_sidebar():
                         }
                         upsert_trade(trade)
                         st.session_state.trades.append(trade)
-                        msg = "✅ Opzione Scaduta salvata!"
-                        if was_assigned:
-                            msg += " ⚠️ Aggiungi il trade di azioni!"
-                        st.success(msg)
+                        st.success("✅ Opzione Scaduta salvata!")
 
         # ——————————————————————————————
         # TAB 3: Flussi di Cassa
@@ -201,46 +214,139 @@ def ui_sidebar():
                     st.session_state.cash_flows.append(flow)
                     st.success("✅ Flusso di cassa salvato!")
 
+        # ——————————————————————————————
+        # TAB 4: Import estratto conto
+        # ——————————————————————————————
+        with tab4:
+            st.subheader("Import Estratto Conto")
+            kind_label = st.radio("Contenuto", ["Trade", "Flussi di cassa"], horizontal=True, key="imp_kind")
+            fmt_label = st.selectbox("Formato", ["CSV generico (colonne schema)", "IBKR Flex Query"], key="imp_fmt")
+            upload = st.file_uploader("File CSV", type=["csv"], key="imp_file")
+            if upload is not None and st.button("📥 Importa", key="imp_go"):
+                kind = "trades" if kind_label == "Trade" else "cashflows"
+                target = st.session_state.trades if kind == "trades" else st.session_state.cash_flows
+                existing = existing_keys(get_trade_table() if kind == "trades" else target, kind,
+                                         get_user_id())
+                bar = st.progress(0.0)
+                size = upload.size or 1
+
+                def progress(summary):
+                    bar.progress(min(1.0, upload.tell() / size),
+                                 text=f"{summary['queued']} in coda · {summary['duplicates']} duplicati")
+
+                summary = import_statement(
+                    upload, kind, upsert_rows, get_user_id(),
+                    fmt="ibkr" if fmt_label.startswith("IBKR") else "generic",
+                    existing=existing, on_rows=target.extend, on_progress=progress
+                )
+                bar.progress(1.0)
+                st.success(f"✅ {summary['imported']} righe importate su {summary['read']} "
+                           f"({summary['duplicates']} duplicati ignorati)")
+                if summary["invalid"]:
+                    st.warning("Righe scartate: " + ", ".join(f"{k} ({v})" for k, v in summary["invalid"].items()))
+                if summary["pending"] or summary["failed"]:
+                    st.error(f"❌ {summary['pending'] + summary['failed']} righe non salvate su Supabase "
+                             f"({summary['pending']} ancora in coda, {summary['failed']} fallite): "
+                             f"{summary['last_error']}")
+
+        # ——————————————————————————————
+        # Stato delle scritture verso Supabase
+        # ——————————————————————————————
+        queue = get_write_queue()
+        st.caption(f"⏳ In attesa di invio: {queue.pending_count} · ❌ Falliti: {queue.failed_count}")
+        if queue.pending_count and st.button("📤 Invia ora"):
+            flush_writes()
+        if queue.failed_count:
+            st.error(f"❌ Invio a Supabase fallito: {queue.last_error}")
+            if st.button("🔁 Riprova invio"):
+                queue.retry_failed()
+
         st.markdown("---")
         if st.button("🔄 Resetta Sessione", type="secondary"):
-            st.session_state.clear()
-            st.experimental_rerun()
+            st.session_state.pending_exit = "reset"
         if st.button("Logout"):
-            del st.session_state["user_id"]
-            st.experimental_rerun()
+            st.session_state.pending_exit = "logout"
+        exit_action = st.session_state.get("pending_exit")
+        if exit_action:
+            # le scritture in coda vanno inviate prima di perdere la sessione:
+            # un solo invio per rerun, l'attesa con retry solo su "Salva ed esci"
+            queue.flush()
+            if not queue.pending_count and not queue.failed_count:
+                _end_session(exit_action)
+            if st.button("💾 Salva ed esci", key="exit_save"):
+                queue.retry_failed()
+                queue.wait()
+                if not queue.pending_count and not queue.failed_count:
+                    _end_session(exit_action)
+            st.warning(f"⚠️ {queue.pending_count} record in attesa e {queue.failed_count} falliti "
+                       "non sono ancora salvati su Supabase: uscendo andrebbero persi.")
+            if queue.last_error:
+                st.caption(f"Ultimo errore: {queue.last_error}")
+            retry_col, cancel_col = st.columns(2)
+            if retry_col.button("🔁 Riprova invio", key="exit_retry"):
+                queue.retry_failed()
+                st.experimental_rerun()
+            if cancel_col.button("Annulla", key="exit_cancel"):
+                del st.session_state["pending_exit"]
+                st.experimental_rerun()
+            if st.button("Esci senza salvare", key="exit_discard"):
+                _end_session(exit_action)
+
+
+def _end_session(action: str) -> None:
+    """Reset completo della sessione o logout, poi rerun."""
+    if action == "reset":
+        st.session_state.clear()
+    else:
+        st.session_state.pop("pending_exit", None)
+        del st.session_state["user_id"]
+    st.experimental_rerun()
 
 
 def main_view():
     """Disegna la vista principale con grafici, KPI e tabelle."""
+    import plotly.graph_objects as go  # import pesante: solo nelle viste con grafici
+
     st.title("📖 Position Keeper")
 
     # Pulsanti per refresh e ricalcolo
     col1, col2, _ = st.columns([1, 1, 4])
     with col1:
         if st.button("🔄 Refresh Dati", type="secondary"):
+            # il sync sostituisce i dati in sessione: prima vanno inviate le scritture in coda
+            if flush_writes():
+                st.session_state.trades, st.session_state.cash_flows = sync_user_data()
+                st.session_state.pop("trade_table", None)
+            else:
+                st.warning("Scritture non ancora inviate a Supabase: refresh dal server rimandato.")
             st.session_state.last_trade_count = -1
             #st.experimental_rerun()
     with col2:
         if st.button("📊 Ricalcola Tutto", type="primary"):
             st.session_state.portfolio_history = pd.DataFrame()
             st.session_state.expired_options_log = pd.DataFrame()
+            st.session_state.pop("processor", None)
             st.session_state.last_trade_count = -1
             #st.experimental_rerun()
 
-    processor = PortfolioProcessor(
-        st.session_state.trades,
-        st.session_state.cash_flows
-    )
-    
+    # Il processore resta in sessione: conserva prezzi e checkpoint del replay,
+    # così un nuovo trade ricalcola solo il suffisso dello storico
+    if "processor" not in st.session_state:
+        st.session_state.processor = PortfolioProcessor(
+            st.session_state.trades,
+            st.session_state.cash_flows,
+            trade_table=get_trade_table()
+        )
+    processor = st.session_state.processor
+
     # Controllo se serve ricalcolare lo storico
     trade_count = len(st.session_state.trades) + len(st.session_state.cash_flows)
     if trade_count != st.session_state.last_trade_count:
         with st.spinner("Elaborazione… il primo calcolo può richiedere tempo"):
-            processor = PortfolioProcessor(
+            history, expired_log = asyncio.run(processor.update_history(
                 st.session_state.trades,
                 st.session_state.cash_flows
-            )
-            history, expired_log = asyncio.run(processor.build_full_history())
+            ))
             st.session_state.portfolio_history = history
             st.session_state.expired_options_log = expired_log
             st.session_state.last_trade_count = trade_count
@@ -307,13 +413,13 @@ def main_view():
             ].copy()
             
             if not history_subset.empty:
-                # Usa     lo stesso metodo TWR della dashboard principale
-                portfolio_twr_data = processor.calculate_twr_daily_returns(history_subset, st.session_state.cash_flows)
+                # Stesso motore TWR della dashboard principale: rendimenti giornalieri e cumulato
+                twr_subset = compute_twr(history_subset, st.session_state.cash_flows)
                 
-                # Calcola TWR cumulativo dalle daily returns
-                if portfolio_twr_data:
-                    portfolio_twr_cumulative = pd.Series(portfolio_twr_data).add(1).cumprod().sub(1).mul(100)
-                    portfolio_twr_cumulative.index = history_subset['date'].iloc[1:len(portfolio_twr_cumulative)+1]
+                if len(twr_subset["daily"]):
+                    portfolio_twr_cumulative = pd.Series(
+                        twr_subset["cumulative"] * 100, index=twr_subset["daily_dates"]
+                    )
                 else:
                     portfolio_twr_cumulative = pd.Series([0], index=[history_subset['date'].iloc[0]])
                 
@@ -465,10 +571,11 @@ def main_view():
     # — POSIZIONI CORRENTI —
     with st.expander("Dettaglio Posizioni Aperte", expanded=False):
         st.subheader("Posizioni Attuali")
-        from data_store import fetch_trades  # per ricaricare fresh se vuoi
+        # include le azioni derivate da assegnazioni ed esercizi del replay
+        stock_positions, opts = PortfolioProcessor.get_current_positions(processor.position_table)
         # Azioni
         pos_df = pd.DataFrame.from_dict(
-            PortfolioProcessor.get_current_positions(st.session_state.trades)[0],
+            stock_positions,
             orient='index'
         ).reset_index()
         pos_df.columns = ['Simbolo', 'Quantità']
@@ -479,7 +586,6 @@ def main_view():
             st.info("Nessuna azione in portafoglio.")
 
         # Opzioni
-        opts = PortfolioProcessor.get_current_positions(st.session_state.trades)[1]
         st.write("**Opzioni Aperte:**")
         if opts:
             opts_df = pd.DataFrame(opts)
@@ -526,10 +632,7 @@ def main_view():
     with st.expander("Storico Completo", expanded=False):
         st.subheader("Tutti i Trade")
         if st.session_state.trades:
-            tdf = pd.DataFrame(st.session_state.trades)
-            tdf['date'] = pd.to_datetime(tdf['date']).dt.strftime('%Y-%m-%d')
-            tdf['expiry'] = pd.to_datetime(tdf['expiry']).dt.strftime('%Y-%m-%d')
-            st.dataframe(tdf, use_container_width=True)
+            st.dataframe(get_trade_table().display_frame(), use_container_width=True)
         else:
             st.info("Nessun trade.")
 
@@ -554,14 +657,29 @@ def wheel_metrics_view():
 
     # Import qui per evitare errori circolari
     from wheel_metrics import WheelMetricsCalculator
+    import plotly.graph_objects as go
     
-    # Inizializza calcolatore
-    calculator = WheelMetricsCalculator(
-        trades=st.session_state.trades,
-        cash_flows=st.session_state.cash_flows,
-        portfolio_history=st.session_state.portfolio_history,
-        expired_options=st.session_state.get('expired_options_log', pd.DataFrame())
-    )
+    # Calcolatore riusato fra i rerun finché storico e trade sono gli stessi:
+    # così le metriche per simbolo già calcolate restano nella sua memo
+    calculator = st.session_state.get('wheel_calculator')
+    if (calculator is None
+            or calculator.all_portfolio_history is not st.session_state.portfolio_history
+            or calculator.trade_table is not get_trade_table()):
+        # P&L per simbolo e prezzi dal replay del processore, se è quello dello storico in sessione
+        processor = st.session_state.get("processor")
+        replayed = processor is not None and processor.history is st.session_state.portfolio_history
+        calculator = WheelMetricsCalculator(
+            trades=st.session_state.trades,
+            cash_flows=st.session_state.cash_flows,
+            portfolio_history=st.session_state.portfolio_history,
+            expired_options=st.session_state.get('expired_options_log', pd.DataFrame()),
+            trade_table=get_trade_table(),
+            symbol_pnl=processor.symbol_frame('pnl') if replayed else None,
+            prices=processor.price_matrix if replayed else None,
+            derived_trades=[d for d in processor.derived_trades
+                            if d['matched_trade'] is None] if replayed else None
+        )
+        st.session_state.wheel_calculator = calculator
 
     # Selettore per la vista: Aggregata vs Per Simbolo
     view_mode = st.selectbox(
@@ -580,7 +698,9 @@ def wheel_metrics_view():
         # Calcola le metriche aggregate (potresti voler creare un metodo apposito in WheelMetricsCalculator)
         # Per ora, usiamo i calcoli originali che erano aggregati di default
         from portfolio import PortfolioProcessor # ri-usiamo un processore per le metriche aggregate
-        processor = PortfolioProcessor(st.session_state.trades, st.session_state.cash_flows)
+        processor = st.session_state.get("processor") or PortfolioProcessor(
+            st.session_state.trades, st.session_state.cash_flows, trade_table=get_trade_table()
+        )
         agg_metrics = processor.calculate_performance_metrics(st.session_state.portfolio_history)
 
         cols = st.columns(4)
@@ -589,6 +709,16 @@ def wheel_metrics_view():
         cols[2].metric("Sharpe (TWR)", f"{agg_metrics.get('TWR Sharpe Ratio',0):.2f}")
         cols[3].metric("Max Drawdown", f"${agg_metrics['Max Drawdown $']:.2f}")
 
+        # Monte Carlo sul drawdown corrente (simulato una volta, resta nel calcolatore)
+        recovery = calculator.calculate_recovery_probability()
+        st.subheader("🩹 Probabilità di Recupero")
+        probs = recovery.get('components', {}).get('probabilities', {})
+        if probs:
+            rec_cols = st.columns(len(probs))
+            for col, (days, prob) in zip(rec_cols, probs.items()):
+                col.metric(f"Entro {days} gg", f"{prob:.1f}%")
+        st.caption(recovery.get('explanation', ''))
+
         st.info("Questa è una vista aggregata. Seleziona un simbolo dal menu per l'analisi dettagliata.")
 
     else:
@@ -597,8 +727,7 @@ def wheel_metrics_view():
         st.header(f"🔍 Analisi Dettagliata per: ${selected_symbol}")
 
         with st.spinner(f"Calcolo metriche per {selected_symbol}..."):
-            all_metrics_by_symbol = calculator.calculate_all_metrics_by_symbol()
-            metrics = all_metrics_by_symbol.get(selected_symbol, {})
+            metrics = calculator.metrics_for_symbol(selected_symbol)
 
         if not metrics:
             st.error(f"Impossibile calcolare le metriche per {selected_symbol}.")
@@ -671,3 +800,40 @@ def wheel_metrics_view():
                     st.write(f"**Frequenza Trading:** {comp.get('trading_frequency', 0):.2f} trades/mese")
                     st.write(f"**Score Volatilità:** {comp.get('volatility_score', 0):.1f}%")
                     st.write(f"**Tasso Assegnazione:** {comp.get('assignment_rate', 0):.1f}%")
+
+        # --- CICLI WHEEL ---
+        cycles = metrics.get('cycles', pd.DataFrame())
+        if not cycles.empty:
+            st.markdown("---")
+            st.subheader("🔄 Cicli Wheel")
+            closed = cycles[cycles['status'] == 'closed']
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Cicli chiusi", len(closed), f"{len(cycles) - len(closed)} aperti")
+            if not closed.empty:
+                c2.metric("Durata media", f"{closed['days'].mean():.0f} giorni")
+                c3.metric("Rendimento medio annualizzato", f"{closed['annualized_pct'].mean():.2f}%")
+            st.dataframe(cycles[['cycle', 'start', 'end', 'status', 'outcome', 'days', 'premium',
+                                 'stock_pnl', 'pnl', 'capital', 'return_pct', 'annualized_pct']],
+                         use_container_width=True)
+
+        # --- P&L E ROI DEL SIMBOLO ---
+        if calculator.symbol_pnl is not None and selected_symbol in calculator.symbol_pnl.columns:
+            st.markdown("---")
+            st.subheader("💹 P&L del Simbolo vs Buy & Hold")
+            roi_data = metrics['roi']
+            comp = roi_data.get('components', {})
+            c1, c2, c3 = st.columns(3)
+            c1.metric("P&L Wheel", f"${comp.get('wheel_pnl', 0):,.2f}")
+            if comp.get('wheel_return') is not None:
+                c2.metric("Rendimento Wheel", f"{comp['wheel_return']:.2f}%")
+            if comp.get('buy_hold_return') is not None:
+                c3.metric("Buy & Hold", f"{comp['buy_hold_return']:.2f}%", f"{roi_data['ROI']:+.2f} pt wheel")
+            st.caption(roi_data.get('explanation', ''))
+
+            pnl_series = calculator.symbol_pnl[selected_symbol]
+            fig_pnl = go.Figure()
+            fig_pnl.add_trace(go.Scatter(x=pnl_series.index, y=pnl_series.values,
+                                         name=f"P&L {selected_symbol}", line=dict(color='green')))
+            fig_pnl.update_layout(template='plotly_white', title=f"P&L Cumulato {selected_symbol}",
+                                  yaxis_title="P&L $", height=350)
+            st.plotly_chart(fig_pnl, use_container_width=True)
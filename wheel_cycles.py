@@ -0,0 +1,269 @@
+# wheel_cycles.py
+
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from trade_store import TradeTable
+
+CYCLE_COLUMNS = [
+    'symbol', 'cycle', 'start', 'end', 'last_trade', 'status', 'outcome',
+    'trades', 'puts_sold', 'calls_sold', 'put_notional', 'dte_sum', 'premium_sold',
+    'expired', 'assigned', 'premium', 'commissions', 'stock_pnl', 'pnl',
+    'capital', 'days', 'return_pct', 'annualized_pct',
+]
+# ordine degli eventi nello stesso giorno: opzioni aperte, scadenze, poi azioni
+# (un'assegnazione registrata a mano come trade di azioni segue la sua scadenza)
+_OPTION, _EXPIRY, _STOCK = 0, 1, 2
+
+
+def _events(table: TradeTable, expired_log: pd.DataFrame,
+            derived: Optional[List[Dict]] = None) -> pd.DataFrame:
+    """
+    Trade, scadenze ed eventuali azioni derivate dal replay (assegnazioni ed
+    esercizi, marcate `user` = False) in un unico frame ordinato per
+    (simbolo, data, tipo di evento).
+    """
+    df = table.frame
+    trades = pd.DataFrame({
+        'symbol': df['symbol'].astype(object),
+        'date': df['date'],
+        'order': np.where(df['type'] == 'stock', _STOCK, _OPTION),
+        'type': df['type'].astype(object),
+        'quantity': df['quantity'],
+        'strike': df['strike'],
+        'premium': df['premium'],
+        'price': df['stock_price'],
+        'commission': df['commission'],
+        'multiplier': df['multiplier'],
+        'expiry': df['expiry'],
+        'was_assigned': False,
+        'user': True,
+    })
+    frames = [trades]
+    if not expired_log.empty:
+        log = expired_log
+        frames.append(pd.DataFrame({
+            'symbol': log['symbol'].astype(object),
+            'date': pd.to_datetime(log['expiry_date']),
+            'order': _EXPIRY,
+            'type': log['type'].astype(object),
+            'quantity': log['quantity'].astype(float),
+            'strike': log['strike'].astype(float),
+            'premium': 0.0,
+            'price': log['price_on_expiry'].astype(float),
+            'commission': 0.0,
+            'multiplier': log['multiplier'].astype(float),
+            'expiry': pd.to_datetime(log['expiry_date']),
+            'was_assigned': log['was_assigned'].astype(bool),
+            'user': True,
+        }))
+    if derived:
+        settled = pd.DataFrame.from_records(derived)
+        frames.append(pd.DataFrame({
+            'symbol': settled['symbol'].astype(object),
+            'date': pd.to_datetime(settled['date']),
+            'order': _STOCK,
+            'type': 'stock',
+            'quantity': settled['quantity'].astype(float),
+            'strike': 0.0,
+            'premium': 0.0,
+            'price': settled['stock_price'].astype(float),
+            'commission': 0.0,
+            'multiplier': 1.0,
+            'expiry': pd.NaT,
+            'was_assigned': False,
+            'user': False,
+        }))
+    events = pd.concat(frames, ignore_index=True)
+    return events.sort_values(['symbol', 'date', 'order'], kind='stable').reset_index(drop=True)
+
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def _day(n: int) -> date:
+    return date.fromordinal(_EPOCH + n)
+
+
+class _Cycle:
+    """Accumulatori di un ciclo wheel aperto su un simbolo (date come giorni dal 1970)."""
+
+    def __init__(self, symbol: str, number: int, start: int):
+        self.symbol, self.number, self.start = symbol, number, start
+        self.last_trade = start
+        self.trades = self.puts_sold = self.calls_sold = 0
+        self.expired = self.assigned = 0
+        self.put_notional = self.dte_sum = self.premium_sold = 0.0
+        self.premium = self.commissions = self.stock_pnl = 0.0
+        self.capital = 0.0
+        self.had_shares = self.called_away = False
+
+    def row(self, end: Optional[int], as_of: int) -> Dict[str, Any]:
+        last = end if end is not None else as_of
+        days = max(1, last - self.start)
+        pnl = self.premium + self.stock_pnl - self.commissions
+        ret = pnl / self.capital if self.capital > 0 else 0.0
+        if end is None:
+            outcome = None
+        elif self.called_away:
+            outcome = 'called_away'
+        elif self.had_shares:
+            outcome = 'sold'
+        else:
+            outcome = 'expired'
+        return {
+            'symbol': self.symbol, 'cycle': self.number,
+            'start': _day(self.start), 'end': _day(end) if end is not None else None,
+            'last_trade': _day(self.last_trade),
+            'status': 'closed' if end is not None else 'open', 'outcome': outcome,
+            'trades': self.trades, 'puts_sold': self.puts_sold, 'calls_sold': self.calls_sold,
+            'put_notional': self.put_notional, 'dte_sum': self.dte_sum, 'premium_sold': self.premium_sold,
+            'expired': self.expired, 'assigned': self.assigned,
+            'premium': self.premium, 'commissions': self.commissions, 'stock_pnl': self.stock_pnl,
+            'pnl': pnl, 'capital': self.capital, 'days': days,
+            'return_pct': ret * 100,
+            'annualized_pct': ((1 + ret) ** (365 / days) - 1) * 100 if ret > -1 else -100.0,
+        }
+
+
+def _symbol_cycles(symbol: str, events: Dict[str, list], as_of: int,
+                   settle: bool = True) -> List[Dict[str, Any]]:
+    """
+    Macchina a stati di un simbolo: un ciclo inizia alla prima esposizione
+    (opzione o azioni) e si chiude a fine giornata quando non restano né opzioni
+    aperte né azioni. Con `settle` le assegnazioni del log delle scadenze muovono
+    le azioni allo strike, a meno che un trade di azioni inserito a mano nello
+    stesso giorno con la stessa quantità non le abbia già registrate; senza,
+    le azioni arrivano dai trade derivati del replay.
+    `events` ha una lista per colonna, già ordinata per (data, tipo di evento).
+    """
+    rows: List[Dict[str, Any]] = []
+    cycle: Optional[_Cycle] = None
+    shares = cost_basis = secured = 0.0
+    open_options = 0
+    manual = Counter((d, q) for d, q, o in zip(events['day'], events['quantity'], events['order'])
+                     if o == _STOCK)
+
+    def move_shares(qty: float, price: float) -> None:
+        nonlocal shares, cost_basis
+        if qty > 0:
+            total = shares + qty
+            cost_basis = (shares * cost_basis + qty * price) / total if total > 0 else 0.0
+        else:
+            # P&L realizzato sulle sole azioni possedute vendute (costo medio)
+            cycle.stock_pnl += min(-qty, max(shares, 0.0)) * (price - cost_basis)
+        shares += qty
+        if abs(shares) < 1e-9:
+            shares = cost_basis = 0.0
+        cycle.had_shares = True
+
+    days = events['day']
+    n = len(days)
+    for i, (day, order, kind, qty, strike, premium, price, commission, mult, expiry, has_expiry,
+            assigned, user) in enumerate(zip(
+                days, events['order'], events['type'], events['quantity'], events['strike'],
+                events['premium'], events['price'], events['commission'], events['multiplier'],
+                events['expiry'], events['has_expiry'], events['was_assigned'], events['user'])):
+        if cycle is None:
+            cycle = _Cycle(symbol, len(rows) + 1, day)
+
+        if order != _EXPIRY and user:
+            cycle.last_trade = day
+
+        if order == _OPTION:
+            cycle.trades += 1
+            cycle.commissions += commission
+            short = qty < 0
+            cycle.premium += abs(premium) if short else -abs(premium)
+            if short:
+                cycle.premium_sold += abs(premium)
+                cycle.dte_sum += (expiry if has_expiry else day) - day
+                if kind == 'put':
+                    cycle.puts_sold += 1
+                    cycle.put_notional += strike * abs(qty) * mult
+                else:
+                    cycle.calls_sold += 1
+            # le gambe senza scadenza valida non compaiono nel log: non restano aperte
+            if has_expiry and day <= expiry:
+                open_options += 1
+                if short and kind == 'put':
+                    secured += strike * abs(qty) * mult
+
+        elif order == _STOCK:
+            if user:
+                cycle.trades += 1
+                cycle.commissions += commission
+            move_shares(qty, price)
+
+        else:
+            open_options -= 1
+            cycle.expired += 1
+            if qty < 0 and kind == 'put':
+                secured -= strike * abs(qty) * mult
+            if assigned:
+                cycle.assigned += 1
+                delta = abs(qty) * mult * (1 if kind == 'put' else -1)
+                if settle:
+                    if manual[(day, delta)] > 0:
+                        manual[(day, delta)] -= 1
+                    else:
+                        move_shares(delta, strike)
+                if kind == 'call':
+                    cycle.called_away = True
+
+        # capitale impegnato: put coperte da contante + costo delle azioni in portafoglio
+        cycle.capital = max(cycle.capital, secured + max(shares, 0.0) * cost_basis)
+
+        day_end = i == n - 1 or days[i + 1] != day
+        if day_end and open_options <= 0 and shares == 0:
+            rows.append(cycle.row(day, as_of))
+            cycle, open_options, secured = None, 0, 0.0
+
+    if cycle is not None:
+        rows.append(cycle.row(None, as_of))
+    return rows
+
+
+def build_cycles(table: TradeTable, expired_log: pd.DataFrame,
+                 as_of: Optional[date] = None,
+                 derived: Optional[List[Dict]] = None) -> pd.DataFrame:
+    """
+    Registro dei cicli wheel (put venduta → assegnazione → covered call →
+    azioni chiamate via) per tutti i simboli: un ordinamento degli eventi e un
+    passaggio lineare per simbolo, O(n log n) in tutto. Una riga per ciclo con
+    durata, premi incassati, capitale impegnato (massimo di put coperte + costo
+    azioni), P&L realizzato e rendimento semplice e annualizzato; i cicli aperti
+    sono valutati al `as_of` (default oggi) con il solo P&L realizzato.
+    `derived` sono le azioni consegnate alle scadenze dal replay
+    (`PortfolioProcessor.derived_trades` non coperte da un trade dell'utente):
+    se date, sostituiscono lo spostamento di azioni dedotto dal log.
+    """
+    if table.empty:
+        return pd.DataFrame(columns=CYCLE_COLUMNS)
+    as_of_day = (as_of or date.today()).toordinal() - _EPOCH
+    events = _events(table, expired_log, derived)
+
+    # colonne come liste Python (giorni interi al posto delle date) e indice
+    # delle righe di ogni simbolo: il ciclo per evento non tocca più pandas
+    expiry = events['expiry'].to_numpy(dtype='datetime64[D]')
+    columns = {
+        'day': events['date'].to_numpy(dtype='datetime64[D]').astype(np.int64).tolist(),
+        'expiry': np.where(np.isnat(expiry), 0, expiry.astype(np.int64)).tolist(),
+        'has_expiry': (~np.isnat(expiry)).tolist(),
+    }
+    for col in ('order', 'type', 'quantity', 'strike', 'premium', 'price',
+                'commission', 'multiplier', 'was_assigned', 'user'):
+        columns[col] = events[col].tolist()
+    symbols, first = np.unique(events['symbol'].to_numpy(), return_index=True)
+    bounds = list(first) + [len(events)]
+
+    rows: List[Dict[str, Any]] = []
+    for k, symbol in enumerate(symbols):
+        lo, hi = bounds[k], bounds[k + 1]
+        rows.extend(_symbol_cycles(symbol, {c: v[lo:hi] for c, v in columns.items()}, as_of_day,
+                                   settle=derived is None))
+    return pd.DataFrame(rows, columns=CYCLE_COLUMNS)
@@ -6,6 +6,13 @@ from datetime import date, timedelta
 from typing import Dict, List, Tuple, Any, Optional
 import streamlit as st
 
+from drawdown import compute_drawdown
+from price_matrix import PriceMatrix
+from recovery import simulate_recovery
+from trade_store import TradeTable
+from twr import compute_twr
+from wheel_cycles import build_cycles
+
 class WheelMetricsCalculator:
     """
     Calcolatore di metriche avanzate per la strategia Wheel,
@@ -13,16 +20,34 @@ class WheelMetricsCalculator:
     """
     
     def __init__(self, trades: List[Dict], cash_flows: List[Dict], 
-                 portfolio_history: pd.DataFrame, expired_options: pd.DataFrame):
+                 portfolio_history: pd.DataFrame, expired_options: pd.DataFrame,
+                 trade_table: Optional[TradeTable] = None,
+                 symbol_pnl: Optional[pd.DataFrame] = None,
+                 prices: Optional[PriceMatrix] = None,
+                 derived_trades: Optional[List[Dict]] = None):
         self.all_trades = trades
+        self.trade_table = trade_table if trade_table is not None else TradeTable.from_records(trades)
         self.all_cash_flows = cash_flows
         self.all_portfolio_history = portfolio_history
         self.all_expired_options = expired_options
-        self.all_symbols = sorted(list(set(t['symbol'] for t in self.all_trades)))
+        self.all_symbols = self.trade_table.symbols
+        # P&L giornaliero per simbolo (date × simboli) dal replay del PortfolioProcessor
+        self.symbol_pnl = symbol_pnl
+        self.prices = prices
+        # azioni consegnate alle scadenze dal replay (assegnazioni ed esercizi)
+        self.derived_trades = derived_trades
+        # calcoli condivisi fra i simboli, fatti alla prima richiesta
+        self._cycles: Optional[pd.DataFrame] = None
+        self._stats: Optional[pd.DataFrame] = None
+        self._vol_score: Optional[float] = None
+        self._drawdown: Optional[Dict[str, Any]] = None
+        self._entry: Optional[pd.Series] = None
+        self._recovery: Optional[Dict[str, Any]] = None
+        self._memo: Dict[str, Dict[str, Any]] = {}
 
     def _filter_data_by_symbol(self, symbol: str) -> Tuple[List[Dict], List[Dict], pd.DataFrame, pd.DataFrame]:
         """Filtra tutti i dati necessari per un singolo simbolo."""
-        trades = [t for t in self.all_trades if t['symbol'] == symbol]
+        trades = self.trade_table.filter(symbol=symbol).records()
         
         # Nota: cash_flows e portfolio_history non sono direttamente filtrabili per simbolo
         # in quanto rappresentano dati a livello di portafoglio aggregato.
@@ -37,53 +62,81 @@ class WheelMetricsCalculator:
         
         return trades, cash_flows, portfolio_history, expired_options
 
+    @property
+    def cycles(self) -> pd.DataFrame:
+        """Registro dei cicli wheel di tutti i simboli (vedi `wheel_cycles.build_cycles`), costruito una volta."""
+        if self._cycles is None:
+            history = self.all_portfolio_history
+            as_of = history['date'].iloc[-1] if not history.empty else None
+            self._cycles = build_cycles(self.trade_table, self.all_expired_options, as_of,
+                                        self.derived_trades)
+        return self._cycles
+
+    def _symbol_stats(self) -> pd.DataFrame:
+        """
+        Componenti di WES e WCS per tutti i simboli, aggregando il registro dei
+        cicli (una riga per simbolo): premi incassati, capitale a rischio delle
+        put vendute, DTE medio, tasso di assegnazione e frequenza di trading.
+        Calcolato una volta.
+        """
+        if self._stats is not None:
+            return self._stats
+
+        cycles = self.cycles.assign(
+            sold=self.cycles['puts_sold'] + self.cycles['calls_sold'],
+            start=pd.to_datetime(self.cycles['start']),
+            last_trade=pd.to_datetime(self.cycles['last_trade']),
+        )
+        stats = cycles.groupby('symbol').agg(
+            trades=('trades', 'sum'), first_date=('start', 'min'), last_date=('last_trade', 'max'),
+            sold=('sold', 'sum'), premium_income=('premium_sold', 'sum'),
+            capital_at_risk=('put_notional', 'sum'), dte_sum=('dte_sum', 'sum'),
+            assigned=('assigned', 'sum'), expired=('expired', 'sum'),
+        ).astype({'assigned': float, 'expired': float})
+
+        has_sold = stats['sold'] > 0
+        has_capital = stats['capital_at_risk'] > 0
+        has_expired = stats['expired'] > 0
+        stats['avg_dte'] = np.where(has_sold, stats['dte_sum'] / stats['sold'].where(has_sold, 1), 0.0)
+        stats['time_factor'] = np.minimum(1.0, stats['avg_dte'] / 45)
+        stats['assignment_rate'] = np.where(has_expired, stats['assigned'] / stats['expired'].where(has_expired, 1), 0.0)
+        stats['premium_yield'] = np.where(
+            has_capital, stats['premium_income'] / stats['capital_at_risk'].where(has_capital, 1), 0.0)
+        stats['wes'] = stats['premium_yield'] * (1 - stats['assignment_rate']) * stats['time_factor'] * 100
+        days_range = (stats['last_date'] - stats['first_date']).dt.days
+        stats['trading_frequency'] = stats['trades'] / np.maximum(1, days_range / 30)
+        stats['frequency_score'] = np.minimum(1.0, stats['trading_frequency'] / 5)
+        stats['assignment_management'] = 1 - np.minimum(0.8, stats['assignment_rate'])
+
+        self._stats = stats
+        return stats
+
+    def _volatility_score(self) -> float:
+        """Volatilità dei rendimenti del portafoglio (proxy per il WCS), calcolata una volta."""
+        if self._vol_score is None:
+            if len(self.all_portfolio_history) > 1:
+                returns = self.all_portfolio_history['portfolio_value'].pct_change().dropna()
+                volatility = returns.std()
+                self._vol_score = max(0, 1 - volatility / 0.03)  # Normalizzato vs 3% daily std dev
+            else:
+                self._vol_score = 1
+        return self._vol_score
+
     def calculate_wheel_efficiency_score(self, symbol: str) -> Dict[str, Any]:
         """Calcola il WES per un singolo simbolo."""
-        trades, _, _, expired_options = self._filter_data_by_symbol(symbol)
-        
         try:
-            if not trades:
+            stats = self._symbol_stats()
+            if symbol not in stats.index:
                 return {"WES": 0, "components": {}, "explanation": "Nessun trade per questo simbolo"}
-            
-            puts_sold = [t for t in trades if t.get('type') == 'put' and t.get('quantity', 0) < 0]
-            calls_sold = [t for t in trades if t.get('type') == 'call' and t.get('quantity', 0) < 0]
-            
-            if not puts_sold and not calls_sold:
+            row = stats.loc[symbol]
+            if row['sold'] == 0:
                 return {"WES": 0, "components": {}, "explanation": "Nessuna opzione venduta per questo simbolo"}
-            
-            total_premium = sum(abs(t.get('premium', 0)) for t in puts_sold + calls_sold)
-            
-            capital_at_risk = 0
-            for t in puts_sold:
-                capital_at_risk += t.get('strike', 0) * abs(t.get('quantity', 0)) * t.get('multiplier', 100)
-            #for t in calls_sold:
-                #capital_at_risk += t.get('strike', 0) * abs(t.get('quantity', 0)) * t.get('multiplier', 100)
-
-            if expired_options.empty:
-                assignment_rate = 0
-            else:
-                assigned_count = expired_options['was_assigned'].sum()
-                total_expired = len(expired_options)
-                assignment_rate = assigned_count / total_expired if total_expired > 0 else 0
-            
-            avg_dte = 0
-            if puts_sold + calls_sold:
-                total_dte = sum((t.get('expiry', t.get('date')) - t.get('date')).days for t in puts_sold + calls_sold)
-                avg_dte = total_dte / len(puts_sold + calls_sold)
-            
-            time_factor = min(1.0, avg_dte / 45)
-            
-            if capital_at_risk > 0:
-                premium_yield = total_premium / capital_at_risk
-                wes = premium_yield * (1 - assignment_rate) * time_factor * 100
-            else:
-                wes = 0
-                premium_yield = 0
-                
+
+            wes = float(row['wes'])
             components = {
-                "premium_income": total_premium, "capital_at_risk": capital_at_risk,
-                "premium_yield": premium_yield * 100, "assignment_rate": assignment_rate * 100,
-                "avg_dte": avg_dte, "time_factor": time_factor
+                "premium_income": float(row['premium_income']), "capital_at_risk": float(row['capital_at_risk']),
+                "premium_yield": float(row['premium_yield']) * 100, "assignment_rate": float(row['assignment_rate']) * 100,
+                "avg_dte": float(row['avg_dte']), "time_factor": float(row['time_factor'])
             }
             
             return {"WES": wes, "components": components, "explanation": f"WES per {symbol}: {wes:.2f}%"}
@@ -91,19 +144,67 @@ class WheelMetricsCalculator:
         except Exception as e:
             return {"WES": 0, "components": {}, "explanation": f"Errore: {str(e)}"}
 
+    def _entry_capital(self) -> pd.Series:
+        """
+        Capitale impegnato all'ingresso nella wheel, per simbolo: nozionale della
+        prima put venduta (strike × quantità × moltiplicatore) o del primo acquisto di azioni.
+        """
+        if self._entry is not None:
+            return self._entry
+        df = self.trade_table.frame
+        put_sold = (df['type'] == 'put') & (df['quantity'] < 0)
+        stock_buy = (df['type'] == 'stock') & (df['quantity'] > 0)
+        notional = np.where(put_sold,
+                            df['strike'] * df['quantity'].abs() * df['multiplier'],
+                            df['quantity'] * df['stock_price'])
+        entries = pd.DataFrame({'symbol': df['symbol'], 'notional': notional})[(put_sold | stock_buy).to_numpy()]
+        self._entry = entries.groupby('symbol', observed=True)['notional'].first()
+        return self._entry
+
     def calculate_relative_opportunity_index(self, symbol: str) -> Dict[str, Any]:
         """
-        Confronta i rendimenti della strategia wheel per un simbolo con il buy-and-hold
-        dello stesso sottostante. Usa il P&L calcolato in `portfolio.py`.
+        Confronta il rendimento della strategia wheel per un simbolo con il buy-and-hold
+        dello stesso sottostante. Il P&L per simbolo è quello del replay in `portfolio.py`,
+        il rendimento è rispetto al capitale impegnato all'ingresso nella wheel.
         """
-        # Questa metrica rimane complessa da calcolare per simbolo senza un P&L per simbolo.
-        # Si consiglia di calcolare il P&L per simbolo in PortfolioProcessor e passarlo qui.
-        # Per ora, restituiamo un placeholder.
-        return {
-            "ROI": "N/A", 
-            "components": {"main_symbol": symbol},
-            "explanation": "Il calcolo del ROI per simbolo richiede il P&L specifico per simbolo (da implementare)."
+        if self.symbol_pnl is None or symbol not in self.symbol_pnl.columns:
+            return {
+                "ROI": "N/A", 
+                "components": {"main_symbol": symbol},
+                "explanation": "Il calcolo del ROI per simbolo richiede il P&L specifico per simbolo."
+            }
+
+        wheel_pnl = float(self.symbol_pnl[symbol].iloc[-1])
+        capital = float(self._entry_capital().get(symbol, 0.0))
+        if capital <= 0:
+            return {
+                "ROI": "N/A",
+                "components": {"main_symbol": symbol, "wheel_pnl": wheel_pnl},
+                "explanation": f"Nessuna put venduta o acquisto di azioni su {symbol}: capitale impegnato non definito."
+            }
+        wheel_return = wheel_pnl / capital * 100
+
+        stats = self._symbol_stats()
+        start = stats.loc[symbol, 'first_date'].date()
+        end = self.symbol_pnl.index[-1]
+        start_price = self.prices.price(symbol, start) if self.prices is not None else 0.0
+        end_price = self.prices.price(symbol, end) if self.prices is not None else 0.0
+        if start_price > 0:
+            buy_hold_return = (end_price / start_price - 1) * 100
+            roi = wheel_return - buy_hold_return
+            explanation = (f"{symbol}: wheel {wheel_return:+.2f}% vs buy & hold {buy_hold_return:+.2f}% "
+                           f"→ {roi:+.2f} punti")
+        else:
+            buy_hold_return = None
+            roi = "N/A"
+            explanation = f"{symbol}: wheel {wheel_return:+.2f}%, prezzi non disponibili per il buy & hold"
+
+        components = {
+            "main_symbol": symbol, "wheel_pnl": wheel_pnl, "capital": capital,
+            "wheel_return": wheel_return, "buy_hold_return": buy_hold_return,
+            "period_days": (end - start).days
         }
+        return {"ROI": roi, "components": components, "explanation": explanation}
         
     def calculate_drawdown_tracker(self, symbol: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -117,92 +218,103 @@ class WheelMetricsCalculator:
         # La mostriamo identica per tutti ma specifichiamo il contesto.
         explanation_prefix = f"Drawdown a livello di portafoglio (mostrato per il contesto di {symbol})" if symbol else "Drawdown a livello di portafoglio"
         
-        equity_line = self.all_portfolio_history['equity_line_pnl']
-        running_max = equity_line.cummax()
-        drawdown = running_max - equity_line
-        
-        initial_capital = abs(self.all_portfolio_history['cumulative_cash_flow'].iloc[0])
-        drawdown_pct = (drawdown / initial_capital) * 100 if initial_capital > 0 else pd.Series([0] * len(drawdown))
-        
-        max_drawdown = drawdown.max()
-        max_drawdown_pct = drawdown_pct.max()
-        
-        in_drawdown = drawdown > 0
-        drawdown_periods = []
-        current_period = 0
-        for is_dd in in_drawdown:
-            if is_dd:
-                current_period += 1
-            elif current_period > 0:
-                drawdown_periods.append(current_period)
-                current_period = 0
-        if current_period > 0:
-            drawdown_periods.append(current_period)
-        
-        avg_drawdown_duration = np.mean(drawdown_periods) if drawdown_periods else 0
-        max_drawdown_duration = max(drawdown_periods) if drawdown_periods else 0
-        
-        return {
+        if self._drawdown is None:
+            history = self.all_portfolio_history
+            initial_capital = abs(history['cumulative_cash_flow'].iloc[0])
+            self._drawdown = compute_drawdown(history['equity_line_pnl'], history['date'], base=initial_capital)
+        dd = self._drawdown
+        max_drawdown, max_drawdown_pct = dd["max_drawdown"], dd["max_drawdown_pct"]
+
+        result = {
             "drawdown_metrics": {
                 "max_drawdown_dollar": max_drawdown, "max_drawdown_pct": max_drawdown_pct,
-                "avg_drawdown_duration": avg_drawdown_duration, "max_drawdown_duration": max_drawdown_duration,
-                "current_drawdown": drawdown.iloc[-1] if not drawdown.empty else 0
+                "avg_drawdown_duration": dd["avg_duration"], "max_drawdown_duration": dd["max_duration"],
+                "current_drawdown": dd["current_drawdown"]
             },
-            "drawdown_series": drawdown,
+            "drawdown_series": dd["drawdown"],
+            "drawdown_episodes": dd["episodes"],
             "explanation": f"{explanation_prefix}: Max DD ${max_drawdown:.2f} ({max_drawdown_pct:.2f}%)"
         }
 
+        # drawdown del solo simbolo, sulla sua colonna della matrice P&L
+        if symbol and self.symbol_pnl is not None and symbol in self.symbol_pnl.columns:
+            pnl = self.symbol_pnl[symbol]
+            sym_dd = compute_drawdown(pnl.reset_index(drop=True), pnl.index,
+                                      base=float(self._entry_capital().get(symbol, 0.0)))
+            result["symbol_drawdown_metrics"] = {
+                "max_drawdown_dollar": sym_dd["max_drawdown"], "max_drawdown_pct": sym_dd["max_drawdown_pct"],
+                "avg_drawdown_duration": sym_dd["avg_duration"], "max_drawdown_duration": sym_dd["max_duration"],
+                "current_drawdown": sym_dd["current_drawdown"]
+            }
+            result["symbol_drawdown_episodes"] = sym_dd["episodes"]
+        return result
+
     def calculate_recovery_probability(self, symbol: Optional[str] = None) -> Dict[str, Any]:
         """
-        Stima la probabilità di recupero. Metrica di portafoglio, mostrata per contesto.
+        Stima la probabilità di recupero dal drawdown corrente con un Monte Carlo
+        a blocchi sui rendimenti giornalieri (TWR) dello storico.
+        Metrica di portafoglio: simulata una volta, mostrata per contesto.
         """
         # Anche questa è una metrica di portafoglio
         if self.all_portfolio_history.empty:
             return {"recovery_prob": 0, "components": {}, "explanation": "Storico vuoto"}
 
-        equity_line = self.all_portfolio_history['equity_line_pnl']
-        
-        # Logica di calcolo identica a prima, è una metrica di portafoglio
-        # ... (la logica può essere copiata dalla tua versione originale)
+        if self._recovery is None:
+            history = self.all_portfolio_history
+            current_drawdown = self.calculate_drawdown_tracker()["drawdown_metrics"]["current_drawdown"]
+            returns = compute_twr(history, self.all_cash_flows)["daily"]
+            self._recovery = simulate_recovery(returns, current_drawdown,
+                                               float(history['portfolio_value'].iloc[-1]))
+            self._recovery["current_drawdown"] = current_drawdown
+        sim = self._recovery
+
+        probabilities = sim["probabilities"]
+        prob = probabilities[sim["horizon"]] * 100
+        components = {
+            "symbol": symbol,
+            "current_drawdown": sim["current_drawdown"],
+            "target_return": sim["target_return"] * 100,
+            "probabilities": {h: p * 100 for h, p in probabilities.items()},
+            "expected_days": sim["expected_days"], "median_days": sim["median_days"],
+            "n_paths": sim["n_paths"], "block": sim["block"]
+        }
+        if sim["current_drawdown"] <= 0:
+            explanation = "Portafoglio sui massimi: nessun drawdown da recuperare."
+        elif sim["expected_days"] is None:
+            explanation = f"Recupero di ${sim['current_drawdown']:.2f} mai raggiunto in {sim['horizon']} giorni simulati."
+        else:
+            explanation = (f"Probabilità di recuperare ${sim['current_drawdown']:.2f} entro {sim['horizon']} giorni: "
+                           f"{prob:.1f}% (tempo atteso {sim['expected_days']:.0f} giorni)")
         
         return {
-            "recovery_prob": "N/A", 
-            "components": {"symbol": symbol},
-            "explanation": "Metrica di recupero a livello di portafoglio."
+            "recovery_prob": prob, 
+            "components": components,
+            "explanation": explanation
         }
 
     def calculate_wheel_continuation_score(self, symbol: str) -> Dict[str, Any]:
         """Calcola il WCS per un singolo simbolo."""
-        trades, _, _, expired_options = self._filter_data_by_symbol(symbol)
-
         try:
-            if not trades:
+            stats = self._symbol_stats()
+            if symbol not in stats.index:
                 return {"WCS": 0, "components": {}, "explanation": "Nessun trade per il simbolo"}
+            row = stats.loc[symbol]
 
             # Performance Trend (difficile per simbolo senza P&L per simbolo)
             performance_trend = 0  # Placeholder
 
             # Volatilità dei rendimenti (metrica di portafoglio, usata come proxy)
-            if len(self.all_portfolio_history) > 1:
-                returns = self.all_portfolio_history['portfolio_value'].pct_change().dropna()
-                volatility = returns.std()
-                volatility_score = max(0, 1 - volatility / 0.03) # Normalizzato vs 3% daily std dev
-            else:
-                volatility_score = 1
-            
-            days_range = (max(t['date'] for t in trades) - min(t['date'] for t in trades)).days if trades else 0
-            trading_frequency = len(trades) / max(1, days_range / 30)
-            frequency_score = min(1.0, trading_frequency / 5) # Normalizzato a 5 trades/mese/simbolo
+            volatility_score = self._volatility_score()
+
+            # Normalizzato a 5 trades/mese/simbolo
+            trading_frequency = float(row['trading_frequency'])
+            frequency_score = float(row['frequency_score'])
 
             # Diversificazione non applicabile per singolo simbolo
             diversification_score = 1.0
 
-            if expired_options.empty:
-                assignment_management = 1.0
-                assignment_rate = 0
-            else:
-                assignment_rate = expired_options['was_assigned'].mean()
-                assignment_management = 1 - min(0.8, assignment_rate)
+            assignment_rate = float(row['assignment_rate'])
+            assignment_management = float(row['assignment_management'])
 
             wcs = (
                 (performance_trend + 1) / 2 * 0.2 +
@@ -225,19 +337,22 @@ class WheelMetricsCalculator:
         except Exception as e:
             return {"WCS": 0, "components": {}, "explanation": f"Errore: {str(e)}"}
 
-    def calculate_all_metrics_by_symbol(self) -> Dict[str, Dict[str, Any]]:
-        """Calcola tutte le metriche per ogni simbolo nel portafoglio."""
-        all_metrics = {}
-        for symbol in self.all_symbols:
-            # Le metriche che sono solo a livello di portafoglio vengono calcolate una volta
-            drawdown_metrics = self.calculate_drawdown_tracker(symbol)
-            recovery_metrics = self.calculate_recovery_probability(symbol)
-
-            all_metrics[symbol] = {
+    def metrics_for_symbol(self, symbol: str) -> Dict[str, Any]:
+        """
+        Tutte le metriche di un simbolo, calcolate alla prima richiesta e poi
+        riprese dalla memo: la vista per simbolo non calcola gli altri simboli.
+        """
+        if symbol not in self._memo:
+            self._memo[symbol] = {
                 "wes": self.calculate_wheel_efficiency_score(symbol),
                 "roi": self.calculate_relative_opportunity_index(symbol),
-                "drawdown": drawdown_metrics,
-                "recovery": recovery_metrics,
-                "wcs": self.calculate_wheel_continuation_score(symbol)
+                "drawdown": self.calculate_drawdown_tracker(symbol),
+                "recovery": self.calculate_recovery_probability(symbol),
+                "wcs": self.calculate_wheel_continuation_score(symbol),
+                "cycles": self.cycles[self.cycles['symbol'] == symbol].reset_index(drop=True)
             }
-        return all_metrics
+        return self._memo[symbol]
+
+    def calculate_all_metrics_by_symbol(self) -> Dict[str, Dict[str, Any]]:
+        """Calcola tutte le metriche per ogni simbolo nel portafoglio."""
+        return {symbol: self.metrics_for_symbol(symbol) for symbol in self.all_symbols}
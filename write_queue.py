@@ -0,0 +1,126 @@
+# write_queue.py
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+WriteFn = Callable[[str, List[Dict]], None]
+
+
+class WriteBehindQueue:
+    """
+    Buffer write-behind per gli upsert su Supabase.
+    I record in attesa sono indicizzati per (tabella, id): accodare due volte lo
+    stesso id tiene solo l'ultima versione, e l'upsert sul server è idempotente.
+    Lo svuotamento manda un unico upsert multi-riga per tabella e avviene:
+     - quando i record in attesa raggiungono `max_batch`;
+     - `max_delay` secondi dopo il primo record accodato (timer in background);
+     - su richiesta esplicita con `flush()`.
+    Un batch fallito resta in coda e viene ritentato con backoff esponenziale;
+    dopo `max_retries` tentativi i record passano tra i falliti, da cui
+    `retry_failed()` li rimette in coda.
+    """
+
+    def __init__(self, write: WriteFn, max_batch: int = 50, max_delay: float = 5.0,
+                 max_retries: int = 3, base_delay: float = 1.0):
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.last_error: Optional[Exception] = None
+        self._pending: Dict[Tuple[str, str], Dict] = {}
+        self._attempts: Dict[str, int] = {}
+        self._failed: Dict[Tuple[str, str], Dict] = {}
+        self._lock = threading.RLock()
+        self._flushing = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def failed_count(self) -> int:
+        return len(self._failed)
+
+    def enqueue(self, table: str, record: Dict) -> None:
+        """Accoda un record (deve avere `id`) per `table`."""
+        key = (table, str(record["id"]))
+        with self._lock:
+            self._pending[key] = record
+            self._failed.pop(key, None)
+            full = len(self._pending) >= self.max_batch
+            if not full:
+                self._schedule(self.max_delay)
+        if full:
+            self.flush()
+
+    def _schedule(self, delay: float) -> None:
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self) -> bool:
+        """Invia subito tutti i record in attesa. True se la coda è vuota al termine."""
+        with self._flushing:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                batch = dict(self._pending)
+            by_table: Dict[str, List[Tuple[Tuple[str, str], Dict]]] = {}
+            for key, record in batch.items():
+                by_table.setdefault(key[0], []).append((key, record))
+
+            retry = False
+            for table, items in by_table.items():
+                try:
+                    self.write(table, [record for _, record in items])
+                except Exception as e:
+                    self.last_error = e
+                    with self._lock:
+                        attempts = self._attempts.get(table, 0) + 1
+                        self._attempts[table] = attempts
+                        if attempts >= self.max_retries:
+                            self._attempts.pop(table, None)
+                            for key, record in items:
+                                # una versione più recente accodata nel frattempo resta in attesa
+                                if self._pending.get(key) is record:
+                                    del self._pending[key]
+                                    self._failed[key] = record
+                        else:
+                            retry = True
+                else:
+                    with self._lock:
+                        self._attempts.pop(table, None)
+                        for key, record in items:
+                            if self._pending.get(key) is record:
+                                del self._pending[key]
+            if retry:
+                attempts = max(self._attempts.values(), default=1)
+                self._schedule(self.base_delay * 2 ** (attempts - 1))
+            elif self._pending:
+                self._schedule(self.max_delay)
+            return not self._pending
+
+    def retry_failed(self) -> bool:
+        """Rimette in coda i record falliti e prova subito a inviarli."""
+        with self._lock:
+            self._pending.update(self._failed)
+            self._failed.clear()
+        return self.flush()
+
+    def wait(self, timeout: float = 10.0) -> None:
+        """Svuota la coda ritentando finché possibile (es. prima di un logout)."""
+        deadline = time.monotonic() + timeout
+        while not self.flush() and self._pending and time.monotonic() < deadline:
+            time.sleep(min(self.base_delay, max(0.0, deadline - time.monotonic())))